@@ -0,0 +1,94 @@
+# coding: utf-8
+DEBUG=False
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from hashing import HASH_ALGORITHMS, compute_file_hash, get_hasher, read_buffer_size
+
+
+# HASHING BENCHMARK
+# Compare le débit des différents chemins de hachage d'un gros fichier
+# au "plafond" de hashlib (hachage du même volume déjà en mémoire) :
+#   8k-read : l'ancien chemin, f.read(8192) (un appel Python tous les 8 Ko)
+#   readinto : buffer réutilisé, dimensionné selon la taille du fichier
+#   mmap : fichier projeté en mémoire
+# Le fichier de test vient d'être écrit : il est dans le cache du système,
+# on mesure donc le coût CPU du chemin de lecture, pas le disque.
+# Usage : python bench_hashing.py [--size-mb 512] [--repeat 3] [fichier]
+
+MIB = 1024 * 1024
+
+
+def hash_read_8k(file_path, algorithm):
+    """
+    The former hashing path, for reference.
+    """
+    hasher = get_hasher(algorithm)
+    with open(file_path, "rb") as f:
+        while chunk := f.read(8192):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_ceiling(data, algorithm, chunk_size):
+    """
+    hashlib alone, on data already in memory: the best a hashing path can do.
+    """
+    hasher = get_hasher(algorithm)
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        hasher.update(view[offset:offset+chunk_size])
+    return hasher.hexdigest()
+
+
+def best_time(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmark(file_path, repeat=3):
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as f:
+        data = f.read()
+    print(f"File: {file_path} ({file_size / MIB:.0f} MiB), read buffer: {read_buffer_size(file_size) // 1024} KiB, "
+          f"best of {repeat}")
+    print(f"{'algorithm':10} {'path':10} {'MiB/s':>8} {'ceiling':>8}")
+    for algorithm in HASH_ALGORITHMS:
+        ceiling = best_time(lambda: hash_ceiling(data, algorithm, read_buffer_size(file_size)), repeat)
+        paths = {
+            "hashlib": ceiling,
+            "8k-read": best_time(lambda: hash_read_8k(file_path, algorithm), repeat),
+            "readinto": best_time(lambda: compute_file_hash(file_path, algorithm=algorithm), repeat),
+            "mmap": best_time(lambda: compute_file_hash(file_path, algorithm=algorithm, use_mmap=True), repeat),
+        }
+        for name, seconds in paths.items():
+            print(f"{algorithm:10} {name:10} {file_size / MIB / seconds:8.0f} {ceiling / seconds:8.0%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the file hashing paths against hashlib's ceiling.")
+    parser.add_argument("file", nargs="?", help="file to hash (default: a temporary file of --size-mb)")
+    parser.add_argument("--size-mb", type=int, default=512, help="size of the temporary file")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path (the best one is kept)")
+    args = parser.parse_args()
+
+    if args.file:
+        run_benchmark(args.file, args.repeat)
+        sys.exit()
+    with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as f:
+        file_path = f.name
+        block = os.urandom(MIB)
+        for _ in range(args.size_mb):
+            f.write(block)
+    try:
+        run_benchmark(file_path, args.repeat)
+    finally:
+        os.remove(file_path)
@@ -0,0 +1,86 @@
+# coding: utf-8
+DEBUG=False
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from transfer import COPY_STRATEGIES, copy_file
+
+
+# TRANSFER BENCHMARK
+# Compare le débit de chaque stratégie de copie de transfer.py à celui de shutil.copyfile,
+# sur un même fichier copié vers un dossier de destination (par défaut, un dossier temporaire ;
+# passer le point de montage du disque de sauvegarde pour mesurer le cas réel).
+# Une stratégie indisponible ici (reflink hors btrfs/XFS...) est signalée et ignorée.
+# Le fichier source est dans le cache du système : on mesure le chemin de copie
+# et l'écriture, pas la lecture du disque source.
+# La destination est supprimée avant chaque copie : remplacer un fichier existant par
+# os.replace force l'écriture de ses données sur certains systèmes de fichiers (ext4),
+# ce qui mesurerait le disque et non le chemin de copie.
+# Usage : python bench_transfer.py [--size-mb 512] [--repeat 3] [--dest dossier] [fichier]
+
+MIB = 1024 * 1024
+
+
+def best_time(function, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmark(file_path, dest_dir, repeat=3):
+    file_size = os.path.getsize(file_path)
+    dst_path = os.path.join(dest_dir, "bench_transfer.out")
+    print(f"File: {file_path} ({file_size / MIB:.0f} MiB) -> {dest_dir}, best of {repeat}")
+    print(f"{'path':16} {'MiB/s':>8} {'baseline':>9}")
+
+    def remove_destination():
+        if os.path.exists(dst_path):
+            os.remove(dst_path)
+
+    try:
+        baseline = best_time(lambda: shutil.copyfile(file_path, dst_path), repeat, remove_destination)
+        print(f"{'shutil.copyfile':16} {file_size / MIB / baseline:8.0f} {1:9.0%}")
+        for strategy in COPY_STRATEGIES:
+            try:
+                copy_file(file_path, dst_path, strategies=(strategy,))
+            except OSError as e:
+                print(f"{strategy:16} unavailable: {e}")
+                continue
+            seconds = best_time(lambda: copy_file(file_path, dst_path, strategies=(strategy,)), repeat, remove_destination)
+            print(f"{strategy:16} {file_size / MIB / seconds:8.0f} {baseline / seconds:9.0%}")
+    finally:
+        remove_destination()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the copy strategies against shutil.copyfile.")
+    parser.add_argument("file", nargs="?", help="file to copy (default: a temporary file of --size-mb)")
+    parser.add_argument("--size-mb", type=int, default=512, help="size of the temporary file")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per path (the best one is kept)")
+    parser.add_argument("--dest", help="destination directory (default: a temporary directory)")
+    args = parser.parse_args()
+
+    dest_dir = args.dest or tempfile.mkdtemp()
+    os.makedirs(dest_dir, exist_ok=True)
+    if args.file:
+        run_benchmark(args.file, dest_dir, args.repeat)
+        sys.exit()
+    with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as f:
+        file_path = f.name
+        block = os.urandom(MIB)
+        for _ in range(args.size_mb):
+            f.write(block)
+    try:
+        run_benchmark(file_path, dest_dir, args.repeat)
+    finally:
+        os.remove(file_path)
@@ -0,0 +1,153 @@
+# coding: utf-8
+DEBUG=False
+
+import sqlite3
+
+from hashing import LEGACY_HASH_ALGORITHM
+
+
+# CONTENT INDEX
+# Index du contenu de tous les dossiers suivis : empreinte -> [(dossier, côté, fichier)],
+# stocké dans Folder_Data.db. Il répond à "quels fichiers sont en double, et combien
+# de place gagnerait-on à dédupliquer ?" sans rien rescanner.
+# Il est tenu à jour à partir des fichiers de suivi (offline_filesync_data.db) :
+# un côté dont la racine Merkle n'a pas changé est ignoré, sinon seules les lignes
+# modifiées sont réécrites.
+# Seuls les fichiers dont l'empreinte complète est connue sont indexés ; deux fichiers
+# hachés avec des algorithmes différents ne sont jamais considérés comme identiques.
+
+SIDES = ("local", "remote")
+# tracked_files rows worth indexing (run against the attached tracking file)
+INDEXABLE_FILES = f"""
+    SELECT filename, coalesce(hash_algo, '{LEGACY_HASH_ALGORITHM}') AS hash_algo, hash, coalesce(size, 0) AS size
+    FROM tracking.tracked_files
+    WHERE status NOT IN ('deleted', 'error') AND hash != ''
+"""
+
+
+class ContentIndex:
+    """
+    Cross-folder index of the file hashes, for the duplicates report.
+    """
+    def __init__(self, db_filepath):
+        self.__db_filepath = db_filepath
+        self.initialize()
+
+    def initialize(self):
+        with sqlite3.connect(self.__db_filepath, timeout=30) as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS content_index (
+                    foldername TEXT NOT NULL,
+                    side TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    hash_algo TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    PRIMARY KEY (foldername, side, filename)
+                )
+            """) # nb - side: 'local' or 'remote'
+            connection.execute("CREATE INDEX IF NOT EXISTS content_index_hash ON content_index (hash_algo, hash)")
+            # Merkle root hash of each side when it was last indexed
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS content_index_state (
+                    foldername TEXT NOT NULL,
+                    side TEXT NOT NULL,
+                    root_hash TEXT,
+                    PRIMARY KEY (foldername, side)
+                )
+            """)
+
+    def update_folder(self, foldername, side, tracking_filepath, root_hash):
+        """
+        Bring the index of one side of a folder up to date with its tracking file.
+        Nothing is done if its Merkle 'root_hash' didn't change since the last update.
+        Returns the number of index rows written or removed.
+        """
+        if side not in SIDES:
+            raise ValueError(f"Unknown side: {side}")
+        connection = sqlite3.connect(self.__db_filepath, timeout=30)
+        try:
+            row = connection.execute("SELECT root_hash FROM content_index_state WHERE foldername = ? AND side = ?",
+                                     (foldername, side)).fetchone()
+            if row is not None and row[0] == root_hash:
+                return 0
+            connection.execute("ATTACH DATABASE ? AS tracking", (tracking_filepath,))
+            with connection:
+                removed = connection.execute(f"""
+                    DELETE FROM content_index WHERE foldername = ? AND side = ?
+                    AND filename NOT IN (SELECT filename FROM ({INDEXABLE_FILES}))
+                """, (foldername, side)).rowcount
+                written = connection.execute(f"""
+                    INSERT OR REPLACE INTO content_index (foldername, side, filename, hash_algo, hash, size)
+                    SELECT ?, ?, t.filename, t.hash_algo, t.hash, t.size FROM ({INDEXABLE_FILES}) AS t
+                    WHERE NOT EXISTS (SELECT 1 FROM content_index AS c
+                                      WHERE c.foldername = ? AND c.side = ? AND c.filename = t.filename
+                                      AND c.hash_algo = t.hash_algo AND c.hash = t.hash AND c.size = t.size)
+                """, (foldername, side, foldername, side)).rowcount
+                connection.execute("INSERT OR REPLACE INTO content_index_state (foldername, side, root_hash) VALUES (?, ?, ?)",
+                                   (foldername, side, root_hash))
+            connection.execute("DETACH DATABASE tracking")
+        finally:
+            connection.close()
+        if DEBUG:
+            print(f"Content index of {foldername} ({side}): {written} rows written, {removed} removed")
+        return written + removed
+
+    def rename_folder(self, foldername, new_name):
+        with sqlite3.connect(self.__db_filepath, timeout=30) as connection:
+            connection.execute("UPDATE content_index SET foldername = ? WHERE foldername = ?", (new_name, foldername))
+            connection.execute("UPDATE content_index_state SET foldername = ? WHERE foldername = ?", (new_name, foldername))
+
+    def remove_folder(self, foldername):
+        with sqlite3.connect(self.__db_filepath, timeout=30) as connection:
+            connection.execute("DELETE FROM content_index WHERE foldername = ?", (foldername,))
+            connection.execute("DELETE FROM content_index_state WHERE foldername = ?", (foldername,))
+
+    def get_duplicates(self, side="local", min_size=1):
+        """
+        Groups of files with the same content, on one side of all the folders.
+        Returns a list of {"hash_algo", "hash", "size", "files": [(foldername, filename)], "wasted"},
+        the groups wasting the most space first ("wasted": bytes saved by keeping a single copy).
+        """
+        groups = {}
+        with sqlite3.connect(self.__db_filepath, timeout=30) as connection:
+            rows = connection.execute("""
+                SELECT c.hash_algo, c.hash, c.size, c.foldername, c.filename FROM content_index AS c
+                JOIN (SELECT hash_algo, hash FROM content_index WHERE side = ? AND size >= ?
+                      GROUP BY hash_algo, hash HAVING count(*) > 1) AS d
+                ON c.hash_algo = d.hash_algo AND c.hash = d.hash
+                WHERE c.side = ?
+                ORDER BY c.foldername, c.filename
+            """, (side, min_size, side))
+            for hash_algo, file_hash, size, foldername, filename in rows:
+                group = groups.setdefault((hash_algo, file_hash), {"hash_algo": hash_algo, "hash": file_hash,
+                                                                   "size": size, "files": []})
+                group["files"].append((foldername, filename))
+        for group in groups.values():
+            group["wasted"] = (len(group["files"]) - 1) * group["size"]
+        return sorted(groups.values(), key=lambda group: group["wasted"], reverse=True)
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
+
+def format_duplicates_report(groups, max_groups=50):
+    """
+    Plain text report of get_duplicates() results.
+    """
+    if not groups:
+        return "No duplicated files."
+    wasted = sum(group["wasted"] for group in groups)
+    copies = sum(len(group["files"]) for group in groups)
+    lines = [f"{len(groups)} duplicated contents, {copies} files: deduplication would save {format_size(wasted)}.", ""]
+    for group in groups[:max_groups]:
+        lines.append(f"{len(group['files'])} x {format_size(group['size'])} ({group['hash_algo']}:{group['hash'][:16]})")
+        lines += [f"    [{foldername}] {filename}" for foldername, filename in group["files"]]
+    if len(groups) > max_groups:
+        lines += ["", f"... and {len(groups) - max_groups} more."]
+    return "\n".join(lines)
@@ -23,6 +23,8 @@ else:
 
 from models import RepoModel
 from views import MainWindow
+from contentindex import format_duplicates_report
+from sync import format_plan_summary, format_sync_report
 
 class MainController:
     def __init__(self, 
@@ -44,16 +46,28 @@ class MainController:
         self.view.removefolderbutton.clicked.connect(self.remove_folder)
         self.view.changenamebutton.clicked.connect(self.change_foldername)
         self.view.changepathbutton.clicked.connect(self.change_paths)
+        self.view.syncbutton.clicked.connect(self.sync_folder)
         self.view.add_action.triggered.connect(self.add_folder)
         self.view.remove_action.triggered.connect(self.remove_folder)
         self.view.edit_action.triggered.connect(self.remove_folder)
+        self.view.duplicates_action.triggered.connect(self.show_duplicates_report)
 
 
 
     def folder_selection_changed(self, new_folder_name):
         if DEBUG:
             print(f"Folder selection changed: {new_folder_name}")
+        previous_folder = self.repo_model.get_selected_folder()
         self.repo_model.set_selected_folder(new_folder_name=new_folder_name)
+        # the selected folder is watched, so that its syncs only rescan the paths changed meanwhile
+        if previous_folder and previous_folder != new_folder_name:
+            self.repo_model.unwatch_folder(previous_folder)
+        if new_folder_name:
+            try:
+                self.repo_model.watch_folder(new_folder_name)
+            except (ValueError, OSError) as e:
+                if DEBUG:
+                    print(f"Cannot watch {new_folder_name}: {e}")
 
 
     def add_folder(self):
@@ -74,7 +88,10 @@ class MainController:
             if DEBUG:
                 print("Deletion confirmed.")
             delete_tracking_files = True
-            self.repo_model.remove_folder_from_db(self.repo_model.get_selected_folder(), delete_tracking_files=delete_tracking_files)
+            foldername = self.repo_model.get_selected_folder()
+            if foldername:
+                self.repo_model.unwatch_folder(foldername)
+            self.repo_model.remove_folder_from_db(foldername, delete_tracking_files=delete_tracking_files)
         else:
             if DEBUG:
                 print("Deletion cancelled.")
@@ -90,6 +107,34 @@ class MainController:
                                         new_name=new_foldername)
 
 
+    def sync_folder(self):
+        if DEBUG:
+            print(type(self).__name__+".sync_folder()")
+        foldername = self.repo_model.get_selected_folder()
+        try:
+            plan = self.repo_model.plan_sync(foldername)
+        except ValueError as e:
+            self.view.show_report("Sync", f"Cannot sync {foldername}: {e}")
+            return
+        if not plan:
+            self.view.show_report("Sync Report", format_sync_report([]))
+            return
+        plan, estimate = self.repo_model.dry_run_sync(foldername, plan=plan)
+        confirmation = self.view.prompt_confirmation(f"sync '{foldername}': {format_plan_summary(plan, estimate)}")
+        if confirmation:
+            results = self.repo_model.sync_folder(foldername, plan=plan)
+            self.view.show_report("Sync Report", format_sync_report(results))
+        elif DEBUG:
+            print("Sync cancelled.")
+
+
+    def show_duplicates_report(self):
+        if DEBUG:
+            print(type(self).__name__+".show_duplicates_report()")
+        groups = self.repo_model.get_duplicates()
+        self.view.show_report("Duplicates Report", format_duplicates_report(groups))
+
+
     def change_paths(self):
         # TODO!(0)
         if DEBUG:
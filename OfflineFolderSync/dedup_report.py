@@ -0,0 +1,25 @@
+# coding: utf-8
+DEBUG=False
+
+import argparse
+
+from models import RepoModel
+from contentindex import SIDES, format_duplicates_report
+
+
+# DUPLICATES REPORT
+# Rapport des fichiers en double entre tous les dossiers suivis, sans interface graphique :
+# l'index de contenu est mis à jour depuis les fichiers de suivi (rien n'est rescanné).
+# Usage : python dedup_report.py [--side local|remote] [--min-size 1] [--max-groups 50]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the files duplicated across the tracked folders.")
+    parser.add_argument("--side", choices=SIDES, default="local", help="side of the folders to compare")
+    parser.add_argument("--min-size", type=int, default=1, help="ignore files smaller than this (bytes)")
+    parser.add_argument("--max-groups", type=int, default=50, help="number of duplicate groups listed")
+    args = parser.parse_args()
+
+    repo_model = RepoModel()
+    groups = repo_model.get_duplicates(side=args.side, min_size=args.min_size)
+    print(format_duplicates_report(groups, max_groups=args.max_groups))
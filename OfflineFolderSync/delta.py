@@ -0,0 +1,260 @@
+# coding: utf-8
+DEBUG=False
+
+import hashlib
+import mmap
+import os
+import shutil
+import zlib
+
+
+# DELTA TRANSFER
+# Mise à jour d'un gros fichier déjà présent à destination en n'écrivant que ce qui a changé
+# (image disque, base de données, machine virtuelle...). Les deux côtés sont des disques locaux :
+# le gain n'est pas le réseau, comme pour rsync, mais les écritures sur le disque de sauvegarde.
+# 1. "delta-inplace" : les blocs alignés de la source et de l'ancienne copie sont comparés,
+#    seuls les blocs différents sont réécrits (modification sur place, ajout en fin de fichier,
+#    troncature) : dans un clone copy-on-write de la copie, renommé une fois complet, quand le
+#    système de fichiers le permet (reflink), sinon directement dans la copie, au prix d'une copie
+#    à moitié à jour si la mise à jour est interrompue. Jamais dans un fichier qui a d'autres liens
+#    physiques : la modification les atteindrait aussi ; il est reconstruit comme en 2.
+# 2. "delta" : si trop de blocs alignés diffèrent (données décalées par un ajout ou une suppression),
+#    les blocs de l'ancienne copie sont retrouvés dans la source par une somme de contrôle glissante
+#    (Adler-32, comme rsync) confirmée par une empreinte forte ; la nouvelle copie est reconstruite
+#    dans un fichier temporaire à partir de ces blocs et des seules données nouvelles.
+# Si aucun des deux ne vaut la peine (fichier réécrit en entier), la copie complète est faite.
+
+# Files below this size are always copied in full
+DELTA_MIN_SIZE = 64 * 1024 * 1024
+DELTA_BLOCK_SIZE = 128 * 1024
+# In-place update if at most this part of the aligned blocks changed
+DELTA_MAX_CHANGED_RATIO = 0.5
+# Give up the rolling search beyond this many new bytes (the search goes byte by byte in Python,
+# about 1 MiB/s: a rewritten file costs a few seconds before being copied in full)
+DELTA_MAX_LITERAL = 8 * 1024 * 1024
+# Adler-32 modulus
+_ADLER_MOD = 65521
+
+
+def _strong_hash(block):
+    return hashlib.blake2b(block, digest_size=16).digest()
+
+
+def changed_blocks(fsrc, fdst, src_size, block_size=DELTA_BLOCK_SIZE, hasher=None):
+    """
+    Offsets of the blocks of 'fsrc' which differ from the block at the same offset in 'fdst'
+    (past the end of 'fdst', every block differs). 'hasher' is fed the whole of 'fsrc'.
+    """
+    changed = []
+    fsrc.seek(0)
+    fdst.seek(0)
+    for offset in range(0, src_size, block_size):
+        block = fsrc.read(block_size)
+        if hasher is not None:
+            hasher.update(block)
+        if block != fdst.read(block_size):
+            changed.append(offset)
+    return changed
+
+
+def delta_inplace(fsrc, fdst, src_size, changed, block_size=DELTA_BLOCK_SIZE):
+    """
+    Write the 'changed' blocks of 'fsrc' at the same offsets in 'fdst' (opened "r+b"),
+    then cut 'fdst' to 'src_size'. Returns the bytes written.
+    """
+    written = 0
+    for offset in changed:
+        fsrc.seek(offset)
+        fdst.seek(offset)
+        written += fdst.write(fsrc.read(block_size))
+    fdst.truncate(src_size)
+    return written
+
+
+def block_signature(f, size, block_size=DELTA_BLOCK_SIZE):
+    """
+    Signature of the full blocks of 'f': {weak checksum: {strong hash: offset}}.
+    """
+    signature = {}
+    f.seek(0)
+    for offset in range(0, size - block_size + 1, block_size):
+        block = f.read(block_size)
+        signature.setdefault(zlib.adler32(block), {}).setdefault(_strong_hash(block), offset)
+    return signature
+
+
+def _copy_range(fold, ftmp, offset, count):
+    """
+    Append 'count' bytes of 'fold' from 'offset' to 'ftmp' (left to the kernel when possible:
+    on a copy-on-write filesystem the blocks are then shared, not written).
+    """
+    if hasattr(os, "copy_file_range"):
+        try:
+            while count > 0:
+                copied = os.copy_file_range(fold.fileno(), ftmp.fileno(), count, offset)
+                if copied == 0:
+                    break
+                offset += copied
+                count -= copied
+            return
+        except OSError:
+            pass # e.g. not supported by the filesystem: done by hand
+    fold.seek(offset)
+    while count > 0:
+        chunk = fold.read(min(count, 1024 * 1024))
+        if not chunk:
+            break
+        ftmp.write(chunk)
+        count -= len(chunk)
+
+
+def delta_rebuild(fsrc, fold, ftmp, src_size, old_size, block_size=DELTA_BLOCK_SIZE, max_literal=DELTA_MAX_LITERAL):
+    """
+    Write into 'ftmp' (opened unbuffered) the content of 'fsrc', reusing the blocks of 'fold'
+    found anywhere in 'fsrc' by rolling checksum. Returns the new bytes written (taken from 'fsrc'),
+    or None if they would exceed 'max_literal' ('ftmp' is then left incomplete).
+    """
+    signature = block_signature(fold, old_size, block_size)
+    with mmap.mmap(fsrc.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        return _rebuild(data, signature, fold, ftmp, block_size, max_literal)
+
+
+def _rebuild(data, signature, fold, ftmp, block_size, max_literal):
+    literal = 0
+    literal_start = 0
+    copy_start = copy_end = None # pending run of blocks of 'fold'
+    position = 0
+    weak = None
+
+    def flush_copy():
+        if copy_start is not None:
+            _copy_range(fold, ftmp, copy_start, copy_end - copy_start)
+
+    while position + block_size <= len(data):
+        if weak is None:
+            weak = zlib.adler32(data[position:position+block_size])
+        candidates = signature.get(weak)
+        match = None
+        if candidates is not None:
+            match = candidates.get(_strong_hash(data[position:position+block_size]))
+        if match is not None:
+            if literal_start < position:
+                flush_copy()
+                copy_start = None
+                ftmp.write(data[literal_start:position])
+            if copy_start is not None and copy_end == match:
+                copy_end += block_size
+            else:
+                flush_copy()
+                copy_start, copy_end = match, match + block_size
+            position += block_size
+            literal_start = position
+            weak = None
+            continue
+        literal += 1
+        if literal > max_literal:
+            return None
+        if position + block_size < len(data):
+            # roll the checksum one byte forward
+            out_byte, in_byte = data[position], data[position + block_size]
+            a = ((weak & 0xffff) - out_byte + in_byte) % _ADLER_MOD
+            b = ((weak >> 16) - block_size * out_byte + a - 1) % _ADLER_MOD
+            weak = (b << 16) | a
+        position += 1
+    flush_copy()
+    literal += len(data) - position
+    if literal > max_literal:
+        return None
+    ftmp.write(data[literal_start:])
+    return literal
+
+
+def delta_copy(src_path, dst_path, temp_path, block_size=DELTA_BLOCK_SIZE, hasher=None, expected_hash=None,
+               clone=None):
+    """
+    Update the existing copy 'dst_path' of 'src_path' by writing only what changed
+    ('temp_path': where to rebuild it if its blocks moved), with the mtime and mode of 'src_path'.
+    'hasher' (hashlib object) is fed the content of 'src_path' on the way; if it doesn't give
+    'expected_hash', OSError is raised before anything is written.
+    The in-place update is made on a clone of 'dst_path' in 'temp_path', renamed over it once complete,
+    when 'clone(fold, ftmp, size)' (a copy-on-write clone, e.g. transfer's reflink) works: nothing else
+    is written. Without one, it is made on 'dst_path' itself: an interrupted update leaves it half-updated
+    (the next scan sees it modified, the next sync writes it again), the price of not rewriting the whole
+    file. A file with other hard links is never updated in place (the change would reach them): it is
+    rebuilt in 'temp_path' instead, if its blocks are worth reusing.
+    Returns {"strategy", "size", "written"}: "delta-inplace" or "delta", the size of the file
+    and the bytes written; or None if the whole file changed and must be copied instead.
+    """
+    src_size = os.path.getsize(src_path)
+    dst_size = os.path.getsize(dst_path)
+    with open(src_path, "rb") as fsrc:
+        with open(dst_path, "rb") as fdst:
+            changed = changed_blocks(fsrc, fdst, src_size, block_size, hasher)
+        if expected_hash and hasher is not None and hasher.hexdigest() != expected_hash:
+            raise OSError("source changed during the copy")
+        blocks = -(-src_size // block_size)
+        in_place = len(changed) <= blocks * DELTA_MAX_CHANGED_RATIO
+        written = None
+        if in_place and clone is not None:
+            written = _delta_on_clone(fsrc, dst_path, temp_path, src_size, dst_size, changed, block_size, clone)
+            if written is not None:
+                shutil.copystat(src_path, temp_path)
+                os.replace(temp_path, dst_path)
+        if written is not None:
+            strategy = "delta-inplace"
+        elif in_place and os.stat(dst_path).st_nlink == 1:
+            with open(dst_path, "r+b") as fdst:
+                written = delta_inplace(fsrc, fdst, src_size, changed, block_size)
+            shutil.copystat(src_path, dst_path)
+            strategy = "delta-inplace"
+        else:
+            try:
+                with open(dst_path, "rb") as fold, open(temp_path, "wb", buffering=0) as ftmp:
+                    written = delta_rebuild(fsrc, fold, ftmp, src_size, dst_size, block_size)
+                if written is None:
+                    os.remove(temp_path)
+                    return None
+                shutil.copystat(src_path, temp_path)
+                os.replace(temp_path, dst_path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+            strategy = "delta"
+    if DEBUG:
+        print(f"Delta copy {src_path} -> {dst_path} ({strategy}): {written}/{src_size} bytes written")
+    return {"strategy": strategy, "size": src_size, "written": written}
+
+
+def _delta_on_clone(fsrc, dst_path, temp_path, src_size, dst_size, changed, block_size, clone):
+    """
+    Clone 'dst_path' to 'temp_path' and write the 'changed' blocks into the clone.
+    Returns the bytes written, or None if the filesystem can't clone ('temp_path' removed).
+    """
+    try:
+        with open(dst_path, "rb") as fold, open(temp_path, "wb") as ftmp:
+            clone(fold, ftmp, dst_size)
+    except OSError as e:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        if DEBUG:
+            print(f"No clone of {dst_path} for an in-place update: {e}")
+        return None
+    try:
+        with open(temp_path, "r+b") as ftmp:
+            return delta_inplace(fsrc, ftmp, src_size, changed, block_size)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+if __name__ == "__main__":
+    print(">> Testing delta.py <<")
+    import sys
+    import tempfile
+
+    if len(sys.argv) != 3:
+        print("Usage: python delta.py <source file> <existing destination file>")
+        sys.exit(1)
+    temp_path = os.path.join(tempfile.gettempdir(), "delta.tmp")
+    print(delta_copy(sys.argv[1], sys.argv[2], temp_path))
@@ -0,0 +1,28 @@
+# coding: utf-8
+DEBUG=False
+
+import argparse
+
+from models import RepoModel
+from sync import format_dry_run
+
+
+# SYNC DRY RUN
+# Plan de synchronisation d'un dossier suivi, sans rien copier ni supprimer et sans interface
+# graphique : le plan vient des seuls fichiers de suivi (derniers scans, aucun fichier n'est lu),
+# avec les octets à copier, les plus gros fichiers et la durée estimée d'après le débit mesuré
+# lors des synchronisations précédentes sur chaque disque.
+# Usage : python dry_run.py <foldername> [--scan] [--max-items 10]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Show the sync plan of a tracked folder and its estimated cost.")
+    parser.add_argument("foldername", help="name of the tracked folder")
+    parser.add_argument("--scan", action="store_true", help="rescan both sides first")
+    parser.add_argument("--max-items", type=int, default=10, help="number of largest copies listed")
+    args = parser.parse_args()
+
+    repo_model = RepoModel()
+    plan = repo_model.plan_sync(args.foldername, scan=args.scan)
+    plan, estimate = repo_model.dry_run_sync(args.foldername, plan=plan, max_items=args.max_items)
+    print(format_dry_run(plan, estimate))
@@ -0,0 +1,143 @@
+# coding: utf-8
+DEBUG=False
+
+import os
+import sqlite3
+import time
+
+
+# GLOBAL HASH CACHE
+# Cache des empreintes commun à tous les dossiers suivis de la machine,
+# stocké à côté de Folder_Data.db : un même fichier vu par plusieurs dossiers
+# (dossiers imbriqués, bind mounts...) n'est lu qu'une fois.
+# Clé : (st_dev, st_ino, mtime_ns, size) + algorithme ; le ctime doit aussi correspondre,
+# pour ne pas confondre un inode réutilisé par un fichier copié avec sa date d'origine.
+# Les entrées inutilisées depuis HASH_CACHE_MAX_AGE_DAYS sont supprimées,
+# puis les moins récemment utilisées au-delà de HASH_CACHE_MAX_ENTRIES (LRU).
+
+HASH_CACHE_FILENAME = "Hash_Cache.db"
+HASH_CACHE_MAX_ENTRIES = 1_000_000
+HASH_CACHE_MAX_AGE_DAYS = 90
+
+
+def cache_key(info):
+    """
+    Cache key of a file from its scanner record, or None if the file can't be identified
+    (no device or inode number, e.g. from os.scandir on Windows).
+    """
+    if not info.get("dev") or not info.get("inode"):
+        return None
+    return (info["dev"], info["inode"], info["mtime_ns"], info["size"])
+
+
+class HashCache:
+    """
+    Machine-wide cache of file hashes and fingerprints, shared by the scans of all folders.
+    """
+    def __init__(self, db_filepath, max_entries=HASH_CACHE_MAX_ENTRIES, max_age_days=HASH_CACHE_MAX_AGE_DAYS):
+        self.__db_filepath = db_filepath
+        self.__max_entries = max_entries
+        self.__max_age_days = max_age_days
+        self.initialize()
+
+    def get_db_filepath(self):
+        return self.__db_filepath
+
+    def initialize(self):
+        with sqlite3.connect(self.__db_filepath, timeout=30) as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS hash_cache (
+                    dev INTEGER NOT NULL,
+                    inode INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    algorithm TEXT NOT NULL,
+                    ctime_ns INTEGER NOT NULL,
+                    hash TEXT NOT NULL,
+                    fingerprint TEXT,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (dev, inode, mtime_ns, size, algorithm)
+                )
+            """) # nb - hash is '' when only the fingerprint is known
+            connection.execute("CREATE INDEX IF NOT EXISTS hash_cache_last_used ON hash_cache (last_used)")
+
+    def get_digests(self, files, algorithm):
+        """
+        Look up the files of 'files' ({name: scanner record}) hashed with 'algorithm'.
+        Returns {name: (hash, fingerprint)} for the files found; they are marked as used.
+        """
+        found = {}
+        used = []
+        with sqlite3.connect(self.__db_filepath, timeout=30) as connection:
+            for name, info in files.items():
+                key = cache_key(info)
+                if key is None:
+                    continue
+                row = connection.execute("""
+                    SELECT hash, fingerprint FROM hash_cache
+                    WHERE dev = ? AND inode = ? AND mtime_ns = ? AND size = ? AND algorithm = ? AND ctime_ns = ?
+                """, (*key, algorithm, info["ctime_ns"])).fetchone()
+                if row is not None:
+                    found[name] = row
+                    used.append(key + (algorithm,))
+            now = time.time()
+            connection.executemany("""
+                UPDATE hash_cache SET last_used = ?
+                WHERE dev = ? AND inode = ? AND mtime_ns = ? AND size = ? AND algorithm = ?
+            """, ((now, *key) for key in used))
+        if DEBUG:
+            print(f"Hash cache: {len(found)}/{len(files)} hits")
+        return found
+
+    def put_digests(self, files, algorithm):
+        """
+        Store the hashes of 'files' ({name: scanner record with "hash" and "fingerprint"}).
+        """
+        now = time.time()
+        rows = []
+        for info in files.values():
+            key = cache_key(info)
+            if key is not None and (info.get("hash") or info.get("fingerprint")):
+                rows.append((*key, algorithm, info["ctime_ns"], info.get("hash") or "", info.get("fingerprint"), now))
+        with sqlite3.connect(self.__db_filepath, timeout=30) as connection:
+            connection.executemany("""
+                INSERT OR REPLACE INTO hash_cache (dev, inode, mtime_ns, size, algorithm, ctime_ns, hash, fingerprint, last_used)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+
+    def evict(self):
+        """
+        Drop the entries unused for 'max_age_days', then the least recently used ones
+        beyond 'max_entries'. Returns the number of entries dropped.
+        """
+        with sqlite3.connect(self.__db_filepath, timeout=30) as connection:
+            dropped = connection.execute("DELETE FROM hash_cache WHERE last_used < ?",
+                                         (time.time() - self.__max_age_days * 86400,)).rowcount
+            count = connection.execute("SELECT count(*) FROM hash_cache").fetchone()[0]
+            if count > self.__max_entries:
+                dropped += connection.execute("""
+                    DELETE FROM hash_cache WHERE rowid IN (
+                        SELECT rowid FROM hash_cache ORDER BY last_used LIMIT ?
+                    )
+                """, (count - self.__max_entries,)).rowcount
+        return dropped
+
+    def clear(self):
+        with sqlite3.connect(self.__db_filepath, timeout=30) as connection:
+            connection.execute("DELETE FROM hash_cache")
+
+
+if __name__ == "__main__":
+    print(">> Testing hashcache.py <<")
+    import sys
+    import tempfile
+    from scanner import scan_tree
+    from hashing import compute_file_digests, DEFAULT_HASH_ALGORITHM
+
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    cache = HashCache(os.path.join(tempfile.mkdtemp(), HASH_CACHE_FILENAME))
+    manifest = scan_tree(root)
+    for filename, info in manifest.items():
+        info["hash"], info["fingerprint"] = compute_file_digests(os.path.join(root, filename))
+    cache.put_digests(manifest, DEFAULT_HASH_ALGORITHM)
+    print(f"{len(cache.get_digests(scan_tree(root), DEFAULT_HASH_ALGORITHM))}/{len(manifest)} files found in the cache")
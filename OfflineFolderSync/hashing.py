@@ -0,0 +1,421 @@
+# coding: utf-8
+DEBUG=False
+
+import ctypes
+import ctypes.util
+import hashlib
+import mmap
+import os
+import platform
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+# FILE HASHING
+# Calcul des empreintes de contenu des fichiers suivis.
+# En mode "background", la lecture est bridée (octets/s et fichiers/s, par token bucket)
+# et le thread qui hashe passe en priorité d'E/S "idle", pour laisser le disque à l'utilisateur.
+
+# Hash algorithms available for the tracked folders.
+# BLAKE2b is the default: noticeably faster than SHA-256 in CPython's hashlib.
+HASH_ALGORITHMS = {
+    "blake2b": hashlib.blake2b,
+    "sha256": hashlib.sha256,
+}
+DEFAULT_HASH_ALGORITHM = "blake2b"
+# Algorithm of the hashes stored by versions without a per-file algorithm
+LEGACY_HASH_ALGORITHM = "sha256"
+
+IO_MODES = ("fast", "background")
+# Default budgets of the background mode
+BACKGROUND_BYTES_PER_SECOND = 20 * 1024 * 1024
+BACKGROUND_FILES_PER_SECOND = 200
+# Read buffer of the hashing path: sized from the file size, between these bounds
+MIN_READ_BUFFER = 64 * 1024
+MAX_READ_BUFFER = 1024 * 1024
+# Files from this size are memory-mapped, when the mmap path is enabled
+MMAP_MIN_SIZE = 64 * 1024 * 1024
+# Quick fingerprints: size + head, middle and tail samples of this size.
+# Files up to FINGERPRINT_FULL_SIZE are read whole: their fingerprint is their full hash.
+FINGERPRINT_SAMPLE_SIZE = 64 * 1024
+FINGERPRINT_FULL_SIZE = 3 * FINGERPRINT_SAMPLE_SIZE
+# Hashing pool: files below this size are hashed in batches (one task per batch)
+SMALL_FILE_SIZE = 1024 * 1024
+BATCH_MAX_FILES = 64
+BATCH_MAX_BYTES = 16 * 1024 * 1024
+
+
+## I/O PRIORITY
+
+# ioprio_set syscall numbers (Linux)
+_IOPRIO_SET_SYSCALLS = {"x86_64": 251, "amd64": 251, "i386": 289, "i686": 289,
+                        "aarch64": 30, "arm64": 30, "armv7l": 314}
+IOPRIO_WHO_PROCESS = 1 # with who=0: the calling thread
+IOPRIO_CLASS_SHIFT = 13
+IOPRIO_CLASS_IDLE = 3 # class 0 ("none") restores the default priority
+# Windows SetThreadPriority modes (background mode lowers the I/O priority too)
+THREAD_MODE_BACKGROUND_BEGIN = 0x00010000
+THREAD_MODE_BACKGROUND_END = 0x00020000
+
+
+def set_thread_io_priority(idle):
+    """
+    Switch the calling thread to idle I/O priority (idle=True) or back to normal.
+    Returns False where the OS doesn't support it.
+    """
+    try:
+        if sys.platform.startswith("linux"):
+            syscall_number = _IOPRIO_SET_SYSCALLS.get(platform.machine().lower())
+            if syscall_number is None:
+                return False
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            ioprio = (IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) if idle else 0
+            return libc.syscall(syscall_number, IOPRIO_WHO_PROCESS, 0, ioprio) == 0
+        if sys.platform == "win32":
+            kernel32 = ctypes.windll.kernel32
+            mode = THREAD_MODE_BACKGROUND_BEGIN if idle else THREAD_MODE_BACKGROUND_END
+            return bool(kernel32.SetThreadPriority(kernel32.GetCurrentThread(), mode))
+    except (OSError, AttributeError):
+        pass
+    return False
+
+
+## THROTTLING
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: 'rate' tokens per second, up to 'capacity' in reserve.
+    Consumers may go into debt; they then wait until the debt is paid back.
+    """
+    def __init__(self, rate, capacity=None):
+        self.__lock = threading.Lock()
+        self.__rate = rate
+        self.__capacity = capacity if capacity is not None else rate
+        self.__tokens = self.__capacity
+        self.__last = time.monotonic()
+
+    def get_rate(self):
+        return self.__rate
+
+    def set_rate(self, rate, capacity=None):
+        with self.__lock:
+            self.__refill()
+            self.__rate = rate
+            self.__capacity = capacity if capacity is not None else rate
+            self.__tokens = min(self.__tokens, self.__capacity)
+
+    def __refill(self):
+        now = time.monotonic()
+        self.__tokens = min(self.__capacity, self.__tokens + (now - self.__last) * self.__rate)
+        self.__last = now
+
+    def consume(self, amount):
+        """
+        Take 'amount' tokens. Returns how long (in seconds) the caller should wait.
+        """
+        with self.__lock:
+            self.__refill()
+            self.__tokens -= amount
+            return -self.__tokens / self.__rate if self.__tokens < 0 else 0.0
+
+
+class HashThrottle:
+    """
+    Budget of the hashing path, shared by the threads of a scan.
+    In "fast" mode nothing is limited. In "background" mode, reads are limited to
+    'bytes_per_second' and 'files_per_second', at idle I/O priority where the OS supports it.
+    The mode can be switched at any time, including while a scan is running.
+    """
+    def __init__(self, mode="fast",
+                 bytes_per_second=BACKGROUND_BYTES_PER_SECOND,
+                 files_per_second=BACKGROUND_FILES_PER_SECOND):
+        if mode not in IO_MODES:
+            raise ValueError(f"Unknown I/O mode: {mode}")
+        self.__mode = mode
+        self.__bytes = TokenBucket(bytes_per_second)
+        self.__files = TokenBucket(files_per_second)
+        self.__thread_modes = threading.local() # I/O priority currently applied to each thread
+
+    def get_mode(self):
+        return self.__mode
+
+    def set_mode(self, mode):
+        if mode not in IO_MODES:
+            raise ValueError(f"Unknown I/O mode: {mode}")
+        self.__mode = mode
+
+    def set_budget(self, bytes_per_second=None, files_per_second=None):
+        if bytes_per_second is not None:
+            self.__bytes.set_rate(bytes_per_second)
+        if files_per_second is not None:
+            self.__files.set_rate(files_per_second)
+
+    def get_budget(self):
+        return {"bytes_per_second": self.__bytes.get_rate(), "files_per_second": self.__files.get_rate()}
+
+    def __apply_io_priority(self):
+        if getattr(self.__thread_modes, "mode", "fast") != self.__mode:
+            set_thread_io_priority(self.__mode == "background")
+            self.__thread_modes.mode = self.__mode
+
+    def __wait(self, delay):
+        # sleep by small steps, to stop waiting as soon as the mode switches to "fast"
+        end = time.monotonic() + delay
+        while self.__mode == "background":
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 0.1))
+
+    def before_file(self):
+        """
+        Called before hashing a file.
+        """
+        self.__apply_io_priority()
+        if self.__mode == "background":
+            self.__wait(self.__files.consume(1))
+
+    def after_read(self, nbytes):
+        """
+        Called after each chunk read.
+        """
+        if self.__mode == "background":
+            self.__wait(self.__bytes.consume(nbytes))
+
+
+## HASHING
+
+def get_hasher(algorithm=DEFAULT_HASH_ALGORITHM):
+    """
+    New hash object for 'algorithm' (one of HASH_ALGORITHMS).
+    """
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unknown hash algorithm: {algorithm}")
+    return HASH_ALGORITHMS[algorithm]()
+
+
+def read_buffer_size(file_size):
+    """
+    Size of the read buffer for a file of 'file_size' bytes: a power of two around
+    1/16th of the file, between MIN_READ_BUFFER and MAX_READ_BUFFER.
+    Large buffers cut the number of Python-level calls per byte on big files,
+    without allocating megabytes for small ones.
+    """
+    size = MIN_READ_BUFFER
+    while size < MAX_READ_BUFFER and size * 16 < file_size:
+        size *= 2
+    return size
+
+
+_thread_buffers = threading.local()
+
+def _get_read_buffer(size):
+    """
+    Read buffer of the calling thread, reused from one file to the next.
+    """
+    buffer = getattr(_thread_buffers, "buffer", None)
+    if buffer is None or len(buffer) < size:
+        buffer = bytearray(size)
+        _thread_buffers.buffer = buffer
+    return memoryview(buffer)[:size]
+
+
+def _hash_readinto(f, file_size, hasher, throttle):
+    buffer = _get_read_buffer(read_buffer_size(file_size))
+    while nbytes := f.readinto(buffer):
+        hasher.update(buffer[:nbytes])
+        if throttle is not None:
+            throttle.after_read(nbytes)
+
+
+def _hash_mmap(f, file_size, hasher, throttle):
+    chunk_size = read_buffer_size(file_size) # chunks only matter to the throttle
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, "madvise"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        # the views must be released before the mapping is closed
+        with memoryview(mapped) as view:
+            for offset in range(0, len(view), chunk_size):
+                with view[offset:offset+chunk_size] as chunk:
+                    hasher.update(chunk)
+                    if throttle is not None:
+                        throttle.after_read(len(chunk))
+
+
+def _hash_file(f, file_size, algorithm, throttle, use_mmap):
+    hasher = get_hasher(algorithm)
+    if use_mmap and file_size >= MMAP_MIN_SIZE:
+        _hash_mmap(f, file_size, hasher, throttle)
+    else:
+        _hash_readinto(f, file_size, hasher, throttle)
+    return hasher.hexdigest()
+
+
+def _fingerprint_file(f, file_size, algorithm, throttle):
+    hasher = get_hasher(algorithm)
+    hasher.update(file_size.to_bytes(8, "little"))
+    for offset in (0, (file_size - FINGERPRINT_SAMPLE_SIZE) // 2, file_size - FINGERPRINT_SAMPLE_SIZE):
+        f.seek(offset)
+        sample = f.read(FINGERPRINT_SAMPLE_SIZE)
+        hasher.update(sample)
+        if throttle is not None:
+            throttle.after_read(len(sample))
+    return hasher.hexdigest()
+
+
+def compute_file_hash(file_path, throttle=None, algorithm=DEFAULT_HASH_ALGORITHM, use_mmap=False):
+    """
+    Compute the hash of a file with 'algorithm' (see HASH_ALGORITHMS).
+    'throttle' (HashThrottle) limits the reads in background mode.
+    The file is read with readinto() into a reused buffer sized from the file size.
+    With 'use_mmap', files of MMAP_MIN_SIZE or more are memory-mapped instead
+    (beware: a file truncated while mapped kills the process with SIGBUS on POSIX).
+    Returns "" if the file could not be read.
+    """
+    try:
+        if throttle is not None:
+            throttle.before_file()
+        with open(file_path, "rb", buffering=0) as f:
+            return _hash_file(f, os.fstat(f.fileno()).st_size, algorithm, throttle, use_mmap)
+    except OSError as e:
+        print(f"Error computing hash for {file_path}: {e}")
+        return ""
+
+
+def compute_file_digests(file_path, throttle=None, algorithm=DEFAULT_HASH_ALGORITHM, use_mmap=False, quick=False):
+    """
+    Compute the full hash and the quick fingerprint of a file.
+    The fingerprint covers the size and three samples (head, middle, tail) of
+    FINGERPRINT_SAMPLE_SIZE bytes: a few reads answer "did this file change?" on any size.
+    Files up to FINGERPRINT_FULL_SIZE are read whole, their fingerprint is their full hash.
+    With 'quick', the full hash of larger files is not computed ("").
+    Returns (hash, fingerprint), ("", "") if the file could not be read.
+    """
+    try:
+        if throttle is not None:
+            throttle.before_file()
+        with open(file_path, "rb", buffering=0) as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size <= FINGERPRINT_FULL_SIZE:
+                file_hash = _hash_file(f, file_size, algorithm, throttle, use_mmap)
+                return file_hash, file_hash
+            fingerprint = _fingerprint_file(f, file_size, algorithm, throttle)
+            if quick:
+                return "", fingerprint
+            f.seek(0)
+            return _hash_file(f, file_size, algorithm, throttle, use_mmap), fingerprint
+    except OSError as e:
+        print(f"Error computing hash for {file_path}: {e}")
+        return "", ""
+
+
+class HashPool:
+    """
+    Pool of threads hashing files concurrently (hashlib and file reads release the GIL,
+    so throughput scales with the cores until the disk is the limit).
+    Large files are scheduled first, one task each, so that the biggest ones don't end
+    up running alone at the end of the scan; small files are grouped in batches, so that
+    the per-task overhead doesn't dominate.
+    """
+    def __init__(self, max_workers=None, throttle=None, use_mmap=False):
+        self.__max_workers = max_workers
+        self.__throttle = throttle
+        self.__use_mmap = use_mmap
+
+    def get_max_workers(self):
+        return self.__max_workers if self.__max_workers else (os.cpu_count() or 1)
+
+    def set_max_workers(self, max_workers):
+        """
+        Set the pool size (None: one thread per core).
+        """
+        self.__max_workers = max_workers
+
+    def __hash_batch(self, batch, algorithm, quick):
+        return [(key, *compute_file_digests(path, throttle=self.__throttle, algorithm=algorithm,
+                                            use_mmap=self.__use_mmap, quick=quick))
+                for key, path, _ in batch]
+
+    def hash_files(self, files, algorithm=DEFAULT_HASH_ALGORITHM, quick=False):
+        """
+        Hash 'files', an iterable of (key, path, size), with 'algorithm'.
+        Yields (key, hash, fingerprint) as the hashes are computed (not in input order).
+        With 'quick', only the fingerprints are computed (see compute_file_digests).
+        """
+        get_hasher(algorithm) # fail early on an unknown algorithm
+        files = sorted(files, key=lambda file: file[2], reverse=True)
+        tasks = [[file] for file in files if file[2] >= SMALL_FILE_SIZE]
+        batch = []
+        batch_bytes = 0
+        for file in files[len(tasks):]:
+            batch.append(file)
+            batch_bytes += file[2]
+            if len(batch) >= BATCH_MAX_FILES or batch_bytes >= BATCH_MAX_BYTES:
+                tasks.append(batch)
+                batch = []
+                batch_bytes = 0
+        if batch:
+            tasks.append(batch)
+        if not tasks:
+            return
+        pool = ThreadPoolExecutor(max_workers=self.get_max_workers())
+        try:
+            futures = [pool.submit(self.__hash_batch, task, algorithm, quick) for task in tasks]
+            for future in as_completed(futures):
+                yield from future.result()
+        finally:
+            # on error (or if the caller stops early), don't hash the remaining files
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+## MERKLE TREE
+
+def compute_tree_hashes(files):
+    """
+    Compute the Merkle tree of a folder: the hash of a directory covers the names and
+    hashes of its files and subdirectories, so two folders with the same content have
+    the same root hash, and a change only alters the hashes of the directories above it.
+    'files' iterates over (relative path, file hash), in sorted path order; the file hashes
+    should carry their algorithm (e.g. "blake2b:..."), so that a file hashed with two
+    different algorithms never compares equal.
+    Yields (relative dir, dir hash, file count) for each directory, children before
+    their parent; the root "" comes last. Memory depends on the depth of the tree only.
+    """
+    stack = [["", hashlib.sha256(), 0]] # open directories, from the root: [dirname, hasher, file count]
+
+    def close_directory():
+        dirname, hasher, file_count = stack.pop()
+        digest = hasher.hexdigest()
+        if stack:
+            parent = stack[-1]
+            parent[1].update(f"D {dirname.rpartition('/')[2]}\0{digest}\n".encode())
+            parent[2] += file_count
+        return dirname, digest, file_count
+
+    for rel_path, file_hash in files:
+        parent, _, name = rel_path.rpartition("/")
+        # close the directories the walk has left
+        while stack[-1][0] and parent != stack[-1][0] and not parent.startswith(stack[-1][0] + "/"):
+            yield close_directory()
+        # open the directories between the current one and the file's parent
+        current = stack[-1][0]
+        if parent != current:
+            for part in (parent[len(current)+1:] if current else parent).split("/"):
+                current = f"{current}/{part}" if current else part
+                stack.append([current, hashlib.sha256(), 0])
+        stack[-1][1].update(f"F {name}\0{file_hash}\n".encode())
+        stack[-1][2] += 1
+    while stack:
+        yield close_directory()
+
+
+if __name__ == "__main__":
+    print(">> Testing hashing.py <<")
+
+    throttle = HashThrottle("background", bytes_per_second=1024*1024)
+    for path in sys.argv[1:] or [__file__]:
+        for algorithm in HASH_ALGORITHMS:
+            start = time.perf_counter()
+            print(f"{algorithm}:{compute_file_hash(path, throttle=throttle, algorithm=algorithm)}  {path}  ({time.perf_counter()-start:.2f}s)")
@@ -1,8 +1,56 @@
 # coding: utf-8
 DEBUG=False
 
+import json
 import os
 import sqlite3
+import time
+from datetime import datetime
+
+from scanner import scan_tree, stat_known_files, iter_tree, merge_join
+from hashing import compute_tree_hashes, HashThrottle, HashPool, HASH_ALGORITHMS, DEFAULT_HASH_ALGORITHM, \
+                    LEGACY_HASH_ALGORITHM
+from watcher import create_watcher
+from syncignore import IgnoreRules, SYNCIGNORE_FILENAME
+from hashcache import HashCache, HASH_CACHE_FILENAME
+from contentindex import ContentIndex, SIDES
+from sync import build_sync_plan, execute_sync_plan, estimate_plan, throughput_samples, content_tag
+from transfer import CopyExecutor, TRANSFER_IGNORE_PATTERNS, mount_point_of, filesystem_type
+from packstore import PackStore, PACK_DIRNAME, REMOTE_MODES, DEFAULT_REMOTE_MODE
+
+
+# Per-folder tracking database, stored at the root of each tracked folder
+TRACKING_FILENAME = "offline_filesync_data.db"
+# Files the scanner must never report (the tracking database and its SQLite side files)
+TRACKING_FILES = tuple(TRACKING_FILENAME + suffix for suffix in ("", "-journal", "-wal", "-shm"))
+# Entries of the folder root the scanner must never report: the tracking files and the pack store
+SCAN_EXCLUDE = TRACKING_FILES + (PACK_DIRNAME,)
+# Default ignore rules of every folder, before its .syncignore: the files in progress of the transfers
+# and the pack stores, at any depth (a pack remote inside a tracked folder is not content)
+DEFAULT_IGNORE_PATTERNS = TRANSFER_IGNORE_PATTERNS + (f"{PACK_DIRNAME}/",)
+# Fields of a tracked_files row, after the filename
+TRACKED_FILES_FIELDS = ("status", "last_sync", "hash", "size", "mtime_ns", "inode", "ctime_ns", "hash_algo", "fingerprint",
+                        "base_hash")
+TRACKED_FILES_COLUMNS = ", ".join(("filename",) + TRACKED_FILES_FIELDS)
+TRACKED_FILES_PLACEHOLDERS = ", ".join("?" * (len(TRACKED_FILES_FIELDS)+1))
+# Hash of a tracked_files row tagged with its algorithm, as fed to the Merkle tree
+# ("algo:hash", or "algo~fingerprint" while the full hash is not known yet)
+TAGGED_HASH = (f"coalesce(hash_algo, '{LEGACY_HASH_ALGORITHM}')"
+               " || CASE WHEN hash != '' THEN ':' || hash ELSE '~' || coalesce(fingerprint, '') END")
+# Scan modes: "stat" re-hashes only the files whose stat tuple changed, "full" re-hashes every file,
+# "quick" only fingerprints the files whose stat tuple changed (see verify_fingerprints)
+SCAN_MODES = ("stat", "full", "quick")
+# Weight of the previous measures of a device's throughput at each new sample
+THROUGHPUT_DECAY = 0.5
+# Upper bound of every relative path, in SQLite's order (the largest code point)
+PATH_RANGE_END = "\U0010ffff"
+# Rows written per batch by the streaming scan
+STREAM_BATCH_SIZE = 1000
+# Seconds between two checkpoints of a running scan
+CHECKPOINT_INTERVAL = 30
+# FAT stores mtime with a 2 s resolution
+FAT_MTIME_TOLERANCE_NS = 2_000_000_000
+FAT_FILESYSTEMS = ("vfat", "msdos", "fat", "exfat")
 
 
 # OBSERVER PATTERN - SUBJECT
@@ -39,8 +87,16 @@ class RepoModel(Subject):
         self.__db_filepath = self.__set_db_filepath(self.__db_filename) # private because path is relative to working dir & needs to be set properly
         self.__tablename = tablename
         self.__selected_folder = ""
-        self.__local_folder = FolderModel()
-        self.__remote_folder = FolderModel()
+        # machine-wide hash cache, shared by the scans of all folders
+        self.__hash_cache = HashCache(os.path.join(os.path.dirname(self.__db_filepath), HASH_CACHE_FILENAME))
+        # cross-folder index of the file hashes, for the duplicates report
+        self.__content_index = ContentIndex(self.__db_filepath)
+        self.__copy_executor = CopyExecutor()
+        # measured copy throughput of each device, for the sync time estimates
+        self.__device_throughput = DeviceThroughput(self.__db_filepath)
+        self.__local_folder = FolderModel(hash_cache=self.__hash_cache)
+        self.__remote_folder = FolderModel(hash_cache=self.__hash_cache)
+        self.__watched_folders = {} # foldername -> FolderModel of its watched local path
         
         self.initialize_folders_db()
 
@@ -95,6 +151,14 @@ class RepoModel(Subject):
                 print(f"New folder data: {folder_data}")
             self.__local_folder.set_path(folder_data["local_path"])
             self.__remote_folder.set_path(folder_data["remote_path"])
+            ignore_rules = self.get_ignore_rules(new_folder_name)
+            self.__local_folder.set_ignore_rules(ignore_rules)
+            self.__remote_folder.set_ignore_rules(ignore_rules)
+            self.__local_folder.set_hash_algorithm(folder_data["hash_algorithm"])
+            self.__remote_folder.set_hash_algorithm(folder_data["hash_algorithm"])
+            self.__remote_folder.set_pack_mode(folder_data["remote_mode"] == "pack")
+            for folder in (self.__local_folder, self.__remote_folder):
+                folder.set_mtime_tolerance_ns(mtime_tolerance_of(folder.get_path(), folder_data["mtime_tolerance_ns"]))
             self.notify()
         except: 
             self.__local_folder.set_path(None)
@@ -106,6 +170,18 @@ class RepoModel(Subject):
         return self.__local_folder
 
 
+    def get_hash_cache(self):
+        return self.__hash_cache
+
+
+    def get_copy_executor(self):
+        """
+        Parallel copier of the syncs: its bytes-in-flight cap, per-device concurrency and verify mode are set on it  
+        (e.g. get_copy_executor().set_device_concurrency(remote_path, 1) for a spinning disk).  
+        """
+        return self.__copy_executor
+
+
     def get_remote_folder(self):
         return self.__remote_folder
 
@@ -129,22 +205,46 @@ class RepoModel(Subject):
                         id INTEGER PRIMARY KEY,
                         foldername TEXT NOT NULL,
                         local_path TEXT NOT NULL,
-                        remote_path TEXT NOT NULL
+                        remote_path TEXT NOT NULL,
+                        ignore_file TEXT,
+                        local_hash TEXT,
+                        remote_hash TEXT,
+                        hash_algorithm TEXT,
+                        remote_mode TEXT,
+                        mtime_tolerance_ns INTEGER
                     )
                 """)
+                # nb - ignore_file: rules file of the folder, defaults to <local_path>/.syncignore
+                # nb - local_hash, remote_hash: Merkle root hashes of both sides at their last scan
+                # nb - hash_algorithm: algorithm of the new file hashes, NULL for DEFAULT_HASH_ALGORITHM
+                # (folders registered by older versions keep their SHA-256 hashes)
+                # nb - remote_mode: storage of the remote side, one of packstore.REMOTE_MODES, NULL for DEFAULT_REMOTE_MODE
+                # nb - mtime_tolerance_ns: see FolderModel.set_mtime_tolerance_ns, NULL to detect it on each side
+                # from its filesystem (see mtime_tolerance_of)
+                add_missing_columns(connection, tablename, {"ignore_file": "TEXT",
+                                                            "local_hash": "TEXT",
+                                                            "remote_hash": "TEXT",
+                                                            "hash_algorithm": f"TEXT DEFAULT '{LEGACY_HASH_ALGORITHM}'",
+                                                            "remote_mode": "TEXT",
+                                                            "mtime_tolerance_ns": "INTEGER"})
                 # TODO!(1) add folder-level sync status tracking:
                         # status TEXT NOT NULL,
                         # last_sync TEXT NOT NULL,
-                        # local_hash TEXT NOT NULL,
-                        # usb_hash TEXT NOT NULL,
         self.notify()
         return
     
 
     # CRUD - Create
-    def add_new_folder_to_db(self, foldername, local_path, remote_path, db_filepath=None, tablename=None):
+    def add_new_folder_to_db(self, foldername, local_path, remote_path, ignore_file=None, hash_algorithm=None, remote_mode=None,
+                             mtime_tolerance_ns=None, db_filepath=None, tablename=None):
         """
         Inserts a new folder in the database.  
+        'ignore_file' is the .syncignore rules file of the folder (default: <local_path>/.syncignore).  
+        'hash_algorithm' is one of hashing.HASH_ALGORITHMS (default: DEFAULT_HASH_ALGORITHM).  
+        'remote_mode' is one of packstore.REMOTE_MODES (default: DEFAULT_REMOTE_MODE):  
+        "pack" stores the small files of the remote side in pack files (see packstore.py).  
+        'mtime_tolerance_ns' is how far mtime/ctime may drift before a file is considered changed  
+        (default: detected on each side, FAT_MTIME_TOLERANCE_NS on FAT/exFAT drives, see mtime_tolerance_of).  
         """
         # TODO! if foldername already present, raise error (to warn user & prompt new name)
         # Check if paths are valid
@@ -155,6 +255,13 @@ class RepoModel(Subject):
         remote_path = os.path.dirname(remote_path.rstrip("\\/")) if not os.path.isdir(remote_path) else remote_path
         if not os.path.exists(local_path):
             raise ValueError("Remote directory not found.")
+
+        if hash_algorithm is not None and hash_algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Unknown hash algorithm: {hash_algorithm}")
+        if remote_mode is not None and remote_mode not in REMOTE_MODES:
+            raise ValueError(f"Unknown remote mode: {remote_mode}")
+        if mtime_tolerance_ns is not None and mtime_tolerance_ns < 0:
+            raise ValueError("The mtime tolerance can't be negative.")
         
         # initialize tracking files
         # TODO!(1) initialize tracking files at folder init
@@ -175,9 +282,13 @@ class RepoModel(Subject):
                 INSERT INTO {tablename} (
                                     foldername, 
                                     local_path, 
-                                    remote_path)
-                VALUES (?, ?, ?)
-            """, (foldername, local_path, remote_path))
+                                    remote_path,
+                                    ignore_file,
+                                    hash_algorithm,
+                                    remote_mode,
+                                    mtime_tolerance_ns)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (foldername, local_path, remote_path, ignore_file, hash_algorithm, remote_mode, mtime_tolerance_ns))
         self.notify()
         return
 
@@ -193,16 +304,22 @@ class RepoModel(Subject):
         db_filepath = db_filepath if db_filepath else self.get_db_filepath()
         tablename = tablename if tablename else self.get_tablename()
         folder_data={}
-        sql = f"SELECT * FROM {tablename}"
+        sql = f"SELECT foldername, local_path, remote_path, ignore_file, local_hash, remote_hash, hash_algorithm, remote_mode, mtime_tolerance_ns FROM {tablename}"
         params = ()
         if foldername:
             sql += " WHERE foldername = ?"
             params = (foldername,)
         with sqlite3.connect(db_filepath) as connection:
             cursor = connection.execute(sql, params)
-            folder_data = {row[1]: { # <- foldername
-                                "local_path": row[2],
-                                "remote_path": row[3]
+            folder_data = {row[0]: { # <- foldername
+                                "local_path": row[1],
+                                "remote_path": row[2],
+                                "ignore_file": row[3],
+                                "local_hash": row[4],
+                                "remote_hash": row[5],
+                                "hash_algorithm": row[6] or DEFAULT_HASH_ALGORITHM,
+                                "remote_mode": row[7] or DEFAULT_REMOTE_MODE,
+                                "mtime_tolerance_ns": row[8]
                                 } for row in cursor.fetchall()}
         return folder_data
     
@@ -242,9 +359,14 @@ class RepoModel(Subject):
         
 
     # CRUD - Update
-    def set_folder_data(self, foldername, local_path=None, remote_path=None, new_name=None, db_filepath=None, tablename=None):
+    def set_folder_data(self, foldername, local_path=None, remote_path=None, new_name=None, ignore_file=None, hash_algorithm=None, remote_mode=None,
+                        mtime_tolerance_ns=None, db_filepath=None, tablename=None):
         """
         Uptade the data of a folder in the database.  
+        Changing 'hash_algorithm' doesn't rehash anything: files are rehashed with the new  
+        algorithm as they change, or by FolderModel.rehash_outdated().  
+        Changing 'remote_mode' doesn't move anything either: it only decides where the next small  
+        files copied to the remote side go, the files already packed stay readable.  
         """
         fields = []
         values = []
@@ -263,6 +385,24 @@ class RepoModel(Subject):
                 raise ValueError("Remote directory not found.")
             fields.append("remote_path = ?")
             values.append(remote_path)
+        if ignore_file is not None:
+            fields.append("ignore_file = ?")
+            values.append(ignore_file)
+        if hash_algorithm is not None:
+            if hash_algorithm not in HASH_ALGORITHMS:
+                raise ValueError(f"Unknown hash algorithm: {hash_algorithm}")
+            fields.append("hash_algorithm = ?")
+            values.append(hash_algorithm)
+        if remote_mode is not None:
+            if remote_mode not in REMOTE_MODES:
+                raise ValueError(f"Unknown remote mode: {remote_mode}")
+            fields.append("remote_mode = ?")
+            values.append(remote_mode)
+        if mtime_tolerance_ns is not None:
+            if mtime_tolerance_ns < 0:
+                raise ValueError("The mtime tolerance can't be negative.")
+            fields.append("mtime_tolerance_ns = ?")
+            values.append(mtime_tolerance_ns)
         db_filepath = db_filepath if db_filepath else self.get_db_filepath()
         tablename = tablename if tablename else self.get_tablename()
         with sqlite3.connect(db_filepath) as connection:
@@ -270,6 +410,12 @@ class RepoModel(Subject):
                 values.append(foldername)
                 sql = f"UPDATE {tablename} SET {', '.join(fields)} WHERE foldername = ?"
                 connection.execute(sql, tuple(values))
+        if new_name is not None:
+            self.__content_index.rename_folder(foldername, new_name)
+        if fields and foldername in self.__watched_folders:
+            # watched with the previous settings
+            self.unwatch_folder(foldername)
+            self.watch_folder(new_name if new_name is not None else foldername)
         self.notify()
         return
     
@@ -297,6 +443,8 @@ class RepoModel(Subject):
         TODO: Deleting the tracking files in local and usb folders.
         """
         # delete_tracking_files(foldername)
+        if foldername in self.__watched_folders:
+            self.unwatch_folder(foldername)
         # Remove folder from DB
         db_filepath = db_filepath if db_filepath else self.get_db_filepath()
         tablename = tablename if tablename else self.get_tablename()
@@ -304,42 +452,1387 @@ class RepoModel(Subject):
             connection.execute(f"""
                 DELETE FROM {tablename} WHERE foldername = ?
             """, (foldername,))
+        self.__content_index.remove_folder(foldername)
         self.notify()
         return
 
 
+    def get_ignore_rules(self, foldername):
+        """
+        Load the compiled ignore rules of a folder,  
+        from its 'ignore_file' or else from <local_path>/.syncignore.  
+        The same rules apply to the local and the remote side.  
+        """
+        folder_data = self.get_folder_data(foldername).get(foldername)
+        if folder_data is None:
+            raise ValueError(f"Unknown folder: {foldername}")
+        ignore_file = folder_data["ignore_file"] or os.path.join(folder_data["local_path"], SYNCIGNORE_FILENAME)
+        return IgnoreRules.from_file(ignore_file, defaults=DEFAULT_IGNORE_PATTERNS)
+
+
+    def update_folder_hashes(self, foldername, db_filepath=None, tablename=None):
+        """
+        Store in the registry the Merkle root hashes of both sides of a folder,  
+        read from their tracking files (as of their last scan),  
+        and bring the content index of the sides that changed up to date.  
+        Returns (local_hash, remote_hash).  
+        """
+        folder_data = self.get_folder_data(foldername).get(foldername)
+        if folder_data is None:
+            raise ValueError(f"Unknown folder: {foldername}")
+        hashes = []
+        for side, path in zip(SIDES, (folder_data["local_path"], folder_data["remote_path"])):
+            folder = FolderModel(path)
+            tracking_filepath = folder.get_tracking_filepath()
+            if not os.path.exists(tracking_filepath):
+                # side never scanned, or drive unplugged: its index is kept as it was
+                hashes.append(None)
+                continue
+            hashes.append(folder.get_root_hash())
+            self.__content_index.update_folder(foldername, side, tracking_filepath, hashes[-1])
+        db_filepath = db_filepath if db_filepath else self.get_db_filepath()
+        tablename = tablename if tablename else self.get_tablename()
+        with sqlite3.connect(db_filepath) as connection:
+            connection.execute(f"UPDATE {tablename} SET local_hash = ?, remote_hash = ? WHERE foldername = ?",
+                               (hashes[0], hashes[1], foldername))
+        self.notify()
+        return tuple(hashes)
+
+    def is_folder_in_sync(self, foldername):
+        """
+        O(1) sync check: both sides had the same Merkle root hash at their last scan.  
+        """
+        folder_data = self.get_folder_data(foldername).get(foldername)
+        if folder_data is None:
+            raise ValueError(f"Unknown folder: {foldername}")
+        return folder_data["local_hash"] is not None and folder_data["local_hash"] == folder_data["remote_hash"]
+
+
+    def get_folder_models(self, foldername):
+        """
+        New (local, remote) FolderModels of a tracked folder,  
+        set up with its ignore rules, hash algorithm, remote mode, mtime tolerance and the global hash cache.  
+        """
+        folder_data = self.get_folder_data(foldername).get(foldername)
+        if folder_data is None:
+            raise ValueError(f"Unknown folder: {foldername}")
+        ignore_rules = self.get_ignore_rules(foldername)
+        local_folder, remote_folder = (FolderModel(folder_data[key], ignore_rules=ignore_rules,
+                                                   mtime_tolerance_ns=mtime_tolerance_of(folder_data[key],
+                                                                                         folder_data["mtime_tolerance_ns"]),
+                                                   hash_algorithm=folder_data["hash_algorithm"], hash_cache=self.__hash_cache)
+                                       for key in ("local_path", "remote_path"))
+        remote_folder.set_pack_mode(folder_data["remote_mode"] == "pack")
+        return local_folder, remote_folder
+
+
+    ## SYNC
+
+    def plan_sync(self, foldername=None, scan=True):
+        """
+        Build the sync plan of a folder (default: the selected one), see sync.build_sync_plan.  
+        Both sides are scanned first, unless 'scan' is False (then their last scans are used).  
+        A watched local side is not rescanned: only the dirty paths journaled by its watcher are (see watch_folder).  
+        """
+        foldername = foldername if foldername else self.get_selected_folder()
+        local_folder, remote_folder = self.get_folder_models(foldername)
+        if scan:
+            watched = self.__watched_folders.get(foldername)
+            if watched is not None and watched.is_watching():
+                watched.apply_journal()
+            else:
+                local_folder.scan_folder()
+            remote_folder.scan_folder()
+        return build_sync_plan(local_folder, remote_folder)
+
+    def sync_folder(self, foldername=None, plan=None):
+        """
+        Synchronize both sides of a folder (default: the selected one):  
+        execute 'plan' (default: a new plan, see plan_sync) and update the registry.  
+        Returns the results of sync.execute_sync_plan.  
+        """
+        foldername = foldername if foldername else self.get_selected_folder()
+        if plan is None:
+            plan = self.plan_sync(foldername)
+        local_folder, remote_folder = self.get_folder_models(foldername)
+        results = execute_sync_plan(plan, local_folder, remote_folder, executor=self.__copy_executor)
+        folders = {"local": local_folder, "remote": remote_folder}
+        for target, (size, seconds) in throughput_samples(results).items():
+            self.__device_throughput.record(folders[target].get_path(), size, seconds)
+        pack_store = remote_folder.get_pack_store()
+        if pack_store is not None:
+            pack_store.compact()
+        self.update_folder_hashes(foldername)
+        return results
+
+    def dry_run_sync(self, foldername=None, plan=None, max_items=10):
+        """
+        Plan the sync of a folder (default: the selected one) without doing it:  
+        returns ('plan', sync.estimate_plan of it), the time estimate coming from the throughput  
+        measured by the previous syncs on each device. 'plan' defaults to a new plan from the last scans  
+        of both sides: only their tracking files are read, no file of the folder.  
+        """
+        foldername = foldername if foldername else self.get_selected_folder()
+        if plan is None:
+            plan = self.plan_sync(foldername, scan=False)
+        return plan, estimate_plan(plan, self.get_device_throughputs(foldername), max_items=max_items)
+
+    def get_device_throughputs(self, foldername):
+        """
+        {"local": bytes/s, "remote": bytes/s} measured on the devices of a folder's two sides (None if never measured).  
+        """
+        folder_data = self.get_folder_data(foldername).get(foldername)
+        if folder_data is None:
+            raise ValueError(f"Unknown folder: {foldername}")
+        return {side: self.__device_throughput.get(folder_data[side + "_path"]) for side in SIDES}
+
+
+    def get_duplicates(self, side="local", min_size=1):
+        """
+        Files with the same content across all the tracked folders, from their tracking files  
+        (nothing is rescanned). See ContentIndex.get_duplicates.  
+        """
+        for foldername in self.get_foldernames_list():
+            self.update_folder_hashes(foldername)
+        return self.__content_index.get_duplicates(side=side, min_size=min_size)
+
+
+    ## WATCHING
+
+    def watch_folder(self, foldername):
+        """
+        Start watching the local path of a tracked folder.  
+        Its changes are journaled in its tracking file, so a sync only processes the dirty paths  
+        (the whole tree at the first sync: what changed before the watch started is not known).  
+        """
+        if foldername in self.__watched_folders:
+            return self.__watched_folders[foldername]
+        folder_data = self.get_folder_data(foldername)
+        if foldername not in folder_data:
+            raise ValueError(f"Unknown folder: {foldername}")
+        local_path = folder_data[foldername]["local_path"]
+        folder = FolderModel(local_path,
+                             mtime_tolerance_ns=mtime_tolerance_of(local_path, folder_data[foldername]["mtime_tolerance_ns"]),
+                             ignore_rules=self.get_ignore_rules(foldername),
+                             hash_algorithm=folder_data[foldername]["hash_algorithm"],
+                             hash_cache=self.__hash_cache)
+        folder.start_watching()
+        self.__watched_folders[foldername] = folder
+        return folder
+
+    def unwatch_folder(self, foldername=None):
+        """
+        Stop watching a folder.  
+        If no folder is specified, stops all watchers.  
+        """
+        foldernames = [foldername] if foldername else list(self.__watched_folders)
+        for name in foldernames:
+            folder = self.__watched_folders.pop(name, None)
+            if folder is not None:
+                folder.stop_watching()
+
+    def get_watched_folder(self, foldername):
+        return self.__watched_folders.get(foldername)
+
+
 class FolderModel:
-    def __init__(self, path=None):
+    def __init__(self, path=None, mtime_tolerance_ns=0, ignore_rules=None, hash_workers=None,
+                 hash_algorithm=DEFAULT_HASH_ALGORITHM, hash_cache=None):
         self.__path = path
-        # TODO!(1) Add folder state
-        pass
+        self.__manifest = {} # folder state: {relative path: {"status", "last_sync", "hash", "size", "mtime_ns", "inode", "ctime_ns", "hash_algo", "fingerprint", "base_hash"}}
+        self.__mtime_tolerance_ns = mtime_tolerance_ns
+        self.__watcher = None
+        self.__ignore_rules = ignore_rules if ignore_rules is not None else IgnoreRules(DEFAULT_IGNORE_PATTERNS)
+        self.__throttle = HashThrottle() # hashing I/O budget, "fast" (unlimited) by default
+        self.__hash_pool = HashPool(max_workers=hash_workers, throttle=self.__throttle)
+        self.__hash_algorithm = None
+        self.set_hash_algorithm(hash_algorithm)
+        self.__hash_cache = hash_cache # global HashCache, checked before hashing a file
+        self.__pack_mode = False # small files written to the pack store, see packstore.py
     
     def get_path(self):
         return self.__path
 
     def set_path(self, new_path):
+        self.stop_watching()
         self.__path = new_path
+        self.__manifest = {}
+
+    def get_manifest(self):
+        return self.__manifest
 
-    def scan_folder(self):
-        # TODO!(0)
-        # TODO!(1) Add folder state, and update it when scanning
-        pass
+    def get_mtime_tolerance_ns(self):
+        return self.__mtime_tolerance_ns
 
-    def initialize_tracking_file(self, path):
+    def set_mtime_tolerance_ns(self, mtime_tolerance_ns):
         """
-        Not implemented yet.  
+        Set how far (in ns) mtime/ctime may drift before a file is considered changed.  
+        Use FAT_MTIME_TOLERANCE_NS for FAT/exFAT drives (see mtime_tolerance_of).  
         """
-        # TODO!(0)
-        # Check if it exists
-        # If not then create it
-        raise NotImplementedError
+        self.__mtime_tolerance_ns = mtime_tolerance_ns
+
+    def get_ignore_rules(self):
+        return self.__ignore_rules
+
+    def set_ignore_rules(self, ignore_rules):
+        """
+        Set the compiled .syncignore rules (syncignore.IgnoreRules) used by scans and the watcher.  
+        """
+        self.__ignore_rules = ignore_rules if ignore_rules is not None else IgnoreRules(DEFAULT_IGNORE_PATTERNS)
+
+    def get_io_mode(self):
+        return self.__throttle.get_mode()
+
+    def set_io_mode(self, mode, bytes_per_second=None, files_per_second=None):
+        """
+        Switch the hashing path between "fast" and "background" mode  
+        (limited bytes/s and files/s, idle I/O priority). Can be called while a scan is running.  
+        """
+        self.__throttle.set_budget(bytes_per_second=bytes_per_second, files_per_second=files_per_second)
+        self.__throttle.set_mode(mode)
+
+    def get_hash_workers(self):
+        return self.__hash_pool.get_max_workers()
+
+    def set_hash_workers(self, hash_workers):
+        """
+        Set the number of threads hashing files during scans (None: one per core).  
+        """
+        self.__hash_pool.set_max_workers(hash_workers)
+
+    def get_hash_algorithm(self):
+        return self.__hash_algorithm
+
+    def set_hash_algorithm(self, hash_algorithm):
+        """
+        Set the algorithm of the hashes computed from now on (one of hashing.HASH_ALGORITHMS).  
+        Files already hashed with another algorithm keep their hash until they change  
+        (see rehash_outdated to convert them in the background).  
+        """
+        hash_algorithm = hash_algorithm if hash_algorithm else DEFAULT_HASH_ALGORITHM
+        if hash_algorithm not in HASH_ALGORITHMS:
+            raise ValueError(f"Unknown hash algorithm: {hash_algorithm}")
+        self.__hash_algorithm = hash_algorithm
+
+    def get_hash_cache(self):
+        return self.__hash_cache
+
+    def set_hash_cache(self, hash_cache):
+        """
+        Set the global hash cache (hashcache.HashCache) checked before reading a file, or None.  
+        """
+        self.__hash_cache = hash_cache
+
+    def get_tracking_filepath(self):
+        if not self.__path:
+            raise ValueError("Folder path not set.")
+        return os.path.join(self.__path, TRACKING_FILENAME)
+
+    def get_pack_mode(self):
+        return self.__pack_mode
+
+    def set_pack_mode(self, pack_mode):
+        """
+        Store the small files copied into this folder in pack files (see packstore.py) rather than natively.  
+        """
+        self.__pack_mode = pack_mode
+
+    def get_pack_store(self):
+        """
+        Pack store of the folder (packstore.PackStore): in pack mode, or while files packed  
+        before a switch to native mode remain. None otherwise.  
+        """
+        if not self.__path:
+            return None
+        pack_store = PackStore(self.__path)
+        return pack_store if self.__pack_mode or pack_store.exists() else None
+
+    def stat_files(self, filenames):
+        """
+        Stat tuples of known files ({relative path: {"size", "mtime_ns", "inode", "ctime_ns", "dev"}}),  
+        native or packed, like scanner.stat_known_files. Missing files are left out.  
+        """
+        files = stat_known_files(self.__path, filenames)
+        pack_store = self.get_pack_store()
+        if pack_store is not None:
+            packed = pack_store.get_file_info([filename for filename in filenames if filename not in files])
+            for filename, info in packed.items():
+                files[filename] = {key: info[key] for key in ("size", "mtime_ns", "inode", "ctime_ns", "dev")}
+        return files
+
+    def get_transfer_journal(self):
+        """
+        Journal of the resumable copies into this folder (see transfer.copy_file).  
+        """
+        return TransferJournal(self.initialize_tracking_file(), self.__path)
+
+    def is_unchanged(self, old_info, new_info):
+        """
+        Compare the stat tuples (size, mtime_ns, inode, ctime_ns) of a file.  
+        True if the file can keep its previous hash (or fingerprint).  
+        """
+        if not (old_info.get("hash") or old_info.get("fingerprint")) or old_info.get("mtime_ns") is None:
+            return False
+        tolerance = self.__mtime_tolerance_ns
+        return (old_info["size"] == new_info["size"]
+                # no inode number (0) in the rows listed on Windows by older versions
+                and (old_info["inode"] == new_info["inode"] or not old_info["inode"] or not new_info["inode"])
+                and abs(old_info["mtime_ns"] - new_info["mtime_ns"]) <= tolerance
+                and abs(old_info["ctime_ns"] - new_info["ctime_ns"]) <= tolerance)
+
+    def scan_folder(self, max_workers=None, mode="stat", use_dir_cache=True, checkpoint_interval=CHECKPOINT_INTERVAL):
+        """
+        Recursively scan the folder, listing subdirectories in parallel,  
+        and update the tracking file.  
+        mode="stat": only files whose stat tuple changed are re-hashed.  
+        mode="full": every file is re-hashed.  
+        mode="quick": files whose stat tuple changed are only fingerprinted (size + a few samples),  
+        for a status within seconds; verify_fingerprints() computes their full hashes later.  
+        use_dir_cache: directories whose mtime is unchanged since the last scan are not listed again,  
+        only their known files are stat-ed.  
+        Every 'checkpoint_interval' seconds, the directories listed and the hashes computed so far  
+        are saved in the tracking file: if the scan is interrupted (app closed, drive unplugged),  
+        the next scan resumes from there.  
+        Updates the folder state and returns it.  
+        """
+        if mode not in SCAN_MODES:
+            raise ValueError(f"Unknown scan mode: {mode}")
+        if not self.__path:
+            raise ValueError("Folder path not set.")
+        self.initialize_tracking_file()
+        old_data = self.get_tracking_data()
+        pack_store = self.get_pack_store()
+        packed = pack_store.get_file_info() if pack_store is not None else {}
+        ignore_digest = self.__ignore_rules.get_digest()
+        # the cached directory listings were filtered by the rules of the last scan
+        use_dir_cache = use_dir_cache and self.get_setting("ignore_digest") == ignore_digest
+        dir_cache = {}
+        if use_dir_cache:
+            # packed files are not in the directory listings
+            dir_cache = self.get_dir_cache({filename: info for filename, info in old_data.items() if filename not in packed}
+                                           if packed else old_data)
+        checkpoint = ScanCheckpoint(self.get_tracking_filepath(), ignore_digest, checkpoint_interval)
+        checkpoint_dirs, checkpoint_files = checkpoint.load()
+        if DEBUG and checkpoint_dirs:
+            print(f"Resuming scan of {self.__path}: {len(checkpoint_dirs)} directories, {len(checkpoint_files)} files already done.")
+        dir_cache.update(checkpoint_dirs)
+        new_data, dirs = scan_tree(self.__path, max_workers=max_workers, exclude=SCAN_EXCLUDE,
+                                   dir_cache=dir_cache, with_dirs=True, ignore=self.__ignore_rules,
+                                   on_directory=checkpoint.add_directory)
+        # packed files come with their hash, computed when they were packed (a native copy takes precedence)
+        packed = {filename: info for filename, info in packed.items()
+                  if filename not in new_data and not self.__ignore_rules.is_ignored(filename)}
+        new_data.update(packed)
+        now = datetime.now().isoformat()
+        to_hash = []
+        for filename, info in new_data.items():
+            if filename not in packed and not self.__reuse_hash(info, old_data.get(filename), mode,
+                                                                checkpoint_files.get(filename)):
+                to_hash.append((filename, os.path.join(self.__path, filename), info["size"]))
+        to_hash = self.__use_hash_cache(new_data, to_hash, mode)
+        hashed = {}
+        for filename, file_hash, fingerprint in self.__hash_pool.hash_files(to_hash, self.__hash_algorithm,
+                                                                           quick=(mode == "quick")):
+            new_data[filename]["hash"] = file_hash
+            new_data[filename]["fingerprint"] = fingerprint
+            new_data[filename]["hash_algo"] = self.__hash_algorithm
+            hashed[filename] = new_data[filename]
+            checkpoint.add_file(filename, new_data[filename])
+        if self.__hash_cache is not None:
+            self.__hash_cache.put_digests(hashed, self.__hash_algorithm)
+        for filename, info in new_data.items():
+            self.__set_file_status(info, old_data.get(filename), now)
+        for filename, info in old_data.items():
+            if filename not in new_data:
+                info = self.__missing_file_info(filename, info)
+                if info is not None:
+                    new_data[filename] = info
+        self.save_tracking_data(new_data)
+        self.__finish_scan(dirs, ignore_digest, checkpoint)
+        self.__manifest = new_data
+        return self.__manifest
+
+    def __finish_scan(self, dirs, ignore_digest, checkpoint):
+        """
+        Bookkeeping of a complete scan, once its files are saved: the directories state  
+        (for the next 'dir_cache', None if already saved), the ignore rules it was filtered with,  
+        the dropped checkpoint, the Merkle tree and the global hash cache eviction.  
+        """
+        if dirs is not None:
+            self.save_dir_data(dirs)
+        self.set_setting("ignore_digest", ignore_digest)
+        checkpoint.clear()
+        self.update_merkle_tree()
+        if self.__hash_cache is not None:
+            self.__hash_cache.evict()
+
+    def scan_folder_streaming(self, mode="stat", batch_size=STREAM_BATCH_SIZE):
+        """
+        Scan the folder with bounded memory, for very large trees.  
+        The tree is walked in sorted path order and merge-joined with the tracking data  
+        read in the same order; the result is written in batches to a staging table  
+        which then replaces tracked_files (and likewise for the directories state, tracked_dirs).  
+        Neither state is ever loaded whole.  
+        The folder state (manifest) is not kept.  
+        Returns the number of files per status.  
+        """
+        if mode not in SCAN_MODES:
+            raise ValueError(f"Unknown scan mode: {mode}")
+        path = self.initialize_tracking_file()
+        now = datetime.now().isoformat()
+        counts = {}
+        dir_rows = [] # listed directories not written yet
+        insert_dir = "INSERT INTO tracked_dirs_staging (dirname, mtime_ns, entry_count) VALUES (?, ?, ?)"
+        def add_directory(rel_dir, files, subdirs, dir_info):
+            if dir_info is not None:
+                dir_rows.append((rel_dir, dir_info["mtime_ns"], dir_info["entry_count"]))
+            if len(dir_rows) >= batch_size:
+                connection.executemany(insert_dir, dir_rows)
+                dir_rows.clear()
+        insert = f"INSERT INTO tracked_files_staging ({TRACKED_FILES_COLUMNS}) VALUES ({TRACKED_FILES_PLACEHOLDERS})"
+        with sqlite3.connect(path) as connection:
+            connection.execute("DROP TABLE IF EXISTS tracked_files_staging")
+            create_tracked_files_table(connection, "tracked_files_staging")
+            connection.execute("DROP TABLE IF EXISTS tracked_dirs_staging")
+            connection.execute("CREATE TABLE tracked_dirs_staging (dirname TEXT PRIMARY KEY, mtime_ns INTEGER, entry_count INTEGER NOT NULL)")
+            old_rows = connection.execute(f"SELECT {TRACKED_FILES_COLUMNS} FROM tracked_files ORDER BY filename")
+            old_stream = ((row[0], tracking_info_from_row(row)) for row in old_rows)
+            new_stream = iter_tree(self.__path, exclude=SCAN_EXCLUDE, ignore=self.__ignore_rules,
+                                   on_directory=add_directory)
+            pack_store = self.get_pack_store()
+            packed_stream = pack_store.iter_file_info() if pack_store is not None else ()
+            batch = [] # (filename, info, old_info, scanned): the scanned files are refreshed when the batch is written
+            for filename, old_info, info, packed_info in merge_join(old_stream, new_stream, packed_stream):
+                scanned = info is not None
+                if info is None and packed_info is not None and not self.__ignore_rules.is_ignored(filename):
+                    # packed files come with their hash
+                    info = self.__set_file_status(packed_info, old_info, now)
+                elif info is None and old_info is not None:
+                    info = self.__missing_file_info(filename, old_info)
+                if info is None:
+                    continue # dropped, or an ignored packed file never tracked
+                batch.append((filename, info, old_info, scanned))
+                if len(batch) >= batch_size:
+                    self.__write_stream_batch(connection, insert, batch, mode, now, counts)
+                    connection.executemany(insert_dir, dir_rows)
+                    dir_rows.clear()
+                    batch = []
+            self.__write_stream_batch(connection, insert, batch, mode, now, counts)
+            connection.executemany(insert_dir, dir_rows)
+            old_rows.close()
+            connection.execute("DROP TABLE tracked_files")
+            connection.execute("ALTER TABLE tracked_files_staging RENAME TO tracked_files")
+            connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS tracked_files_filename ON tracked_files (filename)")
+            connection.execute("DELETE FROM tracked_dirs")
+            connection.execute("INSERT INTO tracked_dirs (dirname, mtime_ns, entry_count) SELECT dirname, mtime_ns, entry_count FROM tracked_dirs_staging")
+            connection.execute("DROP TABLE tracked_dirs_staging")
+        ignore_digest = self.__ignore_rules.get_digest()
+        self.__finish_scan(None, ignore_digest, ScanCheckpoint(path, ignore_digest))
+        self.__manifest = {}
+        return counts
+
+    def __write_stream_batch(self, connection, insert, batch, mode, now, counts):
+        """
+        Write a batch of the streaming scan to the staging table, once its scanned files are refreshed.  
+        """
+        self.__refresh_files([(filename, info, old_info) for filename, info, old_info, scanned in batch if scanned],
+                             mode, now)
+        for _, info, _, _ in batch:
+            counts[info["status"]] = counts.get(info["status"], 0) + 1
+        connection.executemany(insert, [tracking_row_from_info(filename, info, now) for filename, info, _, _ in batch])
+
+    def rehash_outdated(self, limit=None):
+        """
+        Rehash with the folder's algorithm the files still hashed with another one  
+        (at most 'limit' files per call, e.g. from a background task in "background" I/O mode).  
+        Files changed since their last scan are left to the next scan.  
+        Returns the number of files rehashed.  
+        """
+        return self.__rehash_where(f"coalesce(hash_algo, '{LEGACY_HASH_ALGORITHM}') != ?",
+                                   (self.__hash_algorithm,), limit)
+
+    def verify_fingerprints(self, limit=None, io_mode="background"):
+        """
+        Compute the full hashes of the files only fingerprinted by a "quick" scan  
+        (at most 'limit' files per call). Runs in 'io_mode' (low priority by default),  
+        the folder's I/O mode is restored afterwards.  
+        Files changed since their last scan are left to the next scan.  
+        Returns the number of files verified.  
+        """
+        previous_mode = self.get_io_mode()
+        self.__throttle.set_mode(io_mode)
+        try:
+            return self.__rehash_where("hash = '' AND fingerprint != ''", (), limit)
+        finally:
+            self.__throttle.set_mode(previous_mode)
+
+    def __rehash_where(self, condition, params, limit):
+        """
+        Compute the full hashes of the tracked files matching the SQL 'condition',  
+        if their stat tuple didn't change since they were scanned.  
+        A base hash (content at the last sync) tagged from the old hash is re-tagged from the new one,  
+        so the three-way comparison of the sync still applies to the file.  
+        """
+        path = self.initialize_tracking_file()
+        sql = f"SELECT {TRACKED_FILES_COLUMNS} FROM tracked_files WHERE status NOT IN ('deleted', 'error') AND {condition}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params += (limit,)
+        with sqlite3.connect(path) as connection:
+            rows = {row[0]: tracking_info_from_row(row) for row in connection.execute(sql, params)}
+        current = stat_known_files(self.__path, rows)
+        to_hash = [(filename, os.path.join(self.__path, filename), info["size"])
+                   for filename, info in current.items() if self.is_unchanged(rows[filename], info)]
+        updated = {}
+        for filename, file_hash, fingerprint in self.__hash_pool.hash_files(to_hash, self.__hash_algorithm):
+            if file_hash:
+                info = dict(rows[filename], hash=file_hash, fingerprint=fingerprint, hash_algo=self.__hash_algorithm)
+                if info["base_hash"] is not None and info["base_hash"] == content_tag(rows[filename]):
+                    info["base_hash"] = content_tag(info)
+                updated[filename] = info
+        if updated:
+            self.save_tracking_entries(updated)
+            self.update_merkle_tree()
+        return len(updated)
+
+    def iter_tracking_data(self, path=None):
+        """
+        Yield (filename, info) from the tracking file, in sorted filename order,  
+        without loading the whole table.  
+        """
+        path = path if path else self.get_tracking_filepath()
+        connection = sqlite3.connect(path)
+        try:
+            for row in connection.execute(f"SELECT {TRACKED_FILES_COLUMNS} FROM tracked_files ORDER BY filename"):
+                yield row[0], tracking_info_from_row(row)
+        finally:
+            connection.close()
+
+    def iter_tracking_pairs(self, other, skip=None, changed_only=False):
+        """
+        Yield (filename, info, other_info) for the files tracked by this folder or by 'other' (FolderModel),  
+        in sorted filename order, None standing for the side not tracking the file.  
+        Both tracking files are joined by SQLite: 'skip' is an SQL condition on the rows 'a' (this side)  
+        and 'b' (the other side) of the pairs not worth yielding, e.g. the files identical on both sides.  
+        With 'changed_only', the subtrees whose Merkle hashes are the same on both sides are left out  
+        (their files are identical on both sides): only the directories that differ are joined.  
+        """
+        columns = ("filename",) + TRACKED_FILES_FIELDS
+        selected = ", ".join(f"a.{column}" for column in columns) + ", " + ", ".join(f"b.{column}" for column in columns)
+        keep = f"coalesce(({skip}), 0) = 0" if skip else "1"
+        connection = sqlite3.connect(self.get_tracking_filepath())
+        try:
+            connection.execute("ATTACH DATABASE ? AS other", (other.get_tracking_filepath(),))
+            ranges = [("", PATH_RANGE_END)] # filename ranges to join: [lo, hi)
+            if changed_only:
+                dirs = dict(connection.execute("SELECT dirname, hash FROM main.dir_hashes"))
+                other_dirs = dict(connection.execute("SELECT dirname, hash FROM other.dir_hashes"))
+                if dirs and other_dirs:
+                    ranges = merkle_diff_ranges(dirs, other_dirs)
+            connection.execute("CREATE TEMP TABLE IF NOT EXISTS pair_ranges (lo TEXT NOT NULL, hi TEXT NOT NULL)")
+            connection.execute("DELETE FROM temp.pair_ranges")
+            connection.executemany("INSERT INTO temp.pair_ranges (lo, hi) VALUES (?, ?)", ranges)
+            rows = connection.execute(f"""
+                SELECT coalesce(a.filename, b.filename) AS path, {selected}
+                FROM temp.pair_ranges AS r
+                CROSS JOIN main.tracked_files AS a ON a.filename >= r.lo AND a.filename < r.hi
+                LEFT JOIN other.tracked_files AS b ON b.filename = a.filename
+                WHERE {keep}
+                UNION ALL
+                SELECT b.filename AS path, {selected}
+                FROM temp.pair_ranges AS r
+                CROSS JOIN other.tracked_files AS b ON b.filename >= r.lo AND b.filename < r.hi
+                LEFT JOIN main.tracked_files AS a ON a.filename = b.filename
+                WHERE a.filename IS NULL AND {keep}
+                ORDER BY path
+            """)
+            width = len(columns)
+            for row in rows:
+                yield (row[0],
+                       tracking_info_from_row(row[1:1+width]) if row[1] is not None else None,
+                       tracking_info_from_row(row[1+width:]) if row[1+width] is not None else None)
+        finally:
+            connection.close()
+
+    def __missing_file_info(self, filename, old_info):
+        """
+        Tracking info of a file the scan did not find anymore: marked as 'deleted'.  
+        A 'deleted' row holding a base hash is kept until a sync has used it (see sync.drop_settled_deletions):  
+        it is what tells a deletion from a file never tracked on this side.  
+        Returns None if its row must be dropped instead: already 'deleted' without a base hash,  
+        or now ignored (a newly ignored file must not be deleted on the other side).  
+        """
+        if self.__ignore_rules.is_ignored(filename):
+            return None
+        if old_info["status"] == "deleted":
+            return old_info if old_info.get("base_hash") else None
+        old_info["status"] = "deleted"
+        return old_info
+
+    def __reuse_hash(self, info, old_info, mode, checkpoint_info=None):
+        """
+        Copy into the freshly scanned 'info' of a file a hash that can be reused without reading it.  
+        'checkpoint_info' is the file as hashed by an interrupted run of this scan, if any.  
+        An unchanged file keeps its hash even if it was made with another algorithm than the  
+        folder's one: switching algorithms doesn't rehash the whole folder at once.  
+        Only the "quick" mode reuses a fingerprint without a full hash.  
+        Returns False if the file must be hashed.  
+        """
+        def reusable(reused):
+            return self.is_unchanged(reused, info) and (mode == "quick" or reused["hash"])
+        if old_info is not None and mode != "full" and reusable(old_info):
+            reused = old_info
+        elif (checkpoint_info is not None and checkpoint_info.get("hash_algo") == self.__hash_algorithm
+                and reusable(checkpoint_info)):
+            reused = checkpoint_info
+        else:
+            return False
+        info["hash"] = reused["hash"]
+        info["fingerprint"] = reused["fingerprint"]
+        info["hash_algo"] = reused["hash_algo"] or LEGACY_HASH_ALGORITHM
+        return True
+
+    def __use_hash_cache(self, data, to_hash, mode):
+        """
+        Take from the global hash cache the hashes of the files of 'to_hash' ((filename, path, size) list),  
+        filling their info in 'data'. Returns the files still to hash.  
+        The "full" mode, which is meant to read every file, doesn't use the cache.  
+        """
+        if not to_hash or self.__hash_cache is None or mode == "full":
+            return to_hash
+        cached = self.__hash_cache.get_digests({file[0]: data[file[0]] for file in to_hash}, self.__hash_algorithm)
+        remaining = []
+        for file in to_hash:
+            digests = cached.get(file[0])
+            if digests is None or not (digests[0] or mode == "quick"):
+                remaining.append(file)
+                continue
+            info = data[file[0]]
+            info["hash"], info["fingerprint"] = digests
+            info["hash_algo"] = self.__hash_algorithm
+        return remaining
+
+    def __refresh_files(self, entries, mode, now):
+        """
+        Complete the freshly scanned infos of 'entries' ((filename, info, old_info) list)  
+        with their hash, status and last_sync, re-hashing only the files that need it.  
+        The global hash cache is looked up and updated once for the whole batch.  
+        Returns {filename: info}.  
+        """
+        data = {filename: info for filename, info, _ in entries}
+        to_hash = [(filename, os.path.join(self.__path, filename), info["size"])
+                   for filename, info, old_info in entries if not self.__reuse_hash(info, old_info, mode)]
+        to_hash = self.__use_hash_cache(data, to_hash, mode)
+        hashed = {}
+        for filename, file_hash, fingerprint in self.__hash_pool.hash_files(to_hash, self.__hash_algorithm,
+                                                                           quick=(mode == "quick")):
+            info = data[filename]
+            info["hash"] = file_hash
+            info["fingerprint"] = fingerprint
+            info["hash_algo"] = self.__hash_algorithm
+            hashed[filename] = info
+        if hashed and self.__hash_cache is not None:
+            self.__hash_cache.put_digests(hashed, self.__hash_algorithm)
+        for filename, info, old_info in entries:
+            self.__set_file_status(info, old_info, now)
+        return data
+
+    def __set_file_status(self, info, old_info, now):
+        """
+        Set the status and last_sync of a file, once its hash is known.  
+        The status tells what changed since the last scan; the base hash (content at the last sync) is kept.  
+        """
+        same_algorithm = old_info is not None and info["hash_algo"] == (old_info["hash_algo"] or LEGACY_HASH_ALGORITHM)
+        if not info["hash"] and not info.get("fingerprint"):
+            info["status"] = "error"
+        elif old_info is None or old_info["status"] == "deleted":
+            info["status"] = "new"
+        elif same_algorithm and info["hash"] and old_info["hash"]:
+            info["status"] = "synced" if info["hash"] == old_info["hash"] else "modified"
+        elif same_algorithm and info.get("fingerprint") and old_info["fingerprint"]:
+            info["status"] = "synced" if info["fingerprint"] == old_info["fingerprint"] else "modified"
+        else:
+            # hashes that can't be compared (other algorithm, full hash against fingerprint):
+            # fall back on the stat tuple
+            info["status"] = "synced" if self.is_unchanged(old_info, info) else "modified"
+        info["last_sync"] = old_info["last_sync"] if old_info is not None else now
+        info["base_hash"] = old_info.get("base_hash") if old_info is not None else None
+        return info
+
+    def initialize_tracking_file(self, path=None):
+        """
+        Create the tracking file of the folder if it doesn't exist,  
+        and add the columns missing from older tracking files.  
+        Default path is the tracking file at the root of the folder.  
+        """
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            create_tracked_files_table(connection)
+            # tracking files created by older versions only have status, last_sync and hash
+            add_missing_columns(connection, "tracked_files", {
+                "size": "INTEGER",
+                "mtime_ns": "INTEGER",
+                "inode": "INTEGER",
+                "ctime_ns": "INTEGER",
+                "hash_algo": f"TEXT DEFAULT '{LEGACY_HASH_ALGORITHM}'",
+                "fingerprint": "TEXT",
+                "base_hash": "TEXT"
+            })
+            connection.execute("CREATE UNIQUE INDEX IF NOT EXISTS tracked_files_filename ON tracked_files (filename)")
+            # journal of the paths reported by the folder watcher since the last sync
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS dirty_paths (
+                    path TEXT PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    event TEXT NOT NULL,
+                    time TEXT NOT NULL
+                )
+            """) # nb - kind: 'file' or 'subtree'
+            # directories state at the last scan, to skip listing the unchanged ones
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS tracked_dirs (
+                    dirname TEXT PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    entry_count INTEGER NOT NULL
+                )
+            """) # nb - mtime_ns is NULL when too recent to be trusted
+            # progress of the running (or interrupted) scan, see ScanCheckpoint
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS scan_checkpoint_dirs (
+                    dirname TEXT PRIMARY KEY,
+                    mtime_ns INTEGER,
+                    entry_count INTEGER NOT NULL,
+                    subdirs TEXT NOT NULL
+                )
+            """) # nb - subdirs: JSON list of the subdirectories paths
+            create_tracked_files_table(connection, "scan_checkpoint_files")
+            add_missing_columns(connection, "scan_checkpoint_files", {"hash_algo": "TEXT", "fingerprint": "TEXT", "base_hash": "TEXT"})
+            # Merkle tree of the folder, see update_merkle_tree
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS dir_hashes (
+                    dirname TEXT PRIMARY KEY,
+                    hash TEXT NOT NULL,
+                    file_count INTEGER NOT NULL
+                )
+            """)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS tracking_settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            """)
+            # progress of the interrupted copies into the folder, see TransferJournal
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS partial_transfers (
+                    filename TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    chunk_size INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    chunk_hashes TEXT NOT NULL
+                )
+            """) # nb - size and mtime_ns: of the source file; chunk_hashes: JSON list
+        return path
     
-    def delete_tracking_file(self, path):
+    def delete_tracking_file(self, path=None):
         """
-        Not implemented yet.  
+        Delete the tracking file of the folder (and its SQLite side files).  
         """
-        # TODO!(0)
-        raise NotImplementedError
+        path = path if path else self.get_tracking_filepath()
+        for filepath in (path, path+"-journal", path+"-wal", path+"-shm"):
+            if os.path.exists(filepath):
+                try:
+                    os.remove(filepath)
+                except OSError as e:
+                    raise OSError(f"Could not delete tracking file {filepath}: {e}")
+        self.__manifest = {}
+
+    def get_tracking_data(self, path=None):
+        """
+        Read the files tracking data from the tracking file.  
+        Returns {filename: {"status", "last_sync", "hash", "size", "mtime_ns", "inode", "ctime_ns", "hash_algo", "fingerprint"}}  
+        """
+        path = path if path else self.get_tracking_filepath()
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Tracking file {path} does not exist.")
+        with sqlite3.connect(path) as connection:
+            cursor = connection.execute(f"SELECT {TRACKED_FILES_COLUMNS} FROM tracked_files")
+            data = {row[0]: tracking_info_from_row(row) for row in cursor.fetchall()}
+        return data
+
+    def save_tracking_data(self, data, path=None):
+        """
+        Save the files tracking data to the tracking file.  
+        Overwrites existing data.  
+        """
+        path = path if path else self.get_tracking_filepath()
+        now = datetime.now().isoformat()
+        with sqlite3.connect(path) as connection:
+            connection.execute("DELETE FROM tracked_files")
+            connection.executemany(f"INSERT INTO tracked_files ({TRACKED_FILES_COLUMNS}) VALUES ({TRACKED_FILES_PLACEHOLDERS})",
+                                   (tracking_row_from_info(filename, info, now) for filename, info in data.items()))
+
+    def get_tracking_entries(self, filenames=(), subtree=None, path=None):
+        """
+        Read the tracking data of some files only:  
+        the files listed in 'filenames', plus every file under the directory 'subtree' ("" for all).  
+        """
+        path = path if path else self.get_tracking_filepath()
+        columns = TRACKED_FILES_COLUMNS
+        rows = []
+        with sqlite3.connect(path) as connection:
+            for filename in filenames:
+                rows += connection.execute(f"SELECT {columns} FROM tracked_files WHERE filename = ?", (filename,)).fetchall()
+            if subtree == "":
+                rows += connection.execute(f"SELECT {columns} FROM tracked_files").fetchall()
+            elif subtree is not None:
+                # '0' is the character right after '/': this range is every path under 'subtree/'
+                rows += connection.execute(f"SELECT {columns} FROM tracked_files WHERE filename >= ? AND filename < ?",
+                                           (subtree+"/", subtree+"0")).fetchall()
+        return {row[0]: tracking_info_from_row(row) for row in rows}
+
+    def get_deleted_entries(self, path=None):
+        """
+        Read the tracking data of the files marked 'deleted'.  
+        """
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            rows = connection.execute(f"SELECT {TRACKED_FILES_COLUMNS} FROM tracked_files WHERE status = 'deleted'").fetchall()
+        return {row[0]: tracking_info_from_row(row) for row in rows}
+
+    def save_tracking_entries(self, data, path=None):
+        """
+        Insert or update the tracking data of some files, leaving the other rows untouched.  
+        """
+        path = path if path else self.get_tracking_filepath()
+        now = datetime.now().isoformat()
+        with sqlite3.connect(path) as connection:
+            connection.executemany(f"INSERT OR REPLACE INTO tracked_files ({TRACKED_FILES_COLUMNS}) VALUES ({TRACKED_FILES_PLACEHOLDERS})",
+                                   (tracking_row_from_info(filename, info, now) for filename, info in data.items()))
+        if self.__manifest:
+            self.__manifest.update(data)
+
+
+    def delete_tracking_entries(self, filenames, path=None):
+        """
+        Remove some files from the tracking data.  
+        """
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            connection.executemany("DELETE FROM tracked_files WHERE filename = ?",
+                                   ((filename,) for filename in filenames))
+        for filename in filenames:
+            self.__manifest.pop(filename, None)
+
+    def get_setting(self, key, default=None, path=None):
+        """
+        Read a value stored in the tracking file (scan bookkeeping).  
+        """
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            row = connection.execute("SELECT value FROM tracking_settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row is not None else default
+
+    def set_setting(self, key, value, path=None):
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            connection.execute("INSERT OR REPLACE INTO tracking_settings (key, value) VALUES (?, ?)", (key, value))
+
+
+    ## MERKLE TREE
+
+    def update_merkle_tree(self, path=None):
+        """
+        Recompute the per-directory hashes of the folder (dir_hashes table)  
+        from the tracked files, in a single streaming pass.  
+        Returns the root hash.  
+        """
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            files = connection.execute(f"SELECT filename, {TAGGED_HASH} FROM tracked_files WHERE status != 'deleted' ORDER BY filename")
+            connection.execute("DELETE FROM dir_hashes")
+            connection.executemany("INSERT INTO dir_hashes (dirname, hash, file_count) VALUES (?, ?, ?)",
+                                   compute_tree_hashes(files))
+        return self.get_root_hash(path)
+
+    def get_root_hash(self, path=None):
+        """
+        Merkle root hash of the folder: equal root hashes mean identical contents.  
+        """
+        return self.get_dir_hash("", path)
+
+    def get_dir_hash(self, dirname, path=None):
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            row = connection.execute("SELECT hash FROM dir_hashes WHERE dirname = ?", (dirname,)).fetchone()
+        return row[0] if row is not None else None
+
+    def get_dir_children(self, dirname, path=None):
+        """
+        Direct children of a directory in the Merkle tree.  
+        Returns (files, subdirs), both {relative path: hash}; file hashes are tagged  
+        with their algorithm ("algorithm:hash").  
+        """
+        path = path if path else self.get_tracking_filepath()
+        prefix = dirname + "/" if dirname else ""
+        # range of the paths under 'dirname/', keeping those with no further '/'
+        where = "WHERE instr(substr({0}, ?), '/') = 0" if not dirname else \
+                "WHERE {0} >= ? AND {0} < ? AND instr(substr({0}, ?), '/') = 0"
+        params = (len(prefix)+1,) if not dirname else (prefix, dirname+"0", len(prefix)+1)
+        with sqlite3.connect(path) as connection:
+            files = dict(connection.execute(f"SELECT filename, {TAGGED_HASH} FROM tracked_files " + where.format("filename")
+                                            + " AND status != 'deleted'", params))
+            subdirs = dict(connection.execute("SELECT dirname, hash FROM dir_hashes " + where.format("dirname")
+                                              + " AND dirname != ''", params))
+        return files, subdirs
+
+    def diff_tree(self, other):
+        """
+        Compare the Merkle trees of this folder and 'other' (another FolderModel),  
+        descending only into the directories whose hashes differ.  
+        Yields the relative paths of the files that differ (or exist on one side only).  
+        A file hashed with different algorithms on both sides is reported as differing:  
+        use the same algorithm on both sides (see rehash_outdated).  
+        """
+        if self.get_root_hash() == other.get_root_hash():
+            return
+        stack = [""]
+        while stack:
+            dirname = stack.pop()
+            files, subdirs = self.get_dir_children(dirname)
+            other_files, other_subdirs = other.get_dir_children(dirname)
+            for filename in sorted(files.keys() | other_files.keys()):
+                if files.get(filename) != other_files.get(filename):
+                    yield filename
+            for subdir in sorted(subdirs.keys() | other_subdirs.keys(), reverse=True):
+                if subdir not in subdirs or subdir not in other_subdirs:
+                    # whole subtree on one side only
+                    side = self if subdir in subdirs else other
+                    entries = side.get_tracking_entries(subtree=subdir)
+                    yield from sorted(filename for filename, info in entries.items() if info["status"] != "deleted")
+                elif subdirs[subdir] != other_subdirs[subdir]:
+                    stack.append(subdir)
+
+
+    def get_dir_data(self, path=None):
+        """
+        Read the directories state from the tracking file.  
+        Returns {relative dir: {"mtime_ns", "entry_count"}}  
+        """
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            cursor = connection.execute("SELECT dirname, mtime_ns, entry_count FROM tracked_dirs")
+            return {row[0]: {"mtime_ns": row[1], "entry_count": row[2]} for row in cursor.fetchall()}
+
+    def save_dir_data(self, dirs, path=None):
+        """
+        Save the directories state to the tracking file.  
+        Overwrites existing data.  
+        """
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            connection.execute("DELETE FROM tracked_dirs")
+            connection.executemany("""
+                INSERT INTO tracked_dirs (dirname, mtime_ns, entry_count)
+                VALUES (?, ?, ?)
+            """, ((dirname, info["mtime_ns"], info["entry_count"]) for dirname, info in dirs.items()))
+
+    def get_dir_cache(self, tracking_data):
+        """
+        Build the scanner's directory cache from the last scan:  
+        {relative dir: {"mtime_ns", "entry_count", "files", "subdirs"}}  
+        Directories whose mtime could not be trusted are left out (they are always listed).  
+        """
+        dir_cache = {dirname: {"mtime_ns": info["mtime_ns"],
+                               "entry_count": info["entry_count"],
+                               "files": [],
+                               "subdirs": []}
+                     for dirname, info in self.get_dir_data().items() if info["mtime_ns"] is not None}
+        for filename, info in tracking_data.items():
+            parent = filename.rpartition("/")[0]
+            if info["status"] != "deleted" and parent in dir_cache:
+                dir_cache[parent]["files"].append(filename)
+        for dirname in self.get_dir_data():
+            parent = dirname.rpartition("/")[0]
+            if dirname and parent in dir_cache:
+                dir_cache[parent]["subdirs"].append(dirname)
+        return dir_cache
+
+
+    ## WATCHING
+
+    def record_dirty_paths(self, entries, path=None):
+        """
+        Journal callback of the folder watcher.  
+        'entries' is a list of (relative path, kind, event), kind being 'file' or 'subtree'.  
+        """
+        path = path if path else self.get_tracking_filepath()
+        now = datetime.now().isoformat()
+        with sqlite3.connect(path, timeout=30) as connection:
+            connection.executemany("""
+                INSERT OR REPLACE INTO dirty_paths (path, kind, event, time)
+                VALUES (?, ?, ?, ?)
+            """, ((rel_path, kind, event, now) for rel_path, kind, event in entries))
+
+    def get_dirty_paths(self, path=None):
+        """
+        Returns the journal of dirty paths: {relative path: {"kind", "event", "time"}}  
+        """
+        path = path if path else self.get_tracking_filepath()
+        with sqlite3.connect(path) as connection:
+            cursor = connection.execute("SELECT path, kind, event, time FROM dirty_paths")
+            return {row[0]: {"kind": row[1], "event": row[2], "time": row[3]} for row in cursor.fetchall()}
+
+    def apply_journal(self, mode="stat"):
+        """
+        Bring the tracking data up to date using only the journal of dirty paths,  
+        instead of walking the whole tree.  
+        'subtree' entries (new or moved directories, event overflow, unwatched directories)  
+        are rescanned; 'file' entries are only stat-ed.  
+        Returns the updated entries.  
+        """
+        self.initialize_tracking_file()
+        journal = self.get_dirty_paths()
+        subtrees = [rel_path for rel_path, entry in journal.items() if entry["kind"] == "subtree"]
+        filenames = [rel_path for rel_path, entry in journal.items() if entry["kind"] == "file"]
+        now = datetime.now().isoformat()
+        updated = {}
+        dropped = []
+        for subtree in subtrees:
+            old_data = self.get_tracking_entries(subtree=subtree)
+            subtree_path = os.path.join(self.__path, subtree) if subtree else self.__path
+            new_data = {}
+            if os.path.isdir(subtree_path):
+                new_data = scan_tree(self.__path, rel_dir=subtree, exclude=SCAN_EXCLUDE, ignore=self.__ignore_rules)
+            updated.update(self.__refresh_files([(filename, info, old_data.get(filename)) for filename, info in new_data.items()],
+                                                mode, now))
+            for filename, info in old_data.items():
+                if filename not in new_data:
+                    info = self.__missing_file_info(filename, info)
+                    if info is None:
+                        dropped.append(filename)
+                    else:
+                        updated[filename] = info
+        filenames = [filename for filename in filenames if filename not in updated]
+        old_data = self.get_tracking_entries(filenames=filenames)
+        new_data = stat_known_files(self.__path, filenames)
+        updated.update(self.__refresh_files([(filename, info, old_data.get(filename)) for filename, info in new_data.items()],
+                                            mode, now))
+        for filename in filenames:
+            old_info = old_data.get(filename)
+            if filename not in new_data and old_info is not None and old_info["status"] != "deleted":
+                old_info["status"] = "deleted"
+                updated[filename] = old_info
+        self.save_tracking_entries(updated)
+        self.delete_tracking_entries(dropped)
+        # clear the processed entries, unless they were reported again meanwhile.
+        # 'unwatched' subtrees stay in the journal: they are rescanned at every sync
+        with sqlite3.connect(self.get_tracking_filepath(), timeout=30) as connection:
+            connection.executemany("DELETE FROM dirty_paths WHERE path = ? AND time = ? AND event != 'unwatched'",
+                                   ((rel_path, entry["time"]) for rel_path, entry in journal.items()))
+        if updated or dropped:
+            self.update_merkle_tree()
+        return updated
+
+    def start_watching(self):
+        """
+        Start a background watcher journaling the changes of the folder.  
+        """
+        if self.__watcher is not None:
+            return self.__watcher
+        self.initialize_tracking_file()
+        # changes made while unwatched: the whole tree is rescanned at the next apply_journal
+        self.record_dirty_paths([("", "subtree", "started")])
+        self.__watcher = create_watcher(self.__path, self.record_dirty_paths, exclude=SCAN_EXCLUDE,
+                                        ignore=self.__ignore_rules)
+        self.__watcher.start()
+        return self.__watcher
+
+    def stop_watching(self):
+        if self.__watcher is None:
+            return
+        self.__watcher.stop()
+        self.__watcher.join()
+        self.__watcher = None
+        # the subtrees it could not watch are no longer relevant
+        with sqlite3.connect(self.get_tracking_filepath(), timeout=30) as connection:
+            connection.execute("DELETE FROM dirty_paths WHERE event = 'unwatched'")
+
+    def is_watching(self):
+        return self.__watcher is not None
+
+
+class TransferJournal:
+    """
+    Progress of the large copies into a folder, saved in its tracking file (table partial_transfers)  
+    after each chunk written to the partial file, with the hash of every chunk:  
+    a copy interrupted by an unplugged disk or a crash checks the chunks already written  
+    and resumes after them (see transfer.copy_file). Entries are keyed by destination path.  
+    """
+    def __init__(self, tracking_filepath, root):
+        self.__tracking_filepath = tracking_filepath
+        self.__root = root
+
+    def __filename(self, dst_path):
+        return os.path.relpath(dst_path, self.__root).replace(os.sep, "/")
+
+    def load(self, dst_path):
+        """
+        Returns {"size", "mtime_ns", "chunk_size", "offset", "chunk_hashes"}, or None.  
+        """
+        with sqlite3.connect(self.__tracking_filepath, timeout=30) as connection:
+            row = connection.execute("""
+                SELECT size, mtime_ns, chunk_size, offset, chunk_hashes FROM partial_transfers WHERE filename = ?
+            """, (self.__filename(dst_path),)).fetchone()
+        if row is None:
+            return None
+        return {"size": row[0], "mtime_ns": row[1], "chunk_size": row[2], "offset": row[3],
+                "chunk_hashes": json.loads(row[4])}
+
+    def save(self, dst_path, entry):
+        with sqlite3.connect(self.__tracking_filepath, timeout=30) as connection:
+            connection.execute("""
+                INSERT OR REPLACE INTO partial_transfers (filename, size, mtime_ns, chunk_size, offset, chunk_hashes)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (self.__filename(dst_path), entry["size"], entry["mtime_ns"], entry["chunk_size"], entry["offset"],
+                  json.dumps(entry["chunk_hashes"])))
+
+    def clear(self, dst_path):
+        with sqlite3.connect(self.__tracking_filepath, timeout=30) as connection:
+            connection.execute("DELETE FROM partial_transfers WHERE filename = ?", (self.__filename(dst_path),))
+
+
+class DeviceThroughput:
+    """
+    Copy throughput measured by the syncs for each device, in the app database (table device_throughput),  
+    keyed by mount point: it gives the sync time estimates of the dry runs.  
+    Each sync's bytes and seconds are added to the previous totals weighted by THROUGHPUT_DECAY,  
+    so recent syncs count most (a disk getting slower, a new USB stick on the same mount point).  
+    """
+    def __init__(self, db_filepath):
+        self.__db_filepath = db_filepath
+        with sqlite3.connect(self.__db_filepath) as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS device_throughput (
+                    mount_point TEXT PRIMARY KEY,
+                    bytes REAL NOT NULL,
+                    seconds REAL NOT NULL,
+                    last_sample TEXT
+                )
+            """)
+
+    def record(self, path, size, seconds):
+        """
+        Add a sample: 'size' bytes copied to 'path' in 'seconds'.  
+        """
+        if size <= 0 or seconds <= 0:
+            return
+        with sqlite3.connect(self.__db_filepath) as connection:
+            connection.execute("""
+                INSERT INTO device_throughput (mount_point, bytes, seconds, last_sample) VALUES (?, ?, ?, ?)
+                ON CONFLICT (mount_point) DO UPDATE SET bytes = bytes * ? + excluded.bytes,
+                    seconds = seconds * ? + excluded.seconds, last_sample = excluded.last_sample
+            """, (mount_point_of(path), size, seconds, datetime.now().isoformat(), THROUGHPUT_DECAY, THROUGHPUT_DECAY))
+
+    def get(self, path):
+        """
+        Measured throughput (bytes/s) of the device of 'path', or None if nothing was ever copied to it.  
+        """
+        with sqlite3.connect(self.__db_filepath) as connection:
+            row = connection.execute("SELECT bytes, seconds FROM device_throughput WHERE mount_point = ?",
+                                     (mount_point_of(path),)).fetchone()
+        return row[0] / row[1] if row is not None else None
+
+
+class ScanCheckpoint:
+    """
+    Progress of a scan, saved at regular intervals in the tracking file  
+    (tables scan_checkpoint_dirs and scan_checkpoint_files),  
+    so that an interrupted scan can be resumed instead of started over.  
+    The checkpoint only holds directory listings and hashes, each checked against  
+    the current mtime/stat tuple before being reused: a stale checkpoint costs nothing.  
+    """
+    def __init__(self, tracking_filepath, ignore_digest, interval=CHECKPOINT_INTERVAL):
+        self.__tracking_filepath = tracking_filepath
+        self.__ignore_digest = ignore_digest
+        self.__interval = interval
+        self.__last_flush = time.monotonic()
+        self.__pending_dirs = []
+        self.__pending_listed = []
+        self.__pending_hashed = []
+
+    def load(self):
+        """
+        Load the checkpoint left by an interrupted scan.  
+        Returns (dirs, files): dirs in the scanner's 'dir_cache' format,  
+        files as {filename: info} with the hashes already computed.  
+        """
+        with sqlite3.connect(self.__tracking_filepath) as connection:
+            row = connection.execute("SELECT value FROM tracking_settings WHERE key = 'checkpoint_ignore_digest'").fetchone()
+            if row is None or row[0] != self.__ignore_digest:
+                # no checkpoint, or listings filtered with other ignore rules
+                self.clear(connection)
+                connection.execute("INSERT OR REPLACE INTO tracking_settings (key, value) VALUES ('checkpoint_ignore_digest', ?)",
+                                   (self.__ignore_digest,))
+                return {}, {}
+            files = {row[0]: tracking_info_from_row(row) for row in
+                     connection.execute(f"SELECT {TRACKED_FILES_COLUMNS} FROM scan_checkpoint_files")}
+            dirs = {row[0]: {"mtime_ns": row[1],
+                             "entry_count": row[2],
+                             "files": [],
+                             "subdirs": json.loads(row[3])}
+                    for row in connection.execute("SELECT dirname, mtime_ns, entry_count, subdirs FROM scan_checkpoint_dirs")
+                    if row[1] is not None}
+        for filename in files:
+            parent = filename.rpartition("/")[0]
+            if parent in dirs:
+                dirs[parent]["files"].append(filename)
+        return dirs, files
+
+    def add_directory(self, rel_dir, files, subdirs, dir_info):
+        """
+        scan_tree callback: a directory has been listed.  
+        """
+        if dir_info is not None:
+            self.__pending_dirs.append((rel_dir, dir_info["mtime_ns"], dir_info["entry_count"], json.dumps(subdirs)))
+        now = datetime.now().isoformat()
+        self.__pending_listed += [tracking_row_from_info(filename, dict(info, status="scanning"), now)
+                                  for filename, info in files.items()]
+        self.flush()
+
+    def add_file(self, filename, info):
+        """
+        A file has been hashed (or its hash reused).  
+        """
+        self.__pending_hashed.append(tracking_row_from_info(filename, info, datetime.now().isoformat()))
+        self.flush()
+
+    def flush(self, force=False):
+        """
+        Write the pending progress, if the checkpoint interval has elapsed (or if forced).  
+        """
+        if not force and time.monotonic() - self.__last_flush < self.__interval:
+            return
+        with sqlite3.connect(self.__tracking_filepath) as connection:
+            connection.executemany("INSERT OR REPLACE INTO scan_checkpoint_dirs (dirname, mtime_ns, entry_count, subdirs) VALUES (?, ?, ?, ?)",
+                                   self.__pending_dirs)
+            # listed files must not overwrite the hashes of an earlier run
+            connection.executemany(f"INSERT OR IGNORE INTO scan_checkpoint_files ({TRACKED_FILES_COLUMNS}) VALUES ({TRACKED_FILES_PLACEHOLDERS})",
+                                   self.__pending_listed)
+            connection.executemany(f"INSERT OR REPLACE INTO scan_checkpoint_files ({TRACKED_FILES_COLUMNS}) VALUES ({TRACKED_FILES_PLACEHOLDERS})",
+                                   self.__pending_hashed)
+        if DEBUG:
+            print(f"Scan checkpoint: {len(self.__pending_dirs)} dirs, {len(self.__pending_hashed)} hashes")
+        self.__pending_dirs = []
+        self.__pending_listed = []
+        self.__pending_hashed = []
+        self.__last_flush = time.monotonic()
+
+    def clear(self, connection=None):
+        """
+        Drop the checkpoint, once the scan is complete.  
+        """
+        if connection is None:
+            with sqlite3.connect(self.__tracking_filepath) as connection:
+                return self.clear(connection)
+        connection.execute("DELETE FROM scan_checkpoint_dirs")
+        connection.execute("DELETE FROM scan_checkpoint_files")
+        connection.execute("DELETE FROM tracking_settings WHERE key = 'checkpoint_ignore_digest'")
+        self.__pending_dirs = []
+        self.__pending_listed = []
+        self.__pending_hashed = []
+
+
+def mtime_tolerance_of(path, mtime_tolerance_ns=None):
+    """
+    mtime tolerance of a folder: 'mtime_tolerance_ns' if set (from the registry),  
+    else FAT_MTIME_TOLERANCE_NS if 'path' is on a FAT/exFAT filesystem, else 0.  
+    """
+    if mtime_tolerance_ns is not None:
+        return mtime_tolerance_ns
+    if path and filesystem_type(path) in FAT_FILESYSTEMS:
+        return FAT_MTIME_TOLERANCE_NS
+    return 0
+
+
+def create_tracked_files_table(connection, tablename="tracked_files"):
+    """
+    Create the table of the files tracking data, if it doesn't exist.  
+    """
+    connection.execute(f"""
+        CREATE TABLE IF NOT EXISTS {tablename} (
+            id INTEGER PRIMARY KEY,
+            filename TEXT NOT NULL UNIQUE,
+            status TEXT NOT NULL,
+            last_sync TEXT NOT NULL,
+            hash TEXT NOT NULL,
+            size INTEGER,
+            mtime_ns INTEGER,
+            inode INTEGER,
+            ctime_ns INTEGER,
+            hash_algo TEXT,
+            fingerprint TEXT,
+            base_hash TEXT
+        )
+    """) # nb - possible statuses: 'new', 'synced', 'modified', 'deleted', 'error'
+    # nb - base_hash: tagged hash of the file when both sides were last in sync (see sync.plan_file)
+    # nb - hash_algo: algorithm of the hash and fingerprint (see hashing.HASH_ALGORITHMS)
+    # nb - hash is '' for files only fingerprinted by a quick scan, see FolderModel.verify_fingerprints
+
+
+def tracking_info_from_row(row):
+    """
+    Convert a tracked_files row (selected with TRACKED_FILES_COLUMNS) into its info dict.  
+    """
+    return dict(zip(TRACKED_FILES_FIELDS, row[1:]))
+
+
+def tracking_row_from_info(filename, info, now):
+    """
+    Convert the info dict of a file into a tracked_files row (in TRACKED_FILES_COLUMNS order).  
+    """
+    defaults = {"status": "unknown", "last_sync": now}
+    row = [filename]
+    for field in TRACKED_FILES_FIELDS:
+        row.append(info.get(field, defaults.get(field)))
+    row[TRACKED_FILES_FIELDS.index("hash")+1] = info.get("hash") or ""
+    return tuple(row)
+
+
+def merkle_diff_ranges(dir_hashes, other_dir_hashes):
+    """
+    Filename ranges [lo, hi) holding the files of the directories whose Merkle hashes differ  
+    between two folders ({dirname: hash} each, "" being the root).  
+    A directory with the same hash on both sides has identical contents: neither its files  
+    nor its subdirectories are covered. For a directory that differs, the ranges are the gaps  
+    between the ranges of its subdirectories, which are covered only if they differ too.  
+    """
+    children = {}
+    for dirname in dir_hashes.keys() | other_dir_hashes.keys():
+        if dirname:
+            children.setdefault(dirname.rpartition("/")[0], []).append(dirname)
+    ranges = []
+    for dirname in dir_hashes.keys() | other_dir_hashes.keys():
+        if dir_hashes.get(dirname) == other_dir_hashes.get(dirname):
+            continue
+        lo = dirname + "/" if dirname else ""
+        # NB: sorted by range, not by name ("a.b/" < "a/")
+        for subdir in sorted(children.get(dirname, ()), key=lambda subdir: subdir + "/"):
+            ranges.append((lo, subdir + "/"))
+            lo = subdir + "0" # '0' is the character right after '/'
+        ranges.append((lo, dirname + "0" if dirname else PATH_RANGE_END))
+    return ranges
+
+
+def add_missing_columns(connection, tablename, columns):
+    """
+    Add to 'tablename' the columns of 'columns' ({name: SQL type}) it doesn't have yet.  
+    Lets tracking files created by older versions be reused.  
+    """
+    existing = {row[1] for row in connection.execute(f"PRAGMA table_info({tablename})")}
+    for name, sql_type in columns.items():
+        if name not in existing:
+            connection.execute(f"ALTER TABLE {tablename} ADD COLUMN {name} {sql_type}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,439 @@
+# coding: utf-8
+DEBUG=False
+
+import os
+import sqlite3
+import time
+
+from hashing import get_hasher, FINGERPRINT_FULL_SIZE
+from transfer import TEMP_SUFFIX
+
+
+# PACK STORE
+# Mode de stockage "pack" du côté remote : sur une clé USB FAT/exFAT, écrire des milliers de petits
+# fichiers coûte surtout en création de fichiers et en mises à jour de la FAT, pas en octets.
+# Les petits fichiers (moins de PACK_MAX_FILE_SIZE) sont donc ajoutés à la suite les uns des autres
+# dans de gros fichiers "pack" (écriture séquentielle, un seul fsync par lot), un index SQLite
+# donnant pour chaque chemin son pack, sa position, sa taille, son mtime et son empreinte.
+# Les gros fichiers restent stockés tels quels. Le dossier .ofs-packs est ignoré par les scans :
+# le scan du côté remote y ajoute les fichiers de l'index, les copies et suppressions de la
+# synchronisation passent par ici (voir sync.execute_sync_plan) ; le reste de l'application
+# ne voit pas la différence. Il fait aussi partie des règles d'ignore par défaut (voir
+# models.DEFAULT_IGNORE_PATTERNS), à toute profondeur : un dossier contenant le côté remote
+# d'un autre dossier suivi ne le synchronise pas comme du contenu.
+# Les packs ne sont jamais modifiés, seulement complétés : un fichier remplacé ou supprimé laisse
+# ses octets morts dans son pack, récupérés par compact(). Après une interruption, les octets
+# écrits au-delà de la taille enregistrée dans l'index sont tronqués à la prochaine écriture.
+
+# Storage modes of the remote side of a folder
+REMOTE_MODES = ("native", "pack")
+DEFAULT_REMOTE_MODE = "native"
+PACK_DIRNAME = ".ofs-packs"
+PACK_INDEX_FILENAME = "pack_index.db"
+PACK_SUFFIX = ".ofs-pack"
+# Files below this size are packed, larger ones are stored natively
+PACK_MAX_FILE_SIZE = 1024 * 1024
+# A new pack is started once the current one reaches this size
+PACK_TARGET_SIZE = 256 * 1024 * 1024
+# Packs whose live data falls below this part of their size are rewritten by compact()
+PACK_COMPACT_RATIO = 0.5
+# Max parameters per "IN (...)" query
+_QUERY_BATCH_SIZE = 500
+
+
+class PackStore:
+    """
+    Small files of a folder stored in append-only pack files (<root>/.ofs-packs), with their index.
+    Entries are keyed by relative path ("/" separators), like the tracking files.
+    """
+    def __init__(self, root):
+        self.__root = root
+        self.__dir = os.path.join(root, PACK_DIRNAME)
+        self.__index_filepath = os.path.join(self.__dir, PACK_INDEX_FILENAME)
+
+    def get_root(self):
+        return self.__root
+
+    def exists(self):
+        return os.path.isfile(self.__index_filepath)
+
+    def initialize_index(self):
+        """
+        Create the pack directory and its index if they don't exist. Returns the index path.
+        """
+        os.makedirs(self.__dir, exist_ok=True)
+        with sqlite3.connect(self.__index_filepath, timeout=30) as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS packed_files (
+                    filename TEXT PRIMARY KEY,
+                    pack TEXT NOT NULL,
+                    offset INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER,
+                    ctime_ns INTEGER,
+                    mode INTEGER,
+                    hash TEXT,
+                    hash_algo TEXT
+                )
+            """)
+            # nb - ctime_ns: when the file was packed (stands for the ctime of a native file)
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS packs (
+                    name TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    live_bytes INTEGER NOT NULL
+                )
+            """)
+            # nb - size: committed size of the pack, live_bytes: bytes still referenced by packed_files
+        return self.__index_filepath
+
+    def __pack_path(self, name):
+        return os.path.join(self.__dir, name)
+
+    ## READ
+
+    def get_file_info(self, filenames=None):
+        """
+        Index entries of the packed files among 'filenames' (default: all of them), as scanned files:
+        {relative path: {"size", "mtime_ns", "inode", "ctime_ns", "dev", "hash", "hash_algo", "fingerprint"}}.
+        """
+        if not self.exists():
+            return {}
+        if filenames is None:
+            return dict(self.iter_file_info())
+        filenames = list(filenames)
+        files = {}
+        with sqlite3.connect(self.__index_filepath, timeout=30) as connection:
+            for start in range(0, len(filenames), _QUERY_BATCH_SIZE):
+                batch = filenames[start:start+_QUERY_BATCH_SIZE]
+                rows = connection.execute(f"""
+                    SELECT filename, size, mtime_ns, ctime_ns, hash, hash_algo FROM packed_files
+                    WHERE filename IN ({', '.join('?' * len(batch))})
+                """, batch)
+                files.update((row[0], _file_info(row)) for row in rows)
+        return files
+
+    def iter_file_info(self):
+        """
+        Yield (filename, info) for every packed file (see get_file_info), in sorted filename order.
+        """
+        if not self.exists():
+            return
+        connection = sqlite3.connect(self.__index_filepath, timeout=30)
+        try:
+            for row in connection.execute("""
+                SELECT filename, size, mtime_ns, ctime_ns, hash, hash_algo FROM packed_files ORDER BY filename
+            """):
+                yield row[0], _file_info(row)
+        finally:
+            connection.close()
+
+    def read(self, filename):
+        """
+        Content of a packed file. Raises FileNotFoundError if it is not packed.
+        """
+        entry = self.__get_entry(filename)
+        with open(self.__pack_path(entry["pack"]), "rb") as fpack:
+            return _read_entry(fpack, entry)
+
+    def __get_entry(self, filename):
+        row = None
+        if self.exists():
+            with sqlite3.connect(self.__index_filepath, timeout=30) as connection:
+                row = connection.execute("""
+                    SELECT pack, offset, size, mtime_ns, mode FROM packed_files WHERE filename = ?
+                """, (filename,)).fetchone()
+        if row is None:
+            raise FileNotFoundError(f"Not packed: {filename}")
+        return {"filename": filename, "pack": row[0], "offset": row[1], "size": row[2], "mtime_ns": row[3], "mode": row[4]}
+
+    def unpack_files(self, copies, algorithm=None):
+        """
+        Copy packed files out of the store: 'copies' is a list of (key, filename, dst_path[, expected hash]).
+        Each destination is written beside itself then renamed over, with the mtime and mode of the file
+        when it was packed, unless its data doesn't have the expected hash. The files are read in pack order.
+        Yields (key, result, error) like transfer.CopyExecutor.copy_files, result being
+        {"strategy": "unpack", "size", "written", "seconds", "throughput", "hash"}.
+        """
+        entries = []
+        for key, filename, dst_path, *expected_hash in copies:
+            try:
+                entries.append((self.__get_entry(filename), key, dst_path, expected_hash[0] if expected_hash else None))
+            except OSError as e:
+                yield key, None, e
+        entries.sort(key=lambda entry: (entry[0]["pack"], entry[0]["offset"]))
+        fpack = None
+        try:
+            for entry, key, dst_path, expected_hash in entries:
+                start = time.perf_counter()
+                temp_path = os.path.join(os.path.dirname(dst_path), f".{os.path.basename(dst_path)}{TEMP_SUFFIX}")
+                try:
+                    if fpack is None or fpack.name != self.__pack_path(entry["pack"]):
+                        if fpack is not None:
+                            fpack.close()
+                        fpack = open(self.__pack_path(entry["pack"]), "rb")
+                    data = _read_entry(fpack, entry)
+                    result = _result("unpack", data, algorithm, start)
+                    _check_hash(result["hash"], expected_hash)
+                    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+                    with open(temp_path, "wb") as fdst:
+                        fdst.write(data)
+                    if entry["mode"] is not None:
+                        os.chmod(temp_path, entry["mode"] & 0o7777)
+                    if entry["mtime_ns"] is not None:
+                        os.utime(temp_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+                    os.replace(temp_path, dst_path)
+                except OSError as e:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    yield key, None, e
+                    continue
+                _set_seconds(result, time.perf_counter() - start)
+                yield key, result, None
+        finally:
+            if fpack is not None:
+                fpack.close()
+
+    ## WRITE
+
+    def pack_files(self, copies, algorithm=None):
+        """
+        Append files to the current pack: 'copies' is a list of (key, src_path, filename[, expected hash]).
+        A file already stored under 'filename', packed or native, is replaced, unless the data read
+        doesn't have the expected hash (the source changed since it was scanned).
+        The packs are synced to disk and the index committed once for the whole batch (or per pack
+        when the batch fills several), so nothing is reported done before it is durable.
+        Yields (key, result, error) like transfer.CopyExecutor.copy_files, result being
+        {"strategy": "pack", "size", "written", "seconds", "throughput", "hash"}.
+        """
+        if not copies:
+            return
+        path = self.initialize_index()
+        copies = list(copies)
+        while copies:
+            done = []
+            with sqlite3.connect(path, timeout=30) as connection:
+                name, offset = self.__current_pack(connection)
+                fd = os.open(self.__pack_path(name), os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+                with os.fdopen(fd, "r+b") as fpack:
+                    # drop what an interrupted batch wrote past the committed end
+                    fpack.truncate(offset)
+                    fpack.seek(offset)
+                    while copies and offset < PACK_TARGET_SIZE:
+                        key, src_path, filename, *expected_hash = copies.pop(0)
+                        start = time.perf_counter()
+                        try:
+                            with open(src_path, "rb") as fsrc:
+                                stat = os.fstat(fsrc.fileno())
+                                data = fsrc.read()
+                        except OSError as e:
+                            yield key, None, e
+                            continue
+                        result = _result("pack", data, algorithm, start)
+                        try:
+                            _check_hash(result["hash"], expected_hash[0] if expected_hash else None)
+                        except OSError as e:
+                            yield key, None, e
+                            continue
+                        fpack.write(data)
+                        _set_seconds(result, time.perf_counter() - start)
+                        done.append((key, result, (filename, name, offset, len(data), stat.st_mtime_ns,
+                                                   time.time_ns(), stat.st_mode, result["hash"], algorithm)))
+                        offset += len(data)
+                    start = time.perf_counter()
+                    fpack.flush()
+                    os.fsync(fpack.fileno())
+                    sync_seconds = time.perf_counter() - start
+                entries = [entry for _, _, entry in done]
+                # the single fsync of the batch is charged to its files, by size
+                packed_bytes = sum(entry[3] for entry in entries)
+                for _, result, entry in done:
+                    _set_seconds(result, result["seconds"] + (sync_seconds * entry[3] / packed_bytes if packed_bytes else 0))
+                self.__release([entry[0] for entry in entries], connection)
+                connection.executemany("""
+                    INSERT OR REPLACE INTO packed_files (filename, pack, offset, size, mtime_ns, ctime_ns, mode, hash, hash_algo)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """, entries)
+                connection.execute("""
+                    INSERT INTO packs (name, size, live_bytes) VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET size = excluded.size, live_bytes = live_bytes + excluded.live_bytes
+                """, (name, offset, sum(entry[3] for entry in entries)))
+            self.__delete_dead_packs()
+            for key, result, entry in done:
+                # the native copy, if any, is now stale
+                native_path = os.path.join(self.__root, entry[0])
+                if os.path.isfile(native_path):
+                    os.remove(native_path)
+                yield key, result, None
+            if DEBUG:
+                print(f"Packed {len(done)} files into {name}")
+
+    def remove(self, filenames):
+        """
+        Drop files from the index (their bytes stay in their pack until compact()).
+        Returns the filenames that were packed.
+        """
+        if not self.exists():
+            return []
+        filenames = list(filenames)
+        with sqlite3.connect(self.__index_filepath, timeout=30) as connection:
+            removed = self.__release(filenames, connection)
+        self.__delete_dead_packs()
+        return removed
+
+    def compact(self):
+        """
+        Rewrite into the current pack the live files of the packs mostly made of dead bytes
+        (files replaced or deleted), then delete those packs. Returns the bytes reclaimed.
+        """
+        if not self.exists():
+            return 0
+        with sqlite3.connect(self.__index_filepath, timeout=30) as connection:
+            current = self.__current_pack(connection)[0]
+            packs = connection.execute("SELECT name, size, live_bytes FROM packs WHERE name != ? AND live_bytes < size * ?",
+                                       (current, PACK_COMPACT_RATIO)).fetchall()
+        reclaimed = 0
+        for name, size, live_bytes in packs:
+            # a single transaction per pack: its entries point either to the old pack or to their
+            # new copies (synced to disk before the commit), never to bytes past a committed size
+            with sqlite3.connect(self.__index_filepath, timeout=30) as connection:
+                rows = connection.execute("""
+                    SELECT filename, offset, size FROM packed_files WHERE pack = ? ORDER BY offset
+                """, (name,)).fetchall()
+                moved = self.__append_entries(name, rows, connection)
+                connection.executemany("""
+                    UPDATE packed_files SET pack = ?, offset = ? WHERE filename = ? AND pack = ?
+                """, [(new_pack, new_offset, filename, name) for filename, new_pack, new_offset in moved])
+                connection.execute("UPDATE packs SET live_bytes = 0 WHERE name = ?", (name,))
+            reclaimed += size - live_bytes
+        self.__delete_dead_packs()
+        if DEBUG:
+            print(f"Compacted {len(packs)} packs: {reclaimed} bytes reclaimed")
+        return reclaimed
+
+    def __append_entries(self, old_pack, rows, connection):
+        """
+        Copy the given entries of 'old_pack' to the end of the current pack(s), synced to disk.
+        The new pack sizes are written on 'connection', left to the caller to commit.
+        Returns [(filename, new pack, new offset)].
+        """
+        moved = []
+        with open(self.__pack_path(old_pack), "rb") as fold:
+            while rows:
+                name, offset = self.__current_pack(connection)
+                fd = os.open(self.__pack_path(name), os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+                with os.fdopen(fd, "r+b") as fpack:
+                    fpack.truncate(offset)
+                    fpack.seek(offset)
+                    added = 0
+                    while rows and offset < PACK_TARGET_SIZE:
+                        filename, old_offset, size = rows.pop(0)
+                        fold.seek(old_offset)
+                        fpack.write(fold.read(size))
+                        moved.append((filename, name, offset))
+                        offset += size
+                        added += size
+                    fpack.flush()
+                    os.fsync(fpack.fileno())
+                connection.execute("""
+                    INSERT INTO packs (name, size, live_bytes) VALUES (?, ?, ?)
+                    ON CONFLICT (name) DO UPDATE SET size = excluded.size, live_bytes = live_bytes + excluded.live_bytes
+                """, (name, offset, added))
+        return moved
+
+    def __current_pack(self, connection):
+        """
+        (name, committed size) of the pack to append to: the last one, or a new one if it is full.
+        """
+        row = connection.execute("SELECT name, size FROM packs ORDER BY name DESC LIMIT 1").fetchone()
+        if row is not None and row[1] < PACK_TARGET_SIZE:
+            return row
+        number = int(row[0][len("pack-"):-len(PACK_SUFFIX)]) + 1 if row is not None else 1
+        return f"pack-{number:06d}{PACK_SUFFIX}", 0
+
+    def __release(self, filenames, connection):
+        """
+        Remove the index entries of 'filenames', counting their bytes as dead in their packs.
+        Returns the filenames that had an entry.
+        """
+        removed = []
+        for start in range(0, len(filenames), _QUERY_BATCH_SIZE):
+            batch = filenames[start:start+_QUERY_BATCH_SIZE]
+            placeholders = ', '.join('?' * len(batch))
+            rows = connection.execute(f"SELECT filename, pack, size FROM packed_files WHERE filename IN ({placeholders})",
+                                      batch).fetchall()
+            connection.executemany("UPDATE packs SET live_bytes = live_bytes - ? WHERE name = ?",
+                                   [(row[2], row[1]) for row in rows])
+            connection.execute(f"DELETE FROM packed_files WHERE filename IN ({placeholders})", batch)
+            removed += [row[0] for row in rows]
+        return removed
+
+    def __delete_dead_packs(self):
+        """
+        Delete the packs no file refers to anymore (except the current one, still appended to).
+        """
+        with sqlite3.connect(self.__index_filepath, timeout=30) as connection:
+            current = self.__current_pack(connection)[0]
+            dead = [row[0] for row in connection.execute("SELECT name FROM packs WHERE live_bytes <= 0 AND name != ?",
+                                                         (current,))]
+            for name in dead:
+                if os.path.exists(self.__pack_path(name)):
+                    os.remove(self.__pack_path(name))
+            connection.executemany("DELETE FROM packs WHERE name = ?", [(name,) for name in dead])
+
+
+def _file_info(row):
+    """
+    Scanned file info of a packed_files row (filename, size, mtime_ns, ctime_ns, hash, hash_algo).
+    Packed files have no inode: 0 stands for it.
+    """
+    return {"size": row[1], "mtime_ns": row[2], "inode": 0, "ctime_ns": row[3], "dev": None,
+            "hash": row[4] or "", "hash_algo": row[5],
+            "fingerprint": row[4] if row[4] and row[1] <= FINGERPRINT_FULL_SIZE else None}
+
+
+def _check_hash(file_hash, expected_hash):
+    if expected_hash and file_hash and file_hash != expected_hash:
+        raise OSError("source changed during the copy")
+
+
+def _read_entry(fpack, entry):
+    fpack.seek(entry["offset"])
+    data = fpack.read(entry["size"])
+    if len(data) != entry["size"]:
+        raise OSError(f"Truncated pack {entry['pack']}: {entry['filename']}")
+    return data
+
+
+def _result(strategy, data, algorithm, start):
+    """
+    Result of a copy through the store, in the format of transfer.copy_file.
+    """
+    file_hash = ""
+    if algorithm:
+        hasher = get_hasher(algorithm)
+        hasher.update(data)
+        file_hash = hasher.hexdigest()
+    result = {"strategy": strategy, "size": len(data), "written": len(data), "hash": file_hash}
+    return _set_seconds(result, time.perf_counter() - start)
+
+
+def _set_seconds(result, seconds):
+    """
+    Set how long the transfer of a result took, and its throughput.
+    """
+    result["seconds"] = seconds
+    result["throughput"] = result["size"] / seconds if seconds > 0 else 0.0
+    return result
+
+
+if __name__ == "__main__":
+    print(">> Testing packstore.py <<")
+    import sys
+
+    if len(sys.argv) != 2:
+        print("Usage: python packstore.py <folder with a pack store>")
+        sys.exit(1)
+    store = PackStore(sys.argv[1])
+    files = store.get_file_info()
+    print(f"{len(files)} packed files, {sum(info['size'] for info in files.values())} bytes")
@@ -0,0 +1,230 @@
+# coding: utf-8
+DEBUG=False
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from stat import S_ISREG
+
+
+# FOLDER SCANNING
+# Parcours récursif d'un dossier suivi :
+# chaque sous-dossier est listé par un thread du pool,
+# pour que le parcours soit limité par le disque et non par un seul thread Python.
+# Les chemins relatifs utilisent toujours "/" comme séparateur.
+
+# Directories modified less than this before the scan started are listed again at the next scan
+# (2 s covers the coarsest timestamps, FAT)
+RACY_WINDOW_NS = 2_000_000_000
+
+
+def stat_record(stat):
+    """
+    Build the manifest record of a file from its os.stat_result.
+    ("dev" is not tracked: it only keys the global hash cache, see hashcache.py)
+    """
+    return {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "inode": stat.st_ino,
+        "ctime_ns": stat.st_ctime_ns,
+        "dev": stat.st_dev
+    }
+
+
+def stat_known_files(root, filenames):
+    """
+    Stat the files already known in a directory, without listing it.
+    Returns {relative path: {"size", "mtime_ns", "inode", "ctime_ns", "dev"}} for the files still present.
+    """
+    files = {}
+    for rel_path in filenames:
+        try:
+            stat = os.stat(os.path.join(root, rel_path), follow_symlinks=False)
+        except OSError:
+            continue
+        if S_ISREG(stat.st_mode):
+            files[rel_path] = stat_record(stat)
+    return files
+
+
+def list_directory(root, rel_dir="", exclude=(), dir_cache=None, ignore=None):
+    """
+    List a single directory of the tree (no recursion).
+    'rel_dir' is relative to 'root' ("" for the root itself).
+    Entries whose relative path is in 'exclude' are skipped,
+    as well as the entries matched by the 'ignore' rules (see syncignore.IgnoreRules).
+    'dir_cache' is the state of the directories at the previous scan:
+    {relative dir: {"mtime_ns", "entry_count", "files", "subdirs"}}.
+    If the directory mtime and entry count are unchanged, the directory is not listed again:
+    only its known files are stat-ed (a directory mtime changes when entries are
+    added, removed or renamed in it, not when a file content changes).
+    Returns a tuple (files, subdirs, dir_info):
+    files is a dict {relative path: {"size", "mtime_ns", "inode", "ctime_ns", "dev"}},
+    subdirs is a list of relative paths of the subdirectories to scan next,
+    dir_info is {"mtime_ns", "entry_count"} for the directory itself.
+    """
+    dir_path = os.path.join(root, rel_dir) if rel_dir else root
+    files = {}
+    subdirs = []
+    try:
+        dir_mtime_ns = os.stat(dir_path).st_mtime_ns
+        cached = dir_cache.get(rel_dir) if dir_cache else None
+        if (cached is not None
+                and cached["mtime_ns"] == dir_mtime_ns
+                and cached["entry_count"] == len(cached["files"]) + len(cached["subdirs"])):
+            files = stat_known_files(root, cached["files"])
+            subdirs = list(cached["subdirs"])
+            return files, subdirs, {"mtime_ns": dir_mtime_ns, "entry_count": cached["entry_count"]}
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                if rel_path in exclude:
+                    continue
+                try:
+                    # symlinks are not followed: they could loop or leave the tracked folder
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if ignore and ignore.match(rel_path, is_dir):
+                        # ignored directories are pruned: never listed
+                        continue
+                    if is_dir:
+                        subdirs.append(rel_path)
+                    elif entry.is_file(follow_symlinks=False):
+                        stat = entry.stat(follow_symlinks=False)
+                        if not stat.st_ino:
+                            # DirEntry.stat() leaves st_ino and st_dev at 0 on Windows:
+                            # the stat tuple must match the os.stat() of stat_known_files
+                            stat = os.stat(entry.path, follow_symlinks=False)
+                        files[rel_path] = stat_record(stat)
+                except OSError as e:
+                    # file removed or unreadable while scanning
+                    print(f"Error reading {entry.path}: {e}")
+    except OSError as e:
+        if not rel_dir:
+            raise
+        print(f"Error scanning {dir_path}: {e}")
+        return files, subdirs, None
+    return files, subdirs, {"mtime_ns": dir_mtime_ns, "entry_count": len(files) + len(subdirs)}
+
+
+def _untrusted_if_racy(dir_info, start_ns):
+    # a directory modified within the timestamp resolution of the scan
+    # could change again without its mtime moving: don't trust it next time
+    if dir_info is not None and dir_info["mtime_ns"] >= start_ns - RACY_WINDOW_NS:
+        dir_info["mtime_ns"] = None
+    return dir_info
+
+
+def scan_tree(root, max_workers=None, exclude=(), dir_cache=None, with_dirs=False, ignore=None, rel_dir="",
+              on_directory=None):
+    """
+    Recursively scan 'root' using a pool of threads.
+    'rel_dir' restricts the scan to that subdirectory (paths stay relative to 'root').
+    Each directory listing is a separate task, so sibling subtrees are listed concurrently.
+    'max_workers' defaults to the ThreadPoolExecutor default.
+    'dir_cache' lets unchanged directories be skipped (see list_directory).
+    'ignore' rules prune the ignored directories before descending into them.
+    'on_directory(rel_dir, files, subdirs, dir_info)' is called (in the calling thread)
+    each time a directory is done, e.g. to checkpoint the progress of a long scan.
+    Returns the complete manifest: {relative path: {"size", "mtime_ns", "inode", "ctime_ns", "dev"}}
+    If 'with_dirs' is True, returns (manifest, dirs) where dirs is
+    {relative dir: {"mtime_ns", "entry_count"}}, ready to be used as the next 'dir_cache'.
+    """
+    if not os.path.isdir(os.path.join(root, rel_dir) if rel_dir else root):
+        raise ValueError(f"Directory not found: {root}")
+    start_ns = time.time_ns()
+    manifest = {}
+    dirs = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {pool.submit(list_directory, root, rel_dir, exclude, dir_cache, ignore): rel_dir}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                rel_dir = pending.pop(future)
+                files, subdirs, dir_info = future.result()
+                manifest.update(files)
+                if _untrusted_if_racy(dir_info, start_ns) is not None:
+                    dirs[rel_dir] = dir_info
+                if on_directory is not None:
+                    on_directory(rel_dir, files, subdirs, dir_info)
+                for subdir in subdirs:
+                    pending[pool.submit(list_directory, root, subdir, exclude, dir_cache, ignore)] = subdir
+    if DEBUG:
+        print(f"Scanned {root}: {len(manifest)} files in {len(dirs)} directories")
+    if with_dirs:
+        return manifest, dirs
+    return manifest
+
+
+def sorted_entries(root, rel_dir="", exclude=(), ignore=None, on_directory=None):
+    """
+    List a single directory, sorted so that walking it depth-first yields paths in sorted order.
+    Subdirectories are sorted as "name/", which is where their content falls among their siblings.
+    'on_directory(rel_dir, files, subdirs, dir_info)' is called with the listing (see list_directory).
+    Returns a list of (relative path, record), record being None for subdirectories.
+    """
+    files, subdirs, dir_info = list_directory(root, rel_dir, exclude, ignore=ignore)
+    if on_directory is not None:
+        on_directory(rel_dir, files, subdirs, dir_info)
+    entries = [(rel_path, rel_path, record) for rel_path, record in files.items()]
+    entries += [(rel_path+"/", rel_path, None) for rel_path in subdirs]
+    entries.sort(key=lambda entry: entry[0])
+    return [(rel_path, record) for _, rel_path, record in entries]
+
+
+def iter_tree(root, exclude=(), ignore=None, on_directory=None):
+    """
+    Walk 'root' depth-first and yield (relative path, {"size", "mtime_ns", "inode", "ctime_ns", "dev"})
+    for each file, in sorted path order (the order of SQLite's "ORDER BY filename").
+    Only the remaining entries of the directories being walked are held in memory,
+    so memory depends on the depth (and width) of the tree, not on its number of files.
+    'on_directory(rel_dir, files, subdirs, dir_info)' is called as each directory is listed,
+    'dir_info' being ready for the next 'dir_cache' as with scan_tree.
+    """
+    if not os.path.isdir(root):
+        raise ValueError(f"Directory not found: {root}")
+    start_ns = time.time_ns()
+    if on_directory is not None:
+        callback = on_directory
+        on_directory = lambda rel_dir, files, subdirs, dir_info: \
+            callback(rel_dir, files, subdirs, _untrusted_if_racy(dir_info, start_ns))
+    stack = [iter(sorted_entries(root, "", exclude, ignore, on_directory))]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+        rel_path, record = entry
+        if record is None:
+            stack.append(iter(sorted_entries(root, rel_path, exclude, ignore, on_directory)))
+        else:
+            yield rel_path, record
+
+
+def merge_join(*streams):
+    """
+    Join several streams of (key, value) sorted by key, without loading them.
+    Yields (key, value_1, value_2, ...), with None for the streams missing that key.
+    """
+    iterators = [iter(stream) for stream in streams]
+    heads = [next(iterator, None) for iterator in iterators]
+    while any(head is not None for head in heads):
+        key = min(head[0] for head in heads if head is not None)
+        values = []
+        for i, head in enumerate(heads):
+            if head is not None and head[0] == key:
+                values.append(head[1])
+                heads[i] = next(iterators[i], None)
+            else:
+                values.append(None)
+        yield (key, *values)
+
+
+if __name__ == "__main__":
+    print(">> Testing scanner.py <<")
+    import sys
+
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    start = time.perf_counter()
+    manifest = scan_tree(root)
+    print(f"{len(manifest)} files found in {time.perf_counter()-start:.3f}s")
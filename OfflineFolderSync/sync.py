@@ -0,0 +1,594 @@
+# coding: utf-8
+DEBUG=False
+
+import itertools
+import os
+import time
+from datetime import datetime
+
+from transfer import CopyExecutor
+from packstore import PACK_MAX_FILE_SIZE
+from contentindex import format_size
+from hashing import FINGERPRINT_FULL_SIZE, LEGACY_HASH_ALGORITHM
+
+
+# SYNC ENGINE
+# Synchronisation des deux côtés (local / remote) d'un dossier suivi, en deux temps :
+# 1. build_sync_plan : un plan explicite (copy, overwrite, delete, conflict) calculé à partir
+#    des seuls fichiers de suivi des deux côtés, joints par SQLite dans l'ordre des chemins :
+#    aucun fichier n'est lu, et seuls les fichiers qui diffèrent remontent jusqu'à Python.
+# 2. execute_sync_plan : exécution du plan, puis mise à jour des fichiers de suivi.
+# Comparaison à trois : chaque fichier garde l'empreinte de son contenu lors de la dernière
+# synchronisation (base_hash, la "base") ; le côté dont le contenu diffère de la base a changé,
+# et si les deux ont changé (différemment), c'est un conflit.
+# Sans base (fichier jamais synchronisé), les statuts new/modified/deleted du dernier scan
+# servent à la place : les deux côtés doivent alors avoir été scannés juste avant.
+# Un fichier modifié depuis le scan est laissé de côté.
+# Dry run : le plan seul, avec les octets à copier et une durée estimée d'après le débit
+# mesuré lors des synchronisations précédentes sur chaque disque (voir estimate_plan).
+
+SYNC_ACTIONS = ("copy", "overwrite", "delete", "conflict")
+# "target" of an action: the side receiving the change
+SYNC_TARGETS = ("local", "remote")
+CHANGED_STATUSES = ("new", "modified")
+
+
+def is_present(info):
+    return info is not None and info["status"] not in ("deleted", "error")
+
+
+def _tag_sql(alias):
+    # content_tag() of the row 'alias', in SQL
+    return (f"coalesce({alias}.hash_algo, '{LEGACY_HASH_ALGORITHM}') || CASE WHEN {alias}.hash != '' "
+            f"THEN ':' || {alias}.hash ELSE '~' || coalesce({alias}.fingerprint, '') END")
+
+
+# Files present and identical on both sides (is_present and same_content, in SQL over the rows 'a' and 'b')
+IN_SYNC_SQL = """
+    a.status NOT IN ('deleted', 'error') AND b.status NOT IN ('deleted', 'error') AND CASE
+        WHEN a.hash_algo IS b.hash_algo AND a.hash != '' AND b.hash != '' THEN a.hash = b.hash
+        WHEN a.hash_algo IS b.hash_algo AND coalesce(a.fingerprint, '') != '' AND coalesce(b.fingerprint, '') != ''
+            THEN a.fingerprint = b.fingerprint
+        ELSE a.size IS b.size AND a.mtime_ns IS b.mtime_ns
+    END
+"""
+# ... whose base hash is already up to date (see record_sync_base)
+BASE_RECORDED_SQL = f"a.base_hash = b.base_hash AND a.base_hash IN ({_tag_sql('a')}, {_tag_sql('b')})"
+
+
+def same_content(info, other_info):
+    """
+    Compare two tracked files without reading them: by hash when both were hashed
+    with the same algorithm, else by fingerprint, else by size and mtime.
+    """
+    if info["hash_algo"] == other_info["hash_algo"]:
+        if info["hash"] and other_info["hash"]:
+            return info["hash"] == other_info["hash"]
+        if info["fingerprint"] and other_info["fingerprint"]:
+            return info["fingerprint"] == other_info["fingerprint"]
+    return info["size"] == other_info["size"] and info["mtime_ns"] == other_info["mtime_ns"]
+
+
+def content_tag(info):
+    """
+    Tagged hash of a tracked file ("algo:hash", or "algo~fingerprint" while the full hash
+    is not known), as stored in base_hash; None if the file has neither.
+    """
+    algorithm = info["hash_algo"] or LEGACY_HASH_ALGORITHM
+    if info["hash"]:
+        return f"{algorithm}:{info['hash']}"
+    if info["fingerprint"]:
+        return f"{algorithm}~{info['fingerprint']}"
+    return None
+
+
+def _tag_kind(tag):
+    # "algo:" or "algo~" prefix of a tagged hash (see content_tag)
+    separator = min((tag.find(sep) for sep in ":~" if sep in tag), default=len(tag))
+    return tag[:separator + 1]
+
+
+def sync_base(local_info, remote_info):
+    """
+    Content of a file at the last sync, as recorded on both sides: a tuple of tagged hashes,
+    which differ only by their algorithm or kind once a side re-tagged its base while rehashing
+    (see FolderModel.rehash_outdated). Empty if unknown, or if the sides don't agree on it.
+    """
+    bases = []
+    for info in (local_info, remote_info):
+        base = info.get("base_hash") if info is not None else None
+        if base and base not in bases:
+            bases.append(base)
+    if len(bases) == 2 and _tag_kind(bases[0]) == _tag_kind(bases[1]):
+        return ()
+    return tuple(bases)
+
+
+def unchanged_since_sync(info, bases):
+    """
+    True if a side of a file still has its base content (any of the tags 'bases'),
+    False if it changed (or was deleted), None if that can't be told
+    (hashed with another algorithm, fingerprint against full hash).
+    """
+    for base in bases:
+        unchanged = _unchanged_since(info, base)
+        if unchanged is not None:
+            return unchanged
+    return None
+
+
+def _unchanged_since(info, base):
+    if not is_present(info):
+        return False
+    algorithm = info["hash_algo"] or LEGACY_HASH_ALGORITHM
+    if _tag_kind(base)[:-1] != algorithm:
+        return None
+    if base.startswith(f"{algorithm}:") and info["hash"]:
+        return base == f"{algorithm}:{info['hash']}"
+    if base.startswith(f"{algorithm}~") and info["fingerprint"]:
+        return base == f"{algorithm}~{info['fingerprint']}"
+    if info["size"] is not None and info["size"] <= FINGERPRINT_FULL_SIZE:
+        # small files: the fingerprint is the full hash
+        digest = info["hash"] or info["fingerprint"]
+        return base in (f"{algorithm}:{digest}", f"{algorithm}~{digest}")
+    return None
+
+
+def _action(action, filename, target, source_info=None, target_info=None):
+    size = source_info["size"] if action in ("copy", "overwrite") else 0
+    return {"action": action, "path": filename, "target": target, "size": size,
+            "source": source_info, "target_info": target_info}
+
+
+def _propagate(filename, source_side, source_info, target_info):
+    """
+    Action bringing the change of 'source_side' to the other side.
+    """
+    target = "remote" if source_side == "local" else "local"
+    if is_present(source_info):
+        if is_present(target_info):
+            return _action("overwrite", filename, target, source_info, target_info)
+        return _action("copy", filename, target, source_info)
+    if is_present(target_info):
+        # NB: a deletion carries the info of the file deleted
+        return _action("delete", filename, target, target_info)
+    return None
+
+
+def plan_file(filename, local_info, remote_info):
+    """
+    Sync action of a single file, from its tracking info on both sides (None if untracked).
+    Three-way comparison of each side against the content at the last sync (base_hash);
+    without a base, the statuses of the last scans tell which side changed.
+    Returns an action dict {"action", "path", "target", "size", "source", "target_info"},
+    or None if nothing is to be done.
+    """
+    if (local_info is not None and local_info["status"] == "error") or \
+       (remote_info is not None and remote_info["status"] == "error"):
+        return None # unreadable on one side: left alone until the next scan
+    local_present, remote_present = is_present(local_info), is_present(remote_info)
+    if local_present and remote_present and same_content(local_info, remote_info):
+        return None
+    if not local_present and not remote_present:
+        return None
+    if local_info is None or remote_info is None:
+        # never tracked on one side (e.g. a new, empty side): copied there, never deleted,
+        # a deletion being only told by a 'deleted' row
+        if local_info is None:
+            return _propagate(filename, "remote", remote_info, local_info)
+        return _propagate(filename, "local", local_info, remote_info)
+    bases = sync_base(local_info, remote_info)
+    if bases:
+        local_unchanged = unchanged_since_sync(local_info, bases)
+        remote_unchanged = unchanged_since_sync(remote_info, bases)
+        if local_unchanged is not None and remote_unchanged is not None:
+            if local_unchanged and not remote_unchanged:
+                return _propagate(filename, "remote", remote_info, local_info)
+            if remote_unchanged and not local_unchanged:
+                return _propagate(filename, "local", local_info, remote_info)
+            return _action("conflict", filename, None) # changed on both sides
+    # no usable base: the last scans tell
+    local_changed = local_present and local_info["status"] in CHANGED_STATUSES
+    remote_changed = remote_present and remote_info["status"] in CHANGED_STATUSES
+    if local_present and remote_present:
+        if local_changed and not remote_changed:
+            return _propagate(filename, "local", local_info, remote_info)
+        if remote_changed and not local_changed:
+            return _propagate(filename, "remote", remote_info, local_info)
+        return _action("conflict", filename, None)
+    if local_present:
+        # deleted on the remote side since its last scan
+        if local_changed:
+            return _action("conflict", filename, None)
+        return _propagate(filename, "remote", remote_info, local_info)
+    if remote_changed:
+        return _action("conflict", filename, None)
+    return _propagate(filename, "local", local_info, remote_info)
+
+
+def build_sync_plan(local_folder, remote_folder):
+    """
+    Build the sync plan of a folder from the tracking files of both sides (FolderModel),
+    in a single streaming pass over the directories that differ (per their Merkle trees).
+    Returns the list of actions, in path order.
+    """
+    plan = []
+    for filename, local_info, remote_info in local_folder.iter_tracking_pairs(remote_folder, skip=IN_SYNC_SQL,
+                                                                              changed_only=True):
+        action = plan_file(filename, local_info, remote_info)
+        if action is not None:
+            plan.append(action)
+    return plan
+
+
+def summarize_plan(plan):
+    """
+    Returns {action: count} for every action, plus "bytes": the bytes to copy.
+    """
+    summary = dict.fromkeys(SYNC_ACTIONS, 0)
+    for action in plan:
+        summary[action["action"]] += 1
+    summary["bytes"] = sum(action["size"] or 0 for action in plan)
+    return summary
+
+
+def _remove_empty_dirs(root, rel_dir):
+    """
+    Remove 'rel_dir' and its parents while they are empty (never 'root' itself).
+    """
+    while rel_dir:
+        try:
+            os.rmdir(os.path.join(root, rel_dir))
+        except OSError:
+            return
+        rel_dir = rel_dir.rpartition("/")[0]
+
+
+def execute_sync_plan(plan, local_folder, remote_folder, executor=None):
+    """
+    Execute a sync plan between the two sides of a folder (FolderModel), then update
+    their tracking files. Conflicts are not touched. An action is skipped if a file it
+    involves changed since the plan was built (its stat tuple differs from its tracking info).
+    Deletions are done first, then the copies run in parallel on 'executor' (transfer.CopyExecutor).
+    A side in pack mode gets its small files through its pack store, in one batch (see packstore.py),
+    and the files packed on a side are read back from there.
+    The hash computed while copying (see the executor's verify mode) must match the scanned hash
+    of the source; it is recorded on both sides (a quick scan leaves large files without one).
+    Returns the list of results, in plan order:
+    {"action", "path", "target", "result", "strategy", "size", "throughput", "written", "seconds", "ended", "error"},
+    "result" being "done", "skipped" or "error"; for a copy, "throughput" is its bytes/s, "written" its bytes written,
+    "seconds" how long its own transfer took and "ended" the seconds from the start of the transfers to its end
+    (see throughput_samples).
+    """
+    executor = executor if executor is not None else CopyExecutor()
+    folders = {"local": local_folder, "remote": remote_folder}
+    other_side = {"local": "remote", "remote": "local"}
+    now = datetime.now().isoformat()
+    updated = {"local": {}, "remote": {}}
+    dropped = {"local": [], "remote": []}
+    results = []
+    copies = []
+    journals = {side: folder.get_transfer_journal() for side, folder in folders.items()}
+    stores = {side: folder.get_pack_store() for side, folder in folders.items()}
+    packed = {side: set(store.get_file_info([action["path"] for action in plan])) if store is not None else set()
+              for side, store in stores.items()}
+    packs = {"local": [], "remote": []} # (index, source path, filename, expected hash) to append to the target's packs
+    unpacks = {"local": [], "remote": []} # (index, filename, target path, expected hash) to read from the source's packs
+    algorithm = local_folder.get_hash_algorithm()
+    for index, action in enumerate(plan):
+        result = {"action": action["action"], "path": action["path"], "target": action["target"],
+                  "result": "skipped", "strategy": None, "size": None, "throughput": None, "written": None,
+                  "seconds": None, "ended": None, "error": None}
+        results.append(result)
+        if action["action"] == "conflict":
+            continue
+        filename = action["path"]
+        target = folders[action["target"]]
+        source = folders[other_side[action["target"]]]
+        try:
+            if action["action"] == "delete":
+                if not _unchanged_since_scan(target, filename, action["source"]):
+                    result["error"] = "changed since the scan"
+                    continue
+                if filename in packed[action["target"]]:
+                    stores[action["target"]].remove([filename])
+                else:
+                    os.remove(os.path.join(target.get_path(), filename))
+                    _remove_empty_dirs(target.get_path(), filename.rpartition("/")[0])
+                dropped[action["target"]].append(filename)
+                dropped[other_side[action["target"]]].append(filename)
+                result["result"] = "done"
+                continue
+            if not _unchanged_since_scan(source, filename, action["source"]):
+                result["error"] = "changed since the scan"
+                continue
+            if action["action"] == "overwrite":
+                if not _unchanged_since_scan(target, filename, action["target_info"]):
+                    result["error"] = "changed since the scan"
+                    continue
+        except OSError as e:
+            _set_error(result, e)
+            continue
+        source_path = os.path.join(source.get_path(), filename)
+        target_path = os.path.join(target.get_path(), filename)
+        # checked before the target is replaced: a source changed since the scan doesn't overwrite it
+        expected_hash = action["source"]["hash"] if action["source"]["hash_algo"] == algorithm else None
+        if filename in packed[other_side[action["target"]]]:
+            unpacks[other_side[action["target"]]].append((index, filename, target_path, expected_hash))
+        elif target.get_pack_mode() and action["size"] < PACK_MAX_FILE_SIZE:
+            packs[action["target"]].append((index, source_path, filename, expected_hash))
+        else:
+            copies.append((index, source_path, target_path, action["size"], journals[action["target"]], expected_hash))
+    started = time.monotonic()
+    transfers = itertools.chain(executor.copy_files(copies, algorithm=algorithm),
+                                *(stores[side].pack_files(packs[side], algorithm) for side in folders if packs[side]),
+                                *(stores[side].unpack_files(unpacks[side], algorithm) for side in folders if unpacks[side]))
+    for index, copied, error in transfers:
+        action = plan[index]
+        filename = action["path"]
+        if error is not None:
+            _set_error(results[index], error)
+            continue
+        synced = dict(action["source"], status="synced", last_sync=now)
+        if copied["hash"]:
+            if synced["hash_algo"] != algorithm:
+                synced["fingerprint"] = copied["hash"] if copied["size"] <= FINGERPRINT_FULL_SIZE else None
+            synced.update(hash=copied["hash"], hash_algo=algorithm)
+        results[index]["result"] = "done"
+        results[index]["strategy"] = copied["strategy"]
+        results[index]["size"] = copied["size"]
+        results[index]["seconds"] = copied["seconds"]
+        results[index]["ended"] = time.monotonic() - started
+        results[index]["throughput"] = copied["throughput"]
+        results[index]["written"] = copied["written"]
+        if filename in packed[action["target"]] and copied["strategy"] != "pack":
+            # stored natively now: its packed copy is stale
+            stores[action["target"]].remove([filename])
+        updated[other_side[action["target"]]][filename] = synced
+        target_stat = folders[action["target"]].stat_files([filename]).get(filename, {})
+        updated[action["target"]][filename] = dict(synced, **target_stat)
+    for side, folder in folders.items():
+        if updated[side] or dropped[side]:
+            folder.save_tracking_entries(updated[side])
+            folder.delete_tracking_entries(dropped[side])
+    record_sync_base(local_folder, remote_folder)
+    drop_settled_deletions(local_folder, remote_folder)
+    for side, folder in folders.items():
+        if updated[side] or dropped[side]:
+            folder.update_merkle_tree()
+    if DEBUG:
+        print(f"Sync: {sum(result['result'] == 'done' for result in results)}/{len(results)} actions done")
+    return results
+
+
+def record_sync_base(local_folder, remote_folder):
+    """
+    Record as base_hash, on both sides, the content of every file now the same on both sides
+    (in a single streaming pass over the tracking files). Returns the number of files updated.
+    """
+    bases = {"local": {}, "remote": {}}
+    skip = f"NOT ({IN_SYNC_SQL}) OR ({BASE_RECORDED_SQL})"
+    for filename, local_info, remote_info in local_folder.iter_tracking_pairs(remote_folder, skip=skip):
+        if not (is_present(local_info) and is_present(remote_info)) or not same_content(local_info, remote_info):
+            continue
+        # the full hash, when one side has it
+        tag = content_tag(local_info if local_info["hash"] or not remote_info["hash"] else remote_info)
+        if tag is None:
+            continue
+        for side, info in (("local", local_info), ("remote", remote_info)):
+            if info["base_hash"] != tag:
+                bases[side][filename] = dict(info, base_hash=tag)
+    # written once the tracking files are no longer read
+    local_folder.save_tracking_entries(bases["local"])
+    remote_folder.save_tracking_entries(bases["remote"])
+    return len(bases["local"].keys() | bases["remote"].keys())
+
+
+def drop_settled_deletions(local_folder, remote_folder):
+    """
+    Drop, on both sides, the 'deleted' rows the sync no longer needs: the files now absent
+    from both sides (deleted on both, or deleted on one side and never tracked on the other).
+    A file deleted on one side only keeps its row until its deletion is propagated or its conflict solved.
+    Returns the number of files dropped.
+    """
+    folders = {"local": local_folder, "remote": remote_folder}
+    settled = set()
+    for side, other in (("local", "remote"), ("remote", "local")):
+        deleted = folders[side].get_deleted_entries()
+        other_infos = folders[other].get_tracking_entries(list(deleted))
+        settled.update(filename for filename in deleted
+                       if filename not in other_infos or other_infos[filename]["status"] == "deleted")
+    if settled:
+        # 'deleted' rows are not in the Merkle trees: they don't change
+        local_folder.delete_tracking_entries(settled)
+        remote_folder.delete_tracking_entries(settled)
+    return len(settled)
+
+
+def throughput_samples(results):
+    """
+    Overall throughput of the copies of execute_sync_plan() to each target:
+    {target: (bytes copied, seconds)}, the seconds being the time during which at least one
+    transfer to the target was running. Each file counts for its own transfer, [ended - seconds, ended]:
+    the copies run in parallel, but the packs and unpacks after them, and neither is charged the other's time.
+    """
+    intervals = {}
+    for result in results:
+        if result["result"] == "done" and result["ended"] is not None:
+            intervals.setdefault(result["target"], []).append((result["ended"] - result["seconds"], result["ended"],
+                                                               result["size"]))
+    samples = {}
+    for target, target_intervals in intervals.items():
+        size = seconds = 0
+        busy_until = None
+        for start, end, file_size in sorted(target_intervals):
+            size += file_size
+            if busy_until is None or start > busy_until:
+                seconds += end - start
+                busy_until = end
+            elif end > busy_until:
+                seconds += end - busy_until
+                busy_until = end
+        samples[target] = (size, seconds)
+    return samples
+
+
+def estimate_plan(plan, throughputs, max_items=10):
+    """
+    Cost of a sync plan, from the plan alone: {"summary": see summarize_plan,
+    "bytes": {target: bytes to copy}, "seconds": {target: estimated seconds, None if its throughput is unknown},
+    "total_seconds" (None if unknown), "largest": the 'max_items' largest copies}.
+    'throughputs': {target: bytes/s measured on its device, or None} (see models.DeviceThroughput).
+    """
+    copies = [action for action in plan if action["action"] in ("copy", "overwrite")]
+    target_bytes = dict.fromkeys(SYNC_TARGETS, 0)
+    for action in copies:
+        target_bytes[action["target"]] += action["size"] or 0
+    seconds = {}
+    for target, size in target_bytes.items():
+        throughput = throughputs.get(target)
+        seconds[target] = 0 if not size else (size / throughput if throughput else None)
+    known = [value for value in seconds.values() if value is not None]
+    return {"summary": summarize_plan(plan),
+            "bytes": target_bytes,
+            "seconds": seconds,
+            "total_seconds": sum(known) if len(known) == len(seconds) else None,
+            "largest": sorted(copies, key=lambda action: action["size"] or 0, reverse=True)[:max_items]}
+
+
+def format_duration(seconds):
+    if seconds < 1:
+        return "< 1 s"
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds // 60:.0f} min {seconds % 60:02.0f} s"
+    return f"{seconds // 3600:.0f} h {seconds % 3600 // 60:02.0f} min"
+
+
+def _format_estimate(estimate):
+    if estimate["total_seconds"] is not None:
+        return f"estimated {format_duration(estimate['total_seconds'])}"
+    return "duration unknown (no sync measured yet on " + \
+        " / ".join(target for target, value in estimate["seconds"].items() if value is None) + ")"
+
+
+def _set_error(result, error):
+    result["result"] = "error"
+    result["error"] = str(error)
+    print(f"Sync error on {result['path']}: {error}")
+
+
+def _unchanged_since_scan(folder, filename, info):
+    current = folder.stat_files([filename]).get(filename)
+    return current is not None and folder.is_unchanged(info, current)
+
+
+def format_plan_summary(plan, estimate=None):
+    summary = summarize_plan(plan)
+    text = (f"{summary['copy']} copies, {summary['overwrite']} overwrites, {summary['delete']} deletions, "
+            f"{summary['conflict']} conflicts (left untouched)")
+    if estimate is not None:
+        text += f", {format_size(summary['bytes'])} to copy, {_format_estimate(estimate)}"
+    return text
+
+
+def format_dry_run(plan, estimate):
+    """
+    Plain text report of a sync plan and its estimate_plan() cost, nothing being synced.
+    """
+    if not plan:
+        return "Nothing to sync: both sides are identical."
+    lines = [format_plan_summary(plan, estimate), ""]
+    for target in SYNC_TARGETS:
+        if estimate["bytes"][target]:
+            seconds = estimate["seconds"][target]
+            lines.append(f"-> {target}: {format_size(estimate['bytes'][target])}"
+                         + (f", estimated {format_duration(seconds)}" if seconds is not None else ", throughput unknown"))
+    if estimate["largest"]:
+        lines += ["", "Largest copies:"]
+        lines += [f"  {format_size(action['size'] or 0):>10}  {action['path']} -> {action['target']}"
+                  for action in estimate["largest"]]
+    lines += ["", "Plan:"]
+    for action in plan:
+        line = f"  {action['action']} {action['path']}"
+        if action["target"]:
+            line += f" -> {action['target']}"
+        if action["action"] in ("copy", "overwrite"):
+            line += f" ({format_size(action['size'] or 0)})"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def format_sync_report(results):
+    """
+    Plain text report of execute_sync_plan() results.
+    """
+    if not results:
+        return "Nothing to sync: both sides are identical."
+    counts = {}
+    for result in results:
+        counts[result["result"]] = counts.get(result["result"], 0) + 1
+    lines = [", ".join(f"{count} {name}" for name, count in sorted(counts.items())), ""]
+    for result in results:
+        line = f"[{result['result']}] {result['action']} {result['path']}"
+        if result["target"]:
+            line += f" -> {result['target']}"
+        if result["strategy"]:
+            line += f" ({result['strategy']}, {format_size(result['throughput'])}/s"
+            if result["strategy"].startswith("delta"):
+                line += f", {format_size(result['written'])} written"
+            line += ")"
+        if result["error"]:
+            line += f": {result['error']}"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    print(">> Testing sync.py <<")
+    import tempfile
+    from models import FolderModel
+
+    # a default sync (verify mode "hash") must still use the kernel copy strategies
+    with tempfile.TemporaryDirectory() as local_path, tempfile.TemporaryDirectory() as remote_path:
+        with open(os.path.join(local_path, "file.bin"), "wb") as f:
+            f.write(os.urandom(4 * 1024 * 1024))
+        local_folder, remote_folder = FolderModel(local_path), FolderModel(remote_path)
+        local_folder.scan_folder()
+        remote_folder.scan_folder()
+        plan = build_sync_plan(local_folder, remote_folder)
+        print(format_plan_summary(plan))
+        results = execute_sync_plan(plan, local_folder, remote_folder)
+        print(format_sync_report(results))
+        assert all(result["result"] == "done" for result in results)
+        if hasattr(os, "copy_file_range") or hasattr(os, "sendfile"):
+            assert results[0]["strategy"] != "userspace", "kernel copy strategies unused"
+
+    # a side that never tracked the files gets them copied: a missing row is not a deletion
+    with tempfile.TemporaryDirectory() as local_path, tempfile.TemporaryDirectory() as remote_path, \
+         tempfile.TemporaryDirectory() as empty_path:
+        for i in range(3):
+            with open(os.path.join(local_path, f"f{i}"), "w") as f:
+                f.write(f"content {i}")
+        local_folder, remote_folder = FolderModel(local_path), FolderModel(remote_path)
+        local_folder.scan_folder()
+        remote_folder.scan_folder()
+        execute_sync_plan(build_sync_plan(local_folder, remote_folder), local_folder, remote_folder)
+        empty_folder = FolderModel(empty_path)
+        empty_folder.scan_folder()
+        plan = build_sync_plan(local_folder, empty_folder) # empty remote
+        assert [(a["action"], a["path"], a["target"]) for a in plan] == [("copy", f"f{i}", "remote") for i in range(3)], plan
+        plan = build_sync_plan(empty_folder, remote_folder) # empty local
+        assert [(a["action"], a["path"], a["target"]) for a in plan] == [("copy", f"f{i}", "local") for i in range(3)], plan
+        # a real deletion is still propagated, even after several scans
+        os.remove(os.path.join(remote_path, "f0"))
+        for _ in range(2):
+            local_folder.scan_folder()
+            remote_folder.scan_folder()
+        plan = build_sync_plan(local_folder, remote_folder)
+        assert [(a["action"], a["path"], a["target"]) for a in plan] == [("delete", "f0", "local")], plan
+        execute_sync_plan(plan, local_folder, remote_folder)
+        assert not os.path.exists(os.path.join(local_path, "f0"))
+        assert "f0" not in local_folder.get_tracking_data() and "f0" not in remote_folder.get_tracking_data()
+    print("OK")
@@ -0,0 +1,168 @@
+# coding: utf-8
+DEBUG=False
+
+import hashlib
+import os
+import re
+
+
+# IGNORE RULES
+# Règles d'exclusion d'un dossier suivi, en syntaxe .gitignore :
+#   "# commentaire", "!motif" (ré-inclusion), "motif/" (dossiers seulement),
+#   "/motif" ou "a/b" (ancré à la racine), "*", "?", "[abc]", "**".
+# Les règles sont compilées une seule fois en quelques expressions régulières ;
+# le scanner les consulte avant de descendre dans un dossier, pour élaguer
+# des sous-arbres entiers (node_modules, .git...) au lieu de filtrer après coup.
+
+SYNCIGNORE_FILENAME = ".syncignore"
+
+
+def translate_pattern(pattern):
+    """
+    Translate a gitignore glob (without '!' and trailing '/') into a regex body.
+    """
+    out = []
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern[i:i+3] == "**/":
+                out.append("(?:.*/)?") # zero or more directories
+                i += 3
+                continue
+            if pattern[i:i+2] == "**":
+                out.append(".*")
+                i += 2
+                continue
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i+2 if pattern[i+1:i+2] in ("!", "^") else i+1)
+            if end < 0:
+                out.append(re.escape(c))
+            else:
+                content = pattern[i+1:end].replace("\\", "\\\\")
+                if content[:1] in ("!", "^"):
+                    content = "^" + content[1:]
+                out.append(f"(?!/)[{content}]")
+                i = end
+        elif c == "\\" and i+1 < n:
+            i += 1
+            out.append(re.escape(pattern[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def parse_line(line):
+    """
+    Parse one line of a .syncignore file.
+    Returns (regex, negate, dir_only), or None for blank lines and comments.
+    """
+    line = line.rstrip("\n\r")
+    # trailing spaces are ignored unless escaped
+    while line.endswith(" ") and not line.endswith("\\ "):
+        line = line[:-1]
+    if not line or line.startswith("#"):
+        return None
+    negate = line.startswith("!")
+    if negate:
+        line = line[1:]
+    elif line.startswith("\\!") or line.startswith("\\#"):
+        line = line[1:]
+    dir_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    # a slash at the beginning or in the middle anchors the pattern to the root
+    anchored = "/" in line
+    line = line.lstrip("/")
+    body = translate_pattern(line)
+    regex = ("^" if anchored else "^(?:.*/)?") + body + "$"
+    return regex, negate, dir_only
+
+
+class IgnoreRules:
+    """
+    Compiled set of ignore rules.
+    As in git, the last matching rule wins, and a file inside an ignored directory
+    stays ignored whatever the later rules say (the directory is never walked).
+    """
+    def __init__(self, lines=()):
+        self.__lines = [line.rstrip("\n\r") for line in lines]
+        rules = [rule for rule in map(parse_line, self.__lines) if rule is not None]
+        # consecutive rules with the same (negate, dir_only) are merged in a single regex,
+        # then the groups are tried from the last one: the first group matching decides
+        self.__groups = []
+        for regex, negate, dir_only in rules:
+            if self.__groups and self.__groups[-1][1:] == (negate, dir_only):
+                self.__groups[-1][0].append(regex)
+            else:
+                self.__groups.append(([regex], negate, dir_only))
+        self.__groups = [(re.compile("|".join(f"(?:{regex})" for regex in regexes)), negate, dir_only)
+                         for regexes, negate, dir_only in reversed(self.__groups)]
+
+    @classmethod
+    def from_file(cls, filepath, defaults=()):
+        """
+        Load the rules from a .syncignore file, after the 'defaults' rules.
+        A missing file means only the defaults.
+        """
+        if not filepath or not os.path.isfile(filepath):
+            return cls(defaults)
+        with open(filepath, encoding="utf-8") as f:
+            return cls(list(defaults) + f.readlines())
+
+    def __bool__(self):
+        return bool(self.__groups)
+
+    def get_digest(self):
+        """
+        Fingerprint of the rules, to detect when they changed between two scans.
+        """
+        return hashlib.sha256("\n".join(self.__lines).encode()).hexdigest()
+
+    def match(self, rel_path, is_dir=False):
+        """
+        True if the entry 'rel_path' itself is ignored (its parents are not checked).
+        This is what the scanner uses, since it never walks ignored directories.
+        """
+        for regex, negate, dir_only in self.__groups:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                return not negate
+        return False
+
+    def is_ignored(self, rel_path, is_dir=False):
+        """
+        True if 'rel_path' or any of its parent directories is ignored.
+        """
+        parts = rel_path.split("/")
+        for i in range(1, len(parts)):
+            if self.match("/".join(parts[:i]), is_dir=True):
+                return True
+        return self.match(rel_path, is_dir=is_dir)
+
+
+if __name__ == "__main__":
+    print(">> Testing syncignore.py <<")
+
+    rules = IgnoreRules([
+        "# build outputs",
+        "node_modules/",
+        ".git/",
+        "*.swp",
+        "/build",
+        "docs/**/*.tmp",
+        "*.log",
+        "!keep.log",
+    ])
+    for path, is_dir in [("node_modules", True), ("a/node_modules", True), ("node_modules", False),
+                         ("x.swp", False), ("a/b/.x.swp", False), ("build", True), ("a/build", True),
+                         ("docs/a/b/c.tmp", False), ("docs/c.tmp", False), ("debug.log", False),
+                         ("keep.log", False), ("a/node_modules/x.js", False)]:
+        print(f"{path!r:28} dir={is_dir!s:5} ignored={rules.is_ignored(path, is_dir)}")
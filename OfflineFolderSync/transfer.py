@@ -0,0 +1,517 @@
+# coding: utf-8
+DEBUG=False
+
+import errno
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from delta import delta_copy, DELTA_MIN_SIZE
+from hashing import get_hasher, compute_file_hash
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+
+# FILE TRANSFER
+# Copie d'un fichier d'un côté à l'autre d'un dossier suivi, par la méthode la moins coûteuse :
+#   "reflink"         : clone copy-on-write (ioctl FICLONE, btrfs/XFS...), quand source et
+#                       destination sont sur le même système de fichiers : aucune donnée copiée
+#   "copy_file_range" : copie faite par le noyau, sans passer par Python
+#   "sendfile"        : idem, pour les noyaux ou systèmes de fichiers sans copy_file_range
+#   "userspace"       : readinto dans un buffer réutilisé puis écriture, partout ailleurs
+# Pas de lien physique (hardlink) : la "copie" partagerait l'inode de l'original,
+# et une modification locale altérerait aussi la sauvegarde.
+# La copie est écrite dans un fichier temporaire, renommé une fois complet.
+# Un gros fichier dont une ancienne version est déjà à destination n'est pas recopié en entier :
+# seuls ses blocs modifiés sont écrits (delta.py).
+# Vérification : la copie peut hacher les données au passage ("hash"), sans relire la source ;
+# l'empreinte obtenue est comparée à celle du scan. Les stratégies du noyau (reflink,
+# copy_file_range, sendfile) restent utilisées : le fichier temporaire est alors haché après la copie,
+# depuis le cache du système le plus souvent. "readback" relit en plus la destination
+# depuis le disque (cache du système vidé) pour vérifier ce qui a vraiment été écrit.
+# Un très gros fichier est copié par morceaux dans un fichier partiel nommé ; après chaque morceau,
+# la position atteinte et l'empreinte du morceau sont notées dans le fichier de suivi de la destination
+# (voir models.TransferJournal) : après un disque débranché ou un plantage, la copie suivante
+# vérifie les morceaux déjà écrits et reprend là où elle s'était arrêtée.
+# Chaque copie mesure son débit, à comparer à shutil.copyfile avec bench_transfer.py.
+# CopyExecutor copie plusieurs fichiers en parallèle, avec un plafond global d'octets
+# en cours de copie et un nombre de copies simultanées réglable par périphérique
+# de destination (un disque dur veut 1 ou 2 copies à la fois, une mémoire flash bien plus).
+
+COPY_STRATEGIES = ("reflink", "copy_file_range", "sendfile", "userspace")
+# "none": no check, "hash": hash while copying, "readback": also hash the destination as read back from the disk
+VERIFY_MODES = ("none", "hash", "readback")
+DEFAULT_VERIFY_MODE = "hash"
+# ioctl number of FICLONE (linux/fs.h)
+FICLONE = 0x40049409
+# Userspace copy buffer
+COPY_BUFFER_SIZE = 1024 * 1024
+# copy_file_range and sendfile chunk (the syscalls may copy less than asked for)
+COPY_RANGE_CHUNK = 64 * 1024 * 1024
+# Temporary name of a file being copied (in the destination directory)
+TEMP_SUFFIX = ".ofs-tmp"
+# Name of a resumable copy in progress (kept if the copy is interrupted)
+PARTIAL_SUFFIX = ".ofs-partial"
+# Files in progress, never synced (see syncignore.IgnoreRules)
+TRANSFER_IGNORE_PATTERNS = (f"*{TEMP_SUFFIX}", f"*{PARTIAL_SUFFIX}")
+# Copies of files from this size can be resumed, the progress being saved every chunk
+RESUMABLE_MIN_SIZE = 256 * 1024 * 1024
+RESUME_CHUNK_SIZE = 64 * 1024 * 1024
+# Copy executor defaults
+DEFAULT_COPY_WORKERS = 8
+DEFAULT_MAX_BYTES_IN_FLIGHT = 256 * 1024 * 1024
+DEFAULT_DEVICE_CONCURRENCY = 4
+# errors meaning "this strategy is not available here", not "the copy failed"
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY,
+                       getattr(errno, "ENOTSUP", errno.EOPNOTSUPP), errno.EBADF}
+
+
+def same_filesystem(src_path, dst_path):
+    """
+    True if 'src_path' and the directory of 'dst_path' are on the same filesystem.
+    """
+    try:
+        return os.stat(src_path).st_dev == os.stat(os.path.dirname(dst_path) or ".").st_dev
+    except OSError:
+        return False
+
+
+def _copy_reflink(fsrc, fdst, size):
+    if fcntl is None or not sys.platform.startswith("linux"):
+        raise OSError(errno.ENOTSUP, "reflink not supported on this platform")
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_file_range(fsrc, fdst, size):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range not available")
+    copied = 0
+    while copied < size:
+        count = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(COPY_RANGE_CHUNK, size - copied))
+        if count == 0: # source shrank while copying
+            break
+        copied += count
+
+
+def _copy_sendfile(fsrc, fdst, size):
+    if not hasattr(os, "sendfile"):
+        raise OSError(errno.ENOSYS, "sendfile not available")
+    copied = 0
+    while copied < size:
+        count = os.sendfile(fdst.fileno(), fsrc.fileno(), copied, min(COPY_RANGE_CHUNK, size - copied))
+        if count == 0: # source shrank while copying
+            break
+        copied += count
+
+
+_thread_buffers = threading.local()
+
+
+def _get_copy_buffer():
+    # one buffer per thread, reused from one file to the next
+    buffer = getattr(_thread_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _thread_buffers.buffer = memoryview(bytearray(COPY_BUFFER_SIZE))
+    return buffer
+
+
+def _copy_userspace(fsrc, fdst, size, hasher=None):
+    buffer = _get_copy_buffer()
+    while nbytes := fsrc.readinto(buffer):
+        fdst.write(buffer[:nbytes])
+        if hasher is not None:
+            hasher.update(buffer[:nbytes])
+
+
+def _copy_chunk(fsrc, fdst, count, hashers):
+    """
+    Copy up to 'count' bytes from 'fsrc' to 'fdst' (None: only read them), feeding 'hashers'.
+    Returns the bytes copied (fewer at the end of 'fsrc').
+    """
+    buffer = _get_copy_buffer()
+    copied = 0
+    while copied < count:
+        nbytes = fsrc.readinto(buffer[:min(len(buffer), count - copied)])
+        if not nbytes:
+            break
+        if fdst is not None:
+            fdst.write(buffer[:nbytes])
+        for hasher in hashers:
+            hasher.update(buffer[:nbytes])
+        copied += nbytes
+    return copied
+
+
+def _chunk_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+_COPY_FUNCTIONS = {
+    "reflink": _copy_reflink,
+    "copy_file_range": _copy_file_range,
+    "sendfile": _copy_sendfile,
+    "userspace": _copy_userspace,
+}
+
+
+def copy_file(src_path, dst_path, strategies=COPY_STRATEGIES, delta_min_size=None, algorithm=None, readback=False,
+              journal=None, expected_hash=None):
+    """
+    Copy the file 'src_path' to 'dst_path' (created or replaced), with its mtime and mode.
+    The 'strategies' are tried in order; reflink is only tried if both paths
+    are on the same filesystem. Missing destination directories are created.
+    If 'dst_path' exists and 'src_path' is at least 'delta_min_size' bytes, only the changed
+    blocks are written when that is worth it (strategy "delta-inplace" or "delta", see delta.py).
+    With an 'algorithm', the data copied is hashed: on the way by the userspace strategy, after the copy
+    (before the rename) by the kernel ones, which don't go through Python; with 'readback',
+    the destination is then read back from the disk and must have the same hash.
+    If the data copied doesn't have 'expected_hash' (the hash of the source when it was scanned),
+    the source changed meanwhile: the copy is dropped before replacing 'dst_path' and OSError is raised.
+    With a 'journal' (models.TransferJournal of the destination folder), files of RESUMABLE_MIN_SIZE
+    or more are copied by chunks and resume after an interruption (strategy "resumable" or "resumed").
+    Returns {"strategy", "size", "written", "seconds", "throughput", "hash"}: the strategy that did
+    the copy, the size of the file, the bytes written, how long the copy took, its throughput (bytes/s)
+    and the hash of the data copied ("" without 'algorithm').
+    Raises OSError if the copy failed.
+    """
+    start = time.perf_counter()
+    dst_dir = os.path.dirname(dst_path)
+    if dst_dir:
+        os.makedirs(dst_dir, exist_ok=True)
+    temp_path = os.path.join(dst_dir, f".{os.path.basename(dst_path)}{TEMP_SUFFIX}")
+    hasher = get_hasher(algorithm) if algorithm else None
+    if delta_min_size is not None and os.path.isfile(dst_path) and os.path.getsize(src_path) >= delta_min_size:
+        result = delta_copy(src_path, dst_path, temp_path, hasher=hasher, expected_hash=expected_hash,
+                            clone=_copy_reflink)
+        if result is not None:
+            return _checked(result, dst_path, hasher, algorithm, readback, start)
+        hasher = get_hasher(algorithm) if algorithm else None
+    if journal is not None and os.path.getsize(src_path) >= RESUMABLE_MIN_SIZE:
+        result = _copy_resumable(src_path, dst_path, journal, hasher, expected_hash)
+        return _checked(result, dst_path, hasher, algorithm, readback, start)
+    strategies = [strategy for strategy in strategies
+                  if strategy != "reflink" or same_filesystem(src_path, dst_path)]
+    if not strategies:
+        # e.g. only reflink was asked for, across filesystems
+        raise OSError(errno.EXDEV, f"No copy strategy applies from {src_path} to {dst_path}")
+    try:
+        with open(src_path, "rb") as fsrc, open(temp_path, "wb") as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            for strategy in strategies:
+                try:
+                    if strategy == "userspace":
+                        _copy_userspace(fsrc, fdst, size, hasher)
+                    else:
+                        _COPY_FUNCTIONS[strategy](fsrc, fdst, size)
+                    break
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED_ERRNOS or strategy == strategies[-1]:
+                        raise
+                    if DEBUG:
+                        print(f"{strategy} unavailable for {src_path}: {e}")
+                    # start over with the next strategy
+                    fsrc.seek(0)
+                    fdst.seek(0)
+                    fdst.truncate()
+                    hasher = get_hasher(algorithm) if algorithm else None
+        file_hash = ""
+        if hasher is not None:
+            # the kernel strategies don't go through Python: hash what they wrote
+            file_hash = hasher.hexdigest() if strategy == "userspace" else compute_file_hash(temp_path, algorithm=algorithm)
+            _check_source_hash(file_hash, expected_hash)
+        shutil.copystat(src_path, temp_path)
+        os.replace(temp_path, dst_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    result = _checked({"strategy": strategy, "size": size, "written": size, "hash": file_hash}, dst_path, hasher,
+                      algorithm, readback, start)
+    if DEBUG:
+        print(f"Copied {src_path} -> {dst_path} ({strategy}, {size} bytes, {result['throughput'] / 1024**2:.0f} MiB/s)")
+    return result
+
+
+def _check_source_hash(file_hash, expected_hash):
+    if expected_hash and file_hash != expected_hash:
+        raise OSError("source changed during the copy")
+
+
+def _verify_partial(partial_path, chunk_hashes, hasher):
+    """
+    Check the chunks of a partial file against their journaled hashes.
+    Returns the offset of the end of the verified chunks, and the new 'hasher'
+    fed with them (the state of a hashlib object can't be rolled back).
+    """
+    offset = 0
+    with open(partial_path, "rb") as f:
+        for expected in chunk_hashes:
+            chunk_hasher = _chunk_hasher()
+            candidate = hasher.copy() if hasher is not None else None
+            copied = _copy_chunk(f, None, RESUME_CHUNK_SIZE, [h for h in (chunk_hasher, candidate) if h is not None])
+            if copied == 0 or chunk_hasher.hexdigest() != expected:
+                break
+            offset += copied
+            hasher = candidate
+    return offset, hasher
+
+
+def _copy_resumable(src_path, dst_path, journal, hasher, expected_hash=None):
+    """
+    Copy by chunks into a partial file, saving the progress in 'journal' after each chunk,
+    and resume from a previous partial file when its chunks are still valid.
+    A partial file without 'expected_hash' is deleted, not renamed.
+    """
+    partial_path = os.path.join(os.path.dirname(dst_path), f".{os.path.basename(dst_path)}{PARTIAL_SUFFIX}")
+    with open(src_path, "rb") as fsrc:
+        src_stat = os.fstat(fsrc.fileno())
+        entry = journal.load(dst_path)
+        chunk_hashes = []
+        offset = 0
+        if entry is not None and os.path.exists(partial_path) and \
+           (entry["size"], entry["mtime_ns"], entry["chunk_size"]) == (src_stat.st_size, src_stat.st_mtime_ns, RESUME_CHUNK_SIZE):
+            verified, verified_hasher = _verify_partial(partial_path, entry["chunk_hashes"], hasher)
+            if verified:
+                offset = verified
+                chunk_hashes = entry["chunk_hashes"][:-(-verified // RESUME_CHUNK_SIZE)]
+                if hasher is not None:
+                    hasher = verified_hasher
+        resumed = offset
+        with open(partial_path, "r+b" if offset else "wb") as fdst:
+            fdst.truncate(offset)
+            fdst.seek(offset)
+            fsrc.seek(offset)
+            while offset < src_stat.st_size:
+                chunk_hasher = _chunk_hasher()
+                copied = _copy_chunk(fsrc, fdst, RESUME_CHUNK_SIZE, [h for h in (chunk_hasher, hasher) if h is not None])
+                if copied == 0: # source shrank while copying
+                    break
+                # the chunk must be on the disk before the journal says so
+                fdst.flush()
+                os.fsync(fdst.fileno())
+                offset += copied
+                chunk_hashes.append(chunk_hasher.hexdigest())
+                journal.save(dst_path, {"size": src_stat.st_size, "mtime_ns": src_stat.st_mtime_ns,
+                                        "chunk_size": RESUME_CHUNK_SIZE, "offset": offset, "chunk_hashes": chunk_hashes})
+    if hasher is not None and expected_hash and hasher.hexdigest() != expected_hash:
+        os.remove(partial_path)
+        journal.clear(dst_path)
+        _check_source_hash(hasher.hexdigest(), expected_hash)
+    shutil.copystat(src_path, partial_path)
+    os.replace(partial_path, dst_path)
+    journal.clear(dst_path)
+    if DEBUG and resumed:
+        print(f"Resumed the copy of {src_path} at {resumed}/{src_stat.st_size} bytes")
+    return {"strategy": "resumed" if resumed else "resumable", "size": src_stat.st_size,
+            "written": src_stat.st_size - resumed, "hash": hasher.hexdigest() if hasher is not None else ""}
+
+
+def read_back_hash(file_path, algorithm):
+    """
+    Hash of 'file_path' as stored on the disk: the file is flushed, then dropped
+    from the system cache before being read (where posix_fadvise is available).
+    """
+    with open(file_path, "rb") as f:
+        os.fsync(f.fileno())
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    return compute_file_hash(file_path, algorithm=algorithm)
+
+
+def _checked(result, dst_path, hasher, algorithm, readback, start):
+    if "hash" not in result:
+        result["hash"] = hasher.hexdigest() if hasher is not None else ""
+    if readback and algorithm and read_back_hash(dst_path, algorithm) != result["hash"]:
+        raise OSError(errno.EIO, f"Copy verification failed: {dst_path} differs from its source on the disk")
+    result["seconds"] = time.perf_counter() - start
+    result["throughput"] = result["size"] / result["seconds"] if result["seconds"] > 0 else 0.0
+    return result
+
+
+def mount_point_of(path):
+    """
+    Mount point of the filesystem holding 'path' (or its nearest existing parent).
+    """
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def filesystem_type(path):
+    """
+    Type of the filesystem holding 'path' ("ext4", "vfat", "exfat"...), from /proc/mounts.
+    None where it can't be told (no /proc/mounts, e.g. Windows or macOS).
+    """
+    mount_point = mount_point_of(path)
+    for char in "\\ \t\n": # escaped in /proc/mounts as octal codes
+        mount_point = mount_point.replace(char, f"\\{ord(char):03o}")
+    try:
+        with open("/proc/mounts", encoding="utf-8") as mounts:
+            entries = [line.split() for line in mounts]
+    except OSError:
+        return None
+    fs_type = None
+    for entry in entries:
+        if len(entry) >= 3 and entry[1] == mount_point:
+            fs_type = entry[2] # the last mount on a mount point hides the earlier ones
+    return fs_type
+
+
+def device_of(path):
+    """
+    Device (st_dev) of 'path', or of its nearest existing parent.
+    """
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                raise
+            path = parent
+
+
+class CopyExecutor:
+    """
+    Copies files on a pool of threads, with:
+    - a global cap on the bytes being copied at once ('max_bytes_in_flight'); a file
+      larger than the cap is copied alone,
+    - a cap on the copies running at once on each destination device (see set_device_concurrency).
+    Each device's files are started in order; a file waiting for room doesn't hold back
+    the files of the other devices.
+    """
+    def __init__(self, max_workers=DEFAULT_COPY_WORKERS, max_bytes_in_flight=DEFAULT_MAX_BYTES_IN_FLIGHT,
+                 device_concurrency=DEFAULT_DEVICE_CONCURRENCY, delta_min_size=DELTA_MIN_SIZE,
+                 verify=DEFAULT_VERIFY_MODE):
+        self.__max_workers = None
+        self.set_max_workers(max_workers)
+        self.__max_bytes_in_flight = max_bytes_in_flight
+        self.__default_device_concurrency = device_concurrency
+        self.__device_concurrency = {} # st_dev -> concurrent copies
+        self.__delta_min_size = delta_min_size # None: always copy whole files
+        self.set_verify(verify)
+
+    def get_max_workers(self):
+        return self.__max_workers
+
+    def set_max_workers(self, max_workers):
+        """
+        Set the number of copy threads (None: the ThreadPoolExecutor default, min(32, cores + 4)).
+        """
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+        if max_workers < 1:
+            raise ValueError("Copy workers must be at least 1.")
+        self.__max_workers = max_workers
+
+    def get_max_bytes_in_flight(self):
+        return self.__max_bytes_in_flight
+
+    def set_max_bytes_in_flight(self, max_bytes_in_flight):
+        self.__max_bytes_in_flight = max_bytes_in_flight
+
+    def get_delta_min_size(self):
+        return self.__delta_min_size
+
+    def set_delta_min_size(self, delta_min_size):
+        self.__delta_min_size = delta_min_size
+
+    def get_verify(self):
+        return self.__verify
+
+    def set_verify(self, verify):
+        if verify not in VERIFY_MODES:
+            raise ValueError(f"Unknown verify mode: {verify}")
+        self.__verify = verify
+
+    def get_device_concurrency(self, path=None):
+        if path is None:
+            return self.__default_device_concurrency
+        return self.__device_concurrency.get(device_of(path), self.__default_device_concurrency)
+
+    def set_device_concurrency(self, path, concurrency):
+        """
+        Set how many files may be copied at once to the device holding 'path'
+        (e.g. 1 for a spinning disk, 8 or more for an SSD). path=None sets the default.
+        """
+        if concurrency < 1:
+            raise ValueError("Device concurrency must be at least 1.")
+        if path is None:
+            self.__default_device_concurrency = concurrency
+        else:
+            self.__device_concurrency[device_of(path)] = concurrency
+
+    def copy_files(self, copies, strategies=COPY_STRATEGIES, algorithm=None):
+        """
+        Copy 'copies', an iterable of (key, source path, destination path, size[, journal[, expected hash]]),
+        'journal' being the TransferJournal of the destination folder and 'expected hash' the scanned hash
+        of the source, checked before the destination is replaced (see copy_file).
+        The copies are hashed with 'algorithm' unless the verify mode is "none".
+        Yields (key, result, error) as the copies end (not in input order):
+        result is copy_file's {"strategy", "size", "written", "seconds", "throughput", "hash"},
+        or None if the copy failed with 'error' (OSError).
+        """
+        algorithm = algorithm if self.__verify != "none" else None
+        readback = self.__verify == "readback"
+        queues = {} # device -> deque of pending copies
+        for copy in copies:
+            queues.setdefault(device_of(copy[2]), deque()).append(copy)
+        if not queues:
+            return
+        running = {device: 0 for device in queues}
+        limits = {device: self.__device_concurrency.get(device, self.__default_device_concurrency)
+                  for device in queues}
+        bytes_in_flight = 0
+        pending = {} # future -> (copy, device)
+        pool = ThreadPoolExecutor(max_workers=self.__max_workers)
+        try:
+            while queues or pending:
+                # start every copy that fits
+                for device in list(queues):
+                    queue = queues[device]
+                    while queue and running[device] < limits[device] and len(pending) < self.__max_workers:
+                        size = queue[0][3] or 0
+                        if pending and bytes_in_flight + size > self.__max_bytes_in_flight:
+                            break
+                        copy = queue.popleft()
+                        pending[pool.submit(copy_file, copy[1], copy[2], strategies, self.__delta_min_size,
+                                             algorithm, readback, copy[4] if len(copy) > 4 else None,
+                                             copy[5] if len(copy) > 5 else None)] = (copy, device)
+                        running[device] += 1
+                        bytes_in_flight += size
+                    if not queue:
+                        del queues[device]
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    copy, device = pending.pop(future)
+                    running[device] -= 1
+                    bytes_in_flight -= copy[3] or 0
+                    try:
+                        yield copy[0], future.result(), None
+                    except OSError as e:
+                        yield copy[0], None, e
+        finally:
+            # on error (or if the caller stops early), don't start the remaining copies
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    print(">> Testing transfer.py <<")
+
+    if len(sys.argv) != 3:
+        print("Usage: python transfer.py <source file> <destination file>")
+        sys.exit(1)
+    print(copy_file(sys.argv[1], sys.argv[2]))
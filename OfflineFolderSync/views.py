@@ -15,7 +15,7 @@ if major < 3 or (major == 3 and minor < 6):
     raise ImportError("PyQt5 requires Python 3.6+")
 else:
     # Import PyQt5 modules
-    from PyQt5.QtWidgets import QApplication, QAction, QFileSystemModel, QMainWindow, QPushButton, QWidget, QHBoxLayout, QVBoxLayout, QLabel, QLineEdit, QGridLayout, QComboBox, QTreeView, QFileDialog, QMessageBox, QInputDialog, QDialogButtonBox, QDialog
+    from PyQt5.QtWidgets import QApplication, QAction, QFileSystemModel, QMainWindow, QPushButton, QWidget, QHBoxLayout, QVBoxLayout, QLabel, QLineEdit, QGridLayout, QComboBox, QTreeView, QFileDialog, QMessageBox, QInputDialog, QDialogButtonBox, QDialog, QPlainTextEdit
     # from PyQt5.QtCore import 
     from PyQt5.QtGui import QFont
     if __name__ == "__main__":
@@ -90,6 +90,7 @@ class MainWindow(QMainWindow):
         self.changepathbutton = QPushButton("Change Paths")
         self.changenamebutton = QPushButton("Change Name")
         self.changepathbutton.setEnabled(False) # disabled for now bcs feature not added yet
+        self.syncbutton = QPushButton("Sync")
         # Layout
         self.details_layout = QGridLayout()
         self.details_layout.addWidget(self.localpath_label, 0, 0)
@@ -98,6 +99,7 @@ class MainWindow(QMainWindow):
         self.details_layout.addWidget(self.remotepath, 1, 1)
         self.details_layout.addWidget(self.changenamebutton, 2, 0)
         self.details_layout.addWidget(self.changepathbutton, 2, 1)
+        self.details_layout.addWidget(self.syncbutton, 3, 0, 1, 2)
 
         ## LAYOUT
         self.mainwidget = QWidget()
@@ -112,6 +114,7 @@ class MainWindow(QMainWindow):
 
         menubar = self.menuBar()
         file_menu = menubar.addMenu('File')
+        tools_menu = menubar.addMenu('Tools')
         help_menu = menubar.addMenu('Help')
 
         # Add actions to the File menu
@@ -122,6 +125,10 @@ class MainWindow(QMainWindow):
         file_menu.addAction(self.remove_action)
         file_menu.addAction(self.edit_action)
 
+        # Add actions to the Tools menu
+        self.duplicates_action = QAction('Duplicates Report', self)
+        tools_menu.addAction(self.duplicates_action)
+
         # Add actions to the Help menu
         about_action = QAction('About', self)
         help_menu.addAction(about_action)
@@ -180,6 +187,7 @@ class MainWindow(QMainWindow):
         folder_selected = self.folderselector.currentText() != "" # True if a folder is selected, False if selection empty
         self.removefolderbutton.setEnabled(folder_selected)
         self.changenamebutton.setEnabled(folder_selected)
+        self.syncbutton.setEnabled(folder_selected)
         # self.changepathbutton.setEnabled(folder_selected) # disabled for now because feature not added yet
 
 ## PROMPTS
@@ -212,6 +220,10 @@ class MainWindow(QMainWindow):
             return None
         return foldername
 
+    def show_report(self, title, text):
+        dialog = ReportPopup(title=title, text=text)
+        dialog.exec()
+
 class ConfirmationPopup(QDialog):
     def __init__(self, action_description):
         super().__init__()
@@ -233,6 +245,24 @@ class ConfirmationPopup(QDialog):
         self.setLayout(layout)
 
 
+class ReportPopup(QDialog):
+    def __init__(self, title, text):
+        super().__init__()
+
+        self.setWindowTitle(title)
+        self.setMinimumSize(600, 400)
+
+        self.buttonBox = QDialogButtonBox(QDialogButtonBox.StandardButton.Close)
+        self.buttonBox.rejected.connect(self.reject)
+
+        layout = QVBoxLayout()
+        report = QPlainTextEdit(text)
+        report.setReadOnly(True)
+        layout.addWidget(report)
+        layout.addWidget(self.buttonBox)
+        self.setLayout(layout)
+
+
 
 
 if __name__ == "__main__":
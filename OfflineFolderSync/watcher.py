@@ -0,0 +1,276 @@
+# coding: utf-8
+DEBUG=False
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from scanner import scan_tree
+
+
+# FOLDER WATCHING
+# Surveillance d'un dossier suivi en tâche de fond :
+# chaque création / modification / suppression / déplacement est transmise
+# sous forme de "dirty paths" au callback 'journal' (FolderModel.record_dirty_paths),
+# pour qu'une synchro n'ait à traiter que ces chemins au lieu de reparcourir l'arbre.
+# Entrées du journal : (chemin relatif, kind, event)
+#   kind = "file"    : seul ce fichier est à revérifier
+#   kind = "subtree" : tout le sous-arbre est à rescanner (débordement, dossier déplacé...)
+
+
+# inotify constants (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+              | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    return _libc is not None
+
+
+def create_watcher(root, journal, exclude=(), ignore=None, interval=5.0):
+    """
+    Create the best watcher available on this system:
+    an InotifyWatcher on Linux, a PollingWatcher elsewhere.
+    """
+    if inotify_available():
+        return InotifyWatcher(root, journal, exclude=exclude, ignore=ignore)
+    return PollingWatcher(root, journal, exclude=exclude, ignore=ignore, interval=interval)
+
+
+class FolderWatcher(threading.Thread):
+    """
+    Base class of the watchers: a daemon thread reporting dirty paths of 'root'
+    to the 'journal' callback, as a list of (relative path, kind, event).
+    Paths matched by the 'ignore' rules are never reported.
+    """
+    def __init__(self, root, journal, exclude=(), ignore=None):
+        super().__init__(daemon=True)
+        self.root = root
+        self.journal = journal
+        self.exclude = set(exclude)
+        self.ignore = ignore
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def is_stopped(self):
+        return self._stop_event.is_set()
+
+    def report(self, entries):
+        entries = [entry for entry in entries if entry[0] not in self.exclude
+                   and not (self.ignore and entry[0] and self.ignore.is_ignored(entry[0], entry[1] == "subtree"))]
+        if entries:
+            if DEBUG:
+                print(f"{type(self).__name__}: {entries}")
+            self.journal(entries)
+
+
+class InotifyWatcher(FolderWatcher):
+    """
+    Linux watcher using inotify through ctypes.
+    One watch per directory; new directories are watched as they appear.
+    When the kernel queue overflows, the whole tree is reported for rescan.
+    When the watch limit is reached, the subtree that could not be watched is reported
+    as "unwatched", so that it gets rescanned at every sync instead.
+    """
+    def __init__(self, root, journal, exclude=(), ignore=None):
+        super().__init__(root, journal, exclude=exclude, ignore=ignore)
+        if _libc is None:
+            raise RuntimeError("inotify is not available on this system.")
+        self.__fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+        self.__watches = {} # watch descriptor -> relative directory path
+        self.__unwatched = self.__add_watches("") # reported once the thread runs
+
+    def __add_watch(self, rel_dir):
+        """
+        Watch a single directory. Returns False if the watch limit is reached.
+        """
+        path = os.path.join(self.root, rel_dir) if rel_dir else self.root
+        wd = _libc.inotify_add_watch(self.__fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                return False
+            # directory vanished or not readable: nothing to watch
+            if DEBUG:
+                print(f"Cannot watch {path}: {os.strerror(err)}")
+            return True
+        self.__watches[wd] = rel_dir
+        return True
+
+    def __add_watches(self, rel_dir):
+        """
+        Watch 'rel_dir' and all its subdirectories.
+        Returns the list of journal entries for the subtrees that could not be watched.
+        """
+        unwatched = []
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            if not self.__add_watch(current):
+                unwatched.append((current, "subtree", "unwatched"))
+                continue
+            path = os.path.join(self.root, current) if current else self.root
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            rel_path = f"{current}/{entry.name}" if current else entry.name
+                            # ignored directories are not watched: saves watches on node_modules & co
+                            if not (self.ignore and self.ignore.match(rel_path, is_dir=True)):
+                                stack.append(rel_path)
+            except OSError:
+                pass
+        if unwatched:
+            print(f"inotify watch limit reached: {len(unwatched)} subtree(s) of {self.root} will be rescanned instead.")
+        return unwatched
+
+    def __remove_subtree_watches(self, rel_dir):
+        prefix = rel_dir + "/"
+        for wd, watched in list(self.__watches.items()):
+            if watched == rel_dir or watched.startswith(prefix):
+                _libc.inotify_rm_watch(self.__fd, wd)
+                del self.__watches[wd]
+
+    def __read_events(self):
+        try:
+            data = os.read(self.__fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        entries = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset+length].rstrip(b"\0"))
+            offset += length
+            entries.extend(self.__handle_event(wd, mask, name))
+        return entries
+
+    def __handle_event(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            # events were lost: the whole tree must be rescanned
+            return [("", "subtree", "overflow")]
+        if mask & IN_IGNORED:
+            self.__watches.pop(wd, None)
+            return []
+        rel_dir = self.__watches.get(wd)
+        if rel_dir is None or not name:
+            return []
+        rel_path = f"{rel_dir}/{name}" if rel_dir else name
+        if self.ignore and self.ignore.is_ignored(rel_path, is_dir=bool(mask & IN_ISDIR)):
+            return []
+        if mask & IN_ISDIR:
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                # files may have been written before the new watches were added
+                return [(rel_path, "subtree", "created")] + self.__add_watches(rel_path)
+            if mask & IN_MOVED_FROM:
+                self.__remove_subtree_watches(rel_path)
+                return [(rel_path, "subtree", "moved_from")]
+            if mask & IN_DELETE:
+                return [(rel_path, "subtree", "deleted")]
+            return []
+        if mask & IN_CREATE:
+            return [(rel_path, "file", "created")]
+        if mask & IN_MOVED_TO:
+            return [(rel_path, "file", "moved_to")]
+        if mask & IN_MOVED_FROM:
+            return [(rel_path, "file", "moved_from")]
+        if mask & IN_DELETE:
+            return [(rel_path, "file", "deleted")]
+        if mask & (IN_MODIFY | IN_CLOSE_WRITE | IN_ATTRIB):
+            return [(rel_path, "file", "modified")]
+        return []
+
+    def run(self):
+        try:
+            self.report(self.__unwatched)
+            while not self.is_stopped():
+                readable, _, _ = select.select([self.__fd], [], [], 0.5)
+                if readable:
+                    self.report(self.__read_events())
+        finally:
+            os.close(self.__fd)
+
+
+class PollingWatcher(FolderWatcher):
+    """
+    Stdlib-only stand-in for systems without inotify:
+    rescans the stat manifest every 'interval' seconds and reports the files that differ.
+    """
+    def __init__(self, root, journal, exclude=(), ignore=None, interval=5.0):
+        super().__init__(root, journal, exclude=exclude, ignore=ignore)
+        self.interval = interval
+
+    def run(self):
+        previous = scan_tree(self.root, exclude=self.exclude, ignore=self.ignore)
+        while not self._stop_event.wait(self.interval):
+            try:
+                current = scan_tree(self.root, exclude=self.exclude, ignore=self.ignore)
+            except ValueError:
+                # folder unmounted: wait for it to come back
+                continue
+            entries = [(path, "file", "modified") for path, info in current.items()
+                       if previous.get(path) != info]
+            entries += [(path, "file", "deleted") for path in previous.keys() - current.keys()]
+            self.report(entries)
+            previous = current
+
+
+if __name__ == "__main__":
+    print(">> Testing watcher.py <<")
+
+    root = sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__))
+    watcher = create_watcher(root, print)
+    print(f"Watching {root} with {type(watcher).__name__} (Ctrl+C to stop)")
+    watcher.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+        watcher.join()